@@ -3,12 +3,13 @@ import argparse
 import asyncio
 import configparser
 import logging
+import mimetypes
 import os
 import re
 import signal
 import sys
+import tempfile
 import traceback
-import urllib.request
 from collections import OrderedDict
 from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
@@ -347,24 +348,25 @@ class ZulipToMatrix:
         success: bool = True
 
         for file in re.findall(r"\[[^\[\]]*\]\((/user_uploads/[^\(\)]*)\)", msg):
-            result: Dict[str, Any] = self.zulip_client.call_endpoint(file, method="GET")
-            if result["result"] != "success":
-                success = False
-                continue
-
-            try:
-                with urllib.request.urlopen(self.server_url + result["url"]) as response:  # noqa: S310
-                    file_content: bytes = response.read()
-                    mimetype: str = response.headers.get_content_type()
-            except Exception:
-                success = False
-                continue
-
             filename: str = file.split("/")[-1]
-
-            response, _ = await self.matrix_client.upload(
-                data_provider=BytesIO(file_content), content_type=mimetype, filename=filename
-            )
+            mimetype: str = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+
+            # Relay the file through a temporary file rather than memory.
+            with tempfile.TemporaryFile() as file_content:
+                try:
+                    self.zulip_client.download_attachment(file, file_content)
+                except Exception:
+                    success = False
+                    continue
+                filesize: int = file_content.tell()
+                file_content.seek(0)
+
+                response, _ = await self.matrix_client.upload(
+                    data_provider=file_content,
+                    content_type=mimetype,
+                    filename=filename,
+                    filesize=filesize,
+                )
             if isinstance(response, nio.UploadError):
                 success = False
                 continue
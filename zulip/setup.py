@@ -70,5 +70,9 @@ setup(
         "click",
         "typing_extensions>=4.5.0",
     ],
+    extras_require={
+        "async": ["aiohttp>=3.8"],
+        "orjson": ["orjson>=3"],
+    },
     packages=find_packages(exclude=["tests"]),
 )
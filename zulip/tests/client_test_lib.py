@@ -0,0 +1,107 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import TYPE_CHECKING, Any, Dict, Type
+from unittest import TestCase
+
+from typing_extensions import override
+
+import zulip
+
+if TYPE_CHECKING:
+    from zulip.async_client import AsyncClient
+
+
+# call_on_each_event retries after any Exception, so tests stop it with
+# something that isn't one.
+class StopConsumingError(BaseException):
+    pass
+
+
+def make_client(
+    email: str = "bot@example.com",
+    site: str = "https://zulip.example.com",
+    api_key: str = "key",
+    **kwargs: Any,
+) -> zulip.Client:
+    return zulip.Client(
+        email=email, api_key=api_key, site=site, config_file="/nonexistent", **kwargs
+    )
+
+
+def make_async_client(
+    email: str = "bot@example.com",
+    site: str = "https://zulip.example.com",
+    api_key: str = "key",
+    **kwargs: Any,
+) -> "AsyncClient":
+    # Imported here, so that tests of the blocking client don't need aiohttp.
+    from zulip.async_client import AsyncClient
+
+    return AsyncClient(
+        email=email, api_key=api_key, site=site, config_file="/nonexistent", **kwargs
+    )
+
+
+class StubServer(ThreadingHTTPServer):
+    """A local HTTP server, for tests that need real connections."""
+
+    daemon_threads = True
+
+    def __init__(self, handler: Type[BaseHTTPRequestHandler]) -> None:
+        super().__init__(("127.0.0.1", 0), handler)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def start(self, test: TestCase) -> None:
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        test.addCleanup(thread.join)
+        test.addCleanup(self.server_close)
+        test.addCleanup(self.shutdown)
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    @override
+    def log_message(self, format: str, *args: object) -> None:
+        pass
+
+
+def registered(queue_id: str = "1:1") -> Dict[str, Any]:
+    return {"result": "success", "queue_id": queue_id, "last_event_id": -1}
+
+
+def events_response(*events: Dict[str, Any]) -> Dict[str, Any]:
+    return {"result": "success", "msg": "", "events": list(events)}
+
+
+def stream_message(
+    message_id: int = 1,
+    stream: str = "Devel",
+    topic: str = "Bridge",
+    content: str = "<p>Hello world</p>",
+    **fields: Any,
+) -> Dict[str, Any]:
+    return {
+        "id": message_id,
+        "type": "stream",
+        "stream_id": 5,
+        "display_recipient": stream,
+        "subject": topic,
+        "content": content,
+        "sender_id": 8,
+        "sender_email": "iago@example.com",
+        "sender_full_name": "Iago",
+        "timestamp": 1704067200,
+        "flags": [],
+        "reactions": [],
+        **fields,
+    }
+
+
+def message_event(event_id: int, **fields: Any) -> Dict[str, Any]:
+    """A message event, for a message whose ID is `event_id` + 100."""
+    return {"id": event_id, "type": "message", "message": stream_message(100 + event_id, **fields)}
@@ -0,0 +1,159 @@
+import asyncio
+import base64
+import inspect
+import io
+from typing import Any, Dict, List
+from unittest import IsolatedAsyncioTestCase, TestCase
+from unittest.mock import patch
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from typing_extensions import override
+
+import zulip
+from zulip.async_client import AsyncClient
+
+from .client_test_lib import make_async_client
+
+
+class TestAsyncClientParity(TestCase):
+    def test_has_every_client_endpoint(self) -> None:
+        for name, method in inspect.getmembers(zulip.Client, inspect.isfunction):
+            if name.startswith("_") or name in (
+                # asyncio.gather does the job of Client.batch.
+                "batch",
+                "ensure_session",
+                "get_user_agent",
+                "invalidate_server_settings",
+            ):
+                continue
+            with self.subTest(method=name):
+                async_method = getattr(AsyncClient, name)
+                self.assertTrue(
+                    inspect.isasyncgenfunction(async_method)
+                    if inspect.isgeneratorfunction(method)
+                    else inspect.iscoroutinefunction(async_method)
+                )
+                self.assertEqual(
+                    list(inspect.signature(method).parameters),
+                    list(inspect.signature(async_method).parameters),
+                )
+
+    def test_lazy_export(self) -> None:
+        self.assertIs(zulip.AsyncClient, AsyncClient)
+
+
+class TestAsyncClient(IsolatedAsyncioTestCase):
+    @override
+    async def asyncSetUp(self) -> None:
+        self.requests: List[Dict[str, Any]] = []
+        self.fail_next = 0
+
+        async def handle(request: web.Request) -> web.Response:
+            if request.content_type == "multipart/form-data":
+                form = await request.post()
+                data = {key: getattr(val, "filename", val) for key, val in form.items()}
+            else:
+                data = dict(await request.post())
+            self.requests.append(
+                {
+                    "method": request.method,
+                    "path": request.path,
+                    "query": dict(request.query),
+                    "data": data,
+                    "auth": request.headers.get("Authorization"),
+                }
+            )
+            if self.fail_next > 0:
+                self.fail_next -= 1
+                return web.Response(status=502, text="Bad gateway")
+            if request.path == "/api/v1/events":
+                return web.json_response(
+                    {
+                        "result": "success",
+                        "msg": "",
+                        "events": [
+                            {"id": 0, "type": "heartbeat"},
+                            {"id": 1, "type": "message", "message": {"id": 10}},
+                        ],
+                    }
+                )
+            if request.path == "/api/v1/register":
+                return web.json_response(
+                    {"result": "success", "msg": "", "queue_id": "1:1", "last_event_id": -1}
+                )
+            return web.json_response({"result": "success", "msg": "", "id": len(self.requests)})
+
+        app = web.Application()
+        app.router.add_route("*", "/{tail:.*}", handle)
+        self.server = TestServer(app)
+        await self.server.start_server()
+        self.client = make_async_client(site=str(self.server.make_url("")))
+
+    @override
+    async def asyncTearDown(self) -> None:
+        await self.client.close()
+        await self.server.close()
+
+    async def test_send_message(self) -> None:
+        result = await self.client.send_message(
+            {"type": "stream", "to": ["devel"], "topic": "t", "content": "hi"}
+        )
+        self.assertEqual(result["result"], "success")
+        [request] = self.requests
+        self.assertEqual(request["method"], "POST")
+        self.assertEqual(request["path"], "/api/v1/messages")
+        self.assertEqual(request["data"]["to"], '["devel"]')
+        self.assertEqual(request["data"]["content"], "hi")
+        self.assertEqual(
+            request["auth"], "Basic " + base64.b64encode(b"bot@example.com:key").decode()
+        )
+
+    async def test_get_parameters(self) -> None:
+        await self.client.get_messages({"anchor": "newest", "num_before": 5, "num_after": 0})
+        await self.client.get_stream_id("a stream")
+        self.assertEqual(
+            self.requests[0]["query"], {"anchor": "newest", "num_before": "5", "num_after": "0"}
+        )
+        self.assertEqual(self.requests[1]["query"], {"stream": "a stream"})
+
+    async def test_upload_file(self) -> None:
+        fp = io.BytesIO(b"contents")
+        fp.name = "screenshots/file.txt"
+        await self.client.upload_file(fp)
+        [request] = self.requests
+        self.assertEqual(request["data"], {"screenshots/file.txt": "file.txt"})
+
+    async def test_concurrent_requests(self) -> None:
+        results = await asyncio.gather(
+            *(self.client.send_message({"type": "private", "to": [1]}) for _ in range(50))
+        )
+        self.assertEqual(len(results), 50)
+        self.assertEqual(len(self.requests), 50)
+
+    async def test_retry_on_server_error(self) -> None:
+        self.fail_next = 2
+        with patch("asyncio.sleep") as mock_sleep:
+            result = await self.client.get_profile()
+        self.assertEqual(result["result"], "success")
+        self.assertEqual(mock_sleep.call_count, 2)
+        self.assertEqual(len(self.requests), 3)
+        self.assertEqual(self.requests[2]["query"]["dont_block"], "true")
+
+    async def test_cannot_connect(self) -> None:
+        await self.server.close()
+        with self.assertRaises(zulip.UnrecoverableNetworkError):
+            await self.client.get_profile()
+
+    async def test_call_on_each_message(self) -> None:
+        received: List[Dict[str, Any]] = []
+
+        async def callback(message: Dict[str, Any]) -> None:
+            received.append(message)
+            raise asyncio.CancelledError
+
+        with self.assertRaises(asyncio.CancelledError):
+            await self.client.call_on_each_message(callback)
+        self.assertEqual(received, [{"id": 10}])
+        self.assertEqual(self.requests[0]["path"], "/api/v1/register")
+        self.assertEqual(self.requests[1]["query"], {"queue_id": "1:1", "last_event_id": "-1"})
@@ -0,0 +1,315 @@
+import hashlib
+import io
+import os
+import tempfile
+import time
+from typing import List, Optional
+from unittest import IsolatedAsyncioTestCase, TestCase
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import requests
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from typing_extensions import override
+
+import zulip
+from zulip.attachments import AttachmentCache, UploadIndex
+
+from .client_test_lib import StubHandler, StubServer, make_async_client, make_client
+
+CONTENTS = os.urandom(300_000)
+PATH = "/user_uploads/2/ab/cdef/cat.png"
+
+
+class TestAttachmentCache(TestCase):
+    @override
+    def setUp(self) -> None:
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.cache = AttachmentCache(os.path.join(self.directory, "cache"), max_size=250)
+
+    def put(self, path: str, contents: bytes) -> None:
+        with self.cache.writer(path) as writer:
+            writer.write(contents)
+
+    def get(self, path: str) -> Optional[bytes]:
+        cached = self.cache.open(path)
+        if cached is None:
+            return None
+        with cached:
+            return cached.read()
+
+    def test_cache(self) -> None:
+        self.assertIsNone(self.get("user_uploads/1/a.txt"))
+        self.put("user_uploads/1/a.txt", b"a" * 100)
+        # The same contents uploaded twice are stored once.
+        self.put("user_uploads/1/copy-of-a.txt", b"a" * 100)
+        self.assertEqual(len(os.listdir(self.cache.objects_directory)), 1)
+
+        filename = os.path.join(self.directory, "b.txt")
+        with open(filename, "wb") as f:
+            f.write(b"b" * 100)
+        self.cache.put("user_uploads/1/b.txt", filename)
+        self.assertEqual(self.get("user_uploads/1/b.txt"), b"b" * 100)
+
+        # Make b.txt the least recently used file, then go over max_size.
+        old = time.time() - 60
+        digest = hashlib.sha256(b"b" * 100).hexdigest()
+        os.utime(os.path.join(self.cache.objects_directory, digest), (old, old))
+        self.assertEqual(self.get("user_uploads/1/copy-of-a.txt"), b"a" * 100)
+        self.put("user_uploads/1/c.txt", b"c" * 100)
+        self.assertEqual(self.get("user_uploads/1/a.txt"), b"a" * 100)
+        self.assertIsNone(self.get("user_uploads/1/b.txt"))
+        self.assertEqual(self.get("user_uploads/1/c.txt"), b"c" * 100)
+
+    def test_abort(self) -> None:
+        with self.assertRaises(RuntimeError), self.cache.writer("user_uploads/1/a.txt") as writer:
+            writer.write(b"partial")
+            raise RuntimeError
+        self.assertIsNone(self.get("user_uploads/1/a.txt"))
+        self.assertEqual(os.listdir(self.cache.objects_directory), [])
+
+
+class UploadsServer(StubServer):
+    def __init__(self) -> None:
+        super().__init__(UploadsHandler)
+        # The Range header of each download request.
+        self.ranges: List[Optional[str]] = []
+        # Whether to break the connection halfway through the next download.
+        self.truncate = False
+        self.supports_range = True
+
+
+class UploadsHandler(StubHandler):
+    server: UploadsServer
+
+    def send(self, status: int, body: bytes, length: Optional[int] = None) -> None:
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body) if length is None else length))
+        if status == 206:
+            self.send_header("Content-Range", f"bytes {len(CONTENTS) - len(body)}-/{len(CONTENTS)}")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self) -> None:  # noqa: N802
+        if self.path.startswith("/api/v1/user_uploads/"):
+            if self.path.endswith("missing.png"):
+                self.send(400, b'{"result": "error", "msg": "Invalid filename"}')
+            else:
+                self.send(
+                    200, b'{"result": "success", "msg": "", "url": "/user_uploads/temporary/x"}'
+                )
+            return
+
+        self.server.ranges.append(self.headers["Range"])
+        body = CONTENTS
+        status = 200
+        if self.headers["Range"] is not None and self.server.supports_range:
+            body = CONTENTS[int(self.headers["Range"][len("bytes=") : -len("-")]) :]
+            status = 206
+        if self.server.truncate:
+            self.server.truncate = False
+            self.close_connection = True
+            self.send(status, body[: len(body) // 2], length=len(body))
+            return
+        self.send(status, body)
+
+
+@patch("time.sleep")
+class TestDownloadAttachment(TestCase):
+    @override
+    def setUp(self) -> None:
+        self.server = UploadsServer()
+        self.server.start(self)
+        self.client = make_client(site=self.server.url)
+        self.client.rate_limiter = zulip.RateLimiter()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def test_resume(self, mock_sleep: MagicMock) -> None:
+        for supports_range in [True, False]:
+            with self.subTest(supports_range=supports_range):
+                self.server.ranges.clear()
+                self.server.supports_range = supports_range
+                self.server.truncate = True
+                chunks = list(self.client.iter_attachment(self.server.url + PATH, chunk_size=4096))
+                self.assertLessEqual(max(len(chunk) for chunk in chunks), 4096)
+                self.assertEqual(b"".join(chunks), CONTENTS)
+                self.assertEqual(len(self.server.ranges), 2)
+                self.assertIsNone(self.server.ranges[0])
+                self.assertRegex(self.server.ranges[1] or "", r"^bytes=[1-9][0-9]*-$")
+
+    def interrupt_download(self, path: str, dest: str) -> None:
+        self.client.retry_on_errors = False
+        self.server.truncate = True
+        with self.assertRaises(requests.exceptions.RequestException):
+            self.client.download_attachment(path, dest)
+        self.client.retry_on_errors = True
+
+    def test_download_to_file(self, mock_sleep: MagicMock) -> None:
+        dest = os.path.join(self.directory, "cat.png")
+        self.interrupt_download(PATH, dest)
+        self.client.download_attachment(PATH, dest)
+        with open(dest, "rb") as f:
+            self.assertEqual(f.read(), CONTENTS)
+        self.assertEqual(os.listdir(self.directory), ["cat.png"])
+        self.assertIsNone(self.server.ranges[0])
+        self.assertRegex(self.server.ranges[1] or "", r"^bytes=[1-9][0-9]*-$")
+
+        output = io.BytesIO()
+        self.client.download_attachment(PATH, output)
+        self.assertEqual(output.getvalue(), CONTENTS)
+
+        with self.assertRaisesRegex(zulip.ZulipError, "Invalid filename"):
+            self.client.download_attachment("/user_uploads/2/missing.png", output)
+        with self.assertRaises(zulip.ZulipError):
+            self.client.download_attachment("https://example.com/cat.png", output)
+
+    def test_download_other_file(self, mock_sleep: MagicMock) -> None:
+        dest = os.path.join(self.directory, "cat.png")
+        self.interrupt_download("/user_uploads/2/ab/cdef/dog.png", dest)
+        # Only an interrupted download of the same file is resumed.
+        self.client.download_attachment(PATH, dest)
+        with open(dest, "rb") as f:
+            self.assertEqual(f.read(), CONTENTS)
+        self.assertEqual(self.server.ranges, [None, None])
+
+        # A partial file from elsewhere isn't trusted either.
+        with open(dest + ".part", "wb") as f:
+            f.write(b"junk")
+        self.client.download_attachment(PATH, dest)
+        with open(dest, "rb") as f:
+            self.assertEqual(f.read(), CONTENTS)
+        self.assertEqual(self.server.ranges, [None, None, None])
+
+    def test_cache(self, mock_sleep: MagicMock) -> None:
+        self.client.attachment_cache = AttachmentCache(os.path.join(self.directory, "cache"))
+        self.assertEqual(b"".join(self.client.iter_attachment(PATH)), CONTENTS)
+        dest = os.path.join(self.directory, "cat.png")
+        self.client.download_attachment(PATH, dest)
+        self.assertEqual(b"".join(self.client.iter_attachment(PATH)), CONTENTS)
+        with open(dest, "rb") as f:
+            self.assertEqual(f.read(), CONTENTS)
+        self.assertEqual(len(self.server.ranges), 1)
+
+
+class TestAsyncDownloadAttachment(IsolatedAsyncioTestCase):
+    async def test_download(self) -> None:
+        ranges: List[Optional[str]] = []
+
+        async def temporary_url(request: web.Request) -> web.Response:
+            return web.json_response(
+                {"result": "success", "msg": "", "url": "/user_uploads/temporary/x"}
+            )
+
+        async def download(request: web.Request) -> web.StreamResponse:
+            ranges.append(request.headers.get("Range"))
+            if len(ranges) > 1:
+                return web.Response(body=CONTENTS)
+            # Break the connection halfway through the first download.
+            response = web.StreamResponse(headers={"Content-Length": str(len(CONTENTS))})
+            await response.prepare(request)
+            await response.write(CONTENTS[: len(CONTENTS) // 2])
+            assert request.transport is not None
+            request.transport.close()
+            return response
+
+        app = web.Application()
+        app.router.add_get("/api/v1/user_uploads/{path:.*}", temporary_url)
+        app.router.add_get("/user_uploads/temporary/x", download)
+        server = TestServer(app)
+        await server.start_server()
+        self.addAsyncCleanup(server.close)
+        client = make_async_client(site=str(server.make_url("")))
+        self.addAsyncCleanup(client.close)
+
+        output = io.BytesIO()
+        with patch("asyncio.sleep"):
+            await client.download_attachment(PATH, output)
+        self.assertEqual(output.getvalue(), CONTENTS)
+        self.assertIsNone(ranges[0])
+        self.assertIsNotNone(ranges[1])
+
+
+class TestUploadIndex(TestCase):
+    @override
+    def setUp(self) -> None:
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.index = UploadIndex(os.path.join(directory.name, "uploads.db"), max_entries=2)
+        self.client = make_client()
+
+    def test_index(self) -> None:
+        site = self.client.base_url
+        self.index.record(site, "bot@example.com", "a", "/user_uploads/1/a.txt")
+        self.index.record(site, "bot@example.com", "b", "/user_uploads/1/b.txt")
+        self.assertEqual(self.index.lookup(site, "bot@example.com", "a"), "/user_uploads/1/a.txt")
+        self.assertIsNone(self.index.lookup(site, "other-bot@example.com", "a"))
+        # b is now the least recently used.
+        self.index.record(site, "bot@example.com", "c", "/user_uploads/1/c.txt")
+        self.assertIsNone(self.index.lookup(site, "bot@example.com", "b"))
+        self.assertEqual(self.index.lookup(site, "bot@example.com", "c"), "/user_uploads/1/c.txt")
+
+    def test_upload_file(self) -> None:
+        self.client.upload_index = self.index
+        call_endpoint = MagicMock(
+            side_effect=lambda **kwargs: {
+                "result": "success",
+                "msg": "",
+                "url": "/user_uploads/1/{}".format(kwargs["files"][0].name),
+            }
+        )
+        with patch.object(self.client, "call_endpoint", call_endpoint):
+            for name, contents in [("a.txt", b"a"), ("copy-of-a.txt", b"a"), ("b.txt", b"b")]:
+                file = io.BytesIO(contents)
+                file.name = name
+                result = self.client.upload_file(file)
+                self.assertEqual(
+                    result["url"],
+                    "/user_uploads/1/b.txt" if name == "b.txt" else "/user_uploads/1/a.txt",
+                )
+        self.assertEqual(call_endpoint.call_count, 2)
+
+    def test_warm_up(self) -> None:
+        site = self.client.base_url
+        self.index.record(site, "bot@example.com", "deleted", "/user_uploads/1/deleted.txt")
+        get_attachments = MagicMock(
+            return_value={
+                "result": "success",
+                "attachments": [
+                    {"path_id": "1/small.txt", "size": 5},
+                    {"path_id": "1/large.bin", "size": 5_000_000},
+                ],
+            }
+        )
+        iter_attachment = MagicMock(return_value=iter([b"sma", b"ll"]))
+        with patch.object(self.client, "get_attachments", get_attachments), patch.object(
+            self.client, "iter_attachment", iter_attachment
+        ):
+            self.index.warm_up(self.client, max_download_size=1000)
+        iter_attachment.assert_called_once_with("/user_uploads/1/small.txt")
+        self.assertIsNone(self.index.lookup(site, "bot@example.com", "deleted"))
+        self.assertEqual(
+            self.index.lookup(site, "bot@example.com", hashlib.sha256(b"small").hexdigest()),
+            "/user_uploads/1/small.txt",
+        )
+
+
+class TestAsyncUploadIndex(IsolatedAsyncioTestCase):
+    async def test_upload_file(self) -> None:
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        client = make_async_client()
+        client.upload_index = UploadIndex(os.path.join(directory.name, "uploads.db"))
+        call_endpoint = AsyncMock(
+            return_value={"result": "success", "msg": "", "uri": "/user_uploads/1/a.txt"}
+        )
+        with patch.object(client, "call_endpoint", call_endpoint):
+            for _ in range(2):
+                file = io.BytesIO(b"a")
+                file.name = "a.txt"
+                result = await client.upload_file(file)
+                self.assertEqual(result["uri"], "/user_uploads/1/a.txt")
+        call_endpoint.assert_awaited_once()
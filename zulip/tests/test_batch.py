@@ -0,0 +1,114 @@
+import threading
+import time
+from collections import defaultdict
+from typing import Any, DefaultDict, Dict, List, Optional
+from unittest import TestCase
+from unittest.mock import patch
+
+from typing_extensions import override
+
+import zulip
+
+from .client_test_lib import make_client
+
+
+class TestBatch(TestCase):
+    @override
+    def setUp(self) -> None:
+        self.client = make_client()
+        self.lock = threading.Lock()
+        self.running: DefaultDict[str, int] = defaultdict(int)
+        self.max_running: DefaultDict[str, int] = defaultdict(int)
+        self.started: List[str] = []
+
+        def call_endpoint(
+            url: Optional[str] = None,
+            method: str = "POST",
+            request: Optional[Dict[str, Any]] = None,
+            **kwargs: Any,
+        ) -> Dict[str, Any]:
+            assert url is not None
+            endpoint = url.split("/")[-1]
+            with self.lock:
+                self.started.append(url)
+                self.running[endpoint] += 1
+                self.running["total"] += 1
+                for key in (endpoint, "total"):
+                    self.max_running[key] = max(self.max_running[key], self.running[key])
+            time.sleep(0.01)
+            with self.lock:
+                self.running[endpoint] -= 1
+                self.running["total"] -= 1
+            if request is not None and request.get("content") == "fail":
+                raise zulip.UnrecoverableNetworkError("oops")
+            return {"result": "success", "msg": "", "url": url}
+
+        patcher = patch.object(self.client, "call_endpoint", side_effect=call_endpoint)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_results_in_submission_order(self) -> None:
+        with self.client.batch(max_workers=4) as batch:
+            futures = [batch.delete_message(message_id) for message_id in range(20)]
+        self.assertEqual(
+            [future.result()["url"] for future in futures],
+            [f"messages/{message_id}" for message_id in range(20)],
+        )
+        self.assertEqual(
+            [result["url"] for result in batch.results()],
+            [f"messages/{message_id}" for message_id in range(20)],
+        )
+        self.assertEqual(self.max_running["total"], 4)
+
+    def test_endpoint_limits(self) -> None:
+        with self.client.batch(max_workers=6, endpoint_limits={"add_reaction": 2}) as batch:
+            for message_id in range(10):
+                batch.add_reaction({"message_id": message_id, "emoji_name": "tada"})
+            for message_id in range(10):
+                batch.delete_message(message_id)
+        self.assertEqual(self.max_running["reactions"], 2)
+        # The delete_message calls weren't stuck behind the rate-limited ones.
+        self.assertLess(
+            self.started.index("messages/9"), self.started.index("messages/9/reactions")
+        )
+
+    def test_exceptions(self) -> None:
+        with self.client.batch() as batch:
+            ok = batch.send_message({"content": "ok"})
+            failed = batch.send_message({"content": "fail"})
+        self.assertEqual(ok.result()["result"], "success")
+        self.assertIsInstance(failed.exception(), zulip.UnrecoverableNetworkError)
+        with self.assertRaises(zulip.UnrecoverableNetworkError):
+            batch.results()
+
+    def test_submit_callable(self) -> None:
+        def subscribe_and_greet(stream: str) -> str:
+            self.client.add_subscriptions([{"name": stream}])
+            self.client.send_message({"type": "stream", "to": stream, "content": "hi"})
+            return stream
+
+        with self.client.batch() as batch:
+            streams = [batch.submit(subscribe_and_greet, f"stream {i}") for i in range(3)]
+        self.assertEqual([f.result() for f in streams], ["stream 0", "stream 1", "stream 2"])
+        self.assertEqual(len(self.started), 6)
+
+    def test_unbatchable_methods(self) -> None:
+        with self.client.batch() as batch:
+            for name in ["call_on_each_message", "iter_messages", "download_attachment", "email"]:
+                with self.subTest(name=name), self.assertRaises(AttributeError):
+                    getattr(batch, name)
+
+    def test_close(self) -> None:
+        batch = self.client.batch(max_workers=2)
+        futures = [batch.delete_message(message_id) for message_id in range(4)]
+        batch.close()
+        self.assertTrue(all(future.done() for future in futures))
+        self.assertFalse(
+            any(thread.name.startswith("zulip-batch") for thread in threading.enumerate())
+        )
+
+    def test_invalid_limits(self) -> None:
+        with self.assertRaises(ValueError):
+            self.client.batch(max_workers=0)
+        with self.assertRaisesRegex(ValueError, "delete_message"):
+            self.client.batch(endpoint_limits={"send_message": 2, "delete_message": 0})
@@ -0,0 +1,124 @@
+import os
+import tempfile
+from typing import Any, Dict, List, Tuple
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
+
+from typing_extensions import override
+
+from zulip.checkpoint import (
+    CheckpointStore,
+    EventQueueCheckpoint,
+    FileCheckpointStore,
+    SQLiteCheckpointStore,
+    registration_key,
+)
+
+from .client_test_lib import (
+    StopConsumingError,
+    events_response,
+    make_client,
+    message_event,
+    registered,
+)
+
+
+def client_key(**kwargs: Any) -> str:
+    return registration_key(["message"], [], kwargs)
+
+
+class TestCheckpointStores(TestCase):
+    @override
+    def setUp(self) -> None:
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def check_store(self, store: CheckpointStore) -> None:
+        self.assertIsNone(store.load())
+        store.save(EventQueueCheckpoint("queue", 5, "{}"))
+        store.save(EventQueueCheckpoint("queue", 7, "{}"))
+        self.assertEqual(store.load(), EventQueueCheckpoint("queue", 7, "{}"))
+        store.clear()
+        self.assertIsNone(store.load())
+
+    def test_file_store(self) -> None:
+        path = os.path.join(self.directory, "state", "checkpoint.json")
+        self.check_store(FileCheckpointStore(path))
+
+        with open(path, "w") as f:
+            f.write("{")
+        with self.assertLogs("zulip.checkpoint", "WARNING"):
+            self.assertIsNone(FileCheckpointStore(path).load())
+
+    def test_sqlite_store(self) -> None:
+        path = os.path.join(self.directory, "checkpoints.db")
+        self.check_store(SQLiteCheckpointStore(path))
+
+        SQLiteCheckpointStore(path, "bot-a").save(EventQueueCheckpoint("a", 1, "{}"))
+        SQLiteCheckpointStore(path, "bot-b").save(EventQueueCheckpoint("b", 2, "{}"))
+        self.assertEqual(SQLiteCheckpointStore(path, "bot-a").load(), ("a", 1, "{}"))
+
+
+@patch("time.sleep")
+class TestCheckpointedEvents(TestCase):
+    @override
+    def setUp(self) -> None:
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.store = FileCheckpointStore(os.path.join(directory.name, "checkpoint.json"))
+        self.handled: List[int] = []
+        self.deregister = MagicMock(return_value={"result": "success", "msg": ""})
+
+    def consume(
+        self, responses: List[Dict[str, Any]], **kwargs: Any
+    ) -> Tuple[MagicMock, MagicMock]:
+        """Runs call_on_each_message until `responses` from get_events
+        run out; returns the mocked register and get_events methods."""
+        client = make_client()
+        queue_ids = iter(["queue-1", "queue-2"])
+        register = MagicMock(side_effect=lambda *args, **kwargs: registered(next(queue_ids)))
+        get_events = MagicMock(side_effect=[*responses, StopConsumingError])
+
+        def callback(message: Dict[str, Any]) -> None:
+            self.handled.append(message["id"])
+
+        with patch.multiple(
+            client, register=register, get_events=get_events, deregister=self.deregister
+        ), self.assertRaises(StopConsumingError):
+            client.call_on_each_message(callback, checkpoint_store=self.store, **kwargs)
+        return register, get_events
+
+    def test_resume(self, mock_sleep: MagicMock) -> None:
+        self.consume([events_response(message_event(0), message_event(1))])
+        self.assertEqual(self.handled, [100, 101])
+        self.assertEqual(self.store.load(), EventQueueCheckpoint("queue-1", 1, client_key()))
+
+        # A restarted consumer picks up where the last one left off.
+        register, get_events = self.consume([events_response(message_event(2))])
+        register.assert_not_called()
+        self.deregister.assert_not_called()
+        get_events.assert_any_call(queue_id="queue-1", last_event_id=1)
+        self.assertEqual(self.handled, [100, 101, 102])
+        self.assertEqual(self.store.load(), EventQueueCheckpoint("queue-1", 2, client_key()))
+
+    def test_different_registration(self, mock_sleep: MagicMock) -> None:
+        self.store.save(EventQueueCheckpoint("old-queue", 3, client_key()))
+        register, _ = self.consume([], all_public_streams=True)
+        # The old queue is deleted, and a new one registered.
+        self.deregister.assert_called_once_with("old-queue")
+        register.assert_called_once()
+        self.assertEqual(self.store.load(), ("queue-1", -1, client_key(all_public_streams=True)))
+
+    def test_queue_lost(self, mock_sleep: MagicMock) -> None:
+        self.store.save(EventQueueCheckpoint("old-queue", 3, client_key()))
+        lost: List[EventQueueCheckpoint] = []
+        bad_queue = {"result": "error", "code": "BAD_EVENT_QUEUE_ID", "msg": "Bad event queue id"}
+        register, _ = self.consume([bad_queue], on_queue_lost=lost.append)
+        self.assertEqual(lost, [EventQueueCheckpoint("old-queue", 3, client_key())])
+        register.assert_called_once()
+        self.assertEqual(self.store.load(), EventQueueCheckpoint("queue-1", -1, client_key()))
+
+        with self.assertLogs("zulip.checkpoint", "WARNING") as logs:
+            self.consume([bad_queue])
+        self.assertIn("queue-1 expired", logs.output[0])
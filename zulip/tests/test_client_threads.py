@@ -0,0 +1,116 @@
+import base64
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, List, Set, Tuple
+from unittest import TestCase
+
+from typing_extensions import override
+
+import zulip
+
+from .client_test_lib import StubHandler, StubServer, make_client
+
+
+class SettingsServer(StubServer):
+    def __init__(self) -> None:
+        super().__init__(SettingsHandler)
+        self.lock = threading.Lock()
+        self.connections: Set[Tuple[str, int]] = set()
+        self.server_settings_requests = 0
+        self.authorizations: List[str] = []
+
+
+class SettingsHandler(StubHandler):
+    disable_nagle_algorithm = True
+    server: SettingsServer
+
+    def respond(self) -> None:
+        with self.server.lock:
+            self.server.connections.add(self.client_address)
+            self.server.authorizations.append(self.headers["Authorization"])
+            if self.path.startswith("/api/v1/server_settings"):
+                self.server.server_settings_requests += 1
+        length = int(self.headers.get("Content-Length", 0))
+        self.rfile.read(length)
+        body = json.dumps(
+            {"result": "success", "msg": "", "zulip_version": "9.0", "zulip_feature_level": 300}
+        ).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = do_POST = respond  # noqa: N815
+
+
+class TestThreadSafety(TestCase):
+    @override
+    def setUp(self) -> None:
+        self.server = SettingsServer()
+        self.server.start(self)
+
+    def new_client(self, email: str = "bot@example.com", **kwargs: Any) -> zulip.Client:
+        client = make_client(email, self.server.url, **kwargs)
+        client.rate_limiter = zulip.RateLimiter()
+
+        def close_session() -> None:
+            if client.session is not None:
+                client.session.close()
+
+        self.addCleanup(close_session)
+        return client
+
+    def test_shared_client(self) -> None:
+        # Without coalescing, which would turn most of the identical
+        # calls into a few requests.
+        client = self.new_client(connection_limit_per_host=4, coalesce_requests=False)
+        sessions = set()
+
+        def call(i: int) -> int:
+            result = client.get_profile()
+            assert client.session is not None
+            sessions.add(id(client.session))
+            self.assertEqual(result["result"], "success")
+            return client.feature_level
+
+        with ThreadPoolExecutor(max_workers=16) as executor:
+            results = list(executor.map(call, range(400)))
+
+        self.assertEqual(results, [300] * 400)
+        self.assertEqual(len(sessions), 1)
+        self.assertEqual(self.server.server_settings_requests, 1)
+        # Every call made a request of its own.
+        self.assertEqual(len(self.server.authorizations), 401)
+        # Connections are reused, and never more than the limit are open.
+        self.assertLessEqual(len(self.server.connections), 4)
+
+    def test_no_keep_alive(self) -> None:
+        client = self.new_client(keep_alive=False)
+        for _ in range(3):
+            client.get_profile()
+        self.assertEqual(len(self.server.connections), 3)
+
+    def test_shared_connections(self) -> None:
+        self.addCleanup(zulip.Client._shared_sessions.clear)  # noqa: SLF001
+        clients = [
+            self.new_client(f"bot{i}@example.com", share_connections=True, connection_pool_size=2)
+            for i in range(8)
+        ]
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            list(executor.map(lambda client: client.get_profile(), clients * 5))
+
+        self.assertEqual(len({id(client.session) for client in clients}), 1)
+        self.assertLessEqual(len(self.server.connections), 2)
+        self.assertEqual(
+            sorted(set(self.server.authorizations)),
+            sorted(
+                "Basic " + base64.b64encode(f"bot{i}@example.com:key".encode()).decode()
+                for i in range(8)
+            ),
+        )
+        # Clients for another site get a pool of their own.
+        other = make_client("bot0@example.com", "http://127.0.0.2", share_connections=True)
+        other.ensure_session()
+        self.assertIsNot(other.session, clients[0].session)
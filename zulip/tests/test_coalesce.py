@@ -0,0 +1,125 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List
+from unittest import IsolatedAsyncioTestCase, TestCase
+from unittest.mock import MagicMock, patch
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from typing_extensions import override
+
+import zulip
+from zulip.metrics import RequestMetrics
+
+from .client_test_lib import make_async_client, make_client
+
+
+def wait_for(condition: Any, timeout: float = 10) -> None:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.001)
+
+
+class TestCoalescing(TestCase):
+    @override
+    def setUp(self) -> None:
+        self.client = make_client()
+        self.client.rate_limiter = zulip.RateLimiter()
+        self.client.ensure_session()
+        assert self.client.session is not None
+        self.session = self.client.session
+        self.release = threading.Event()
+        self.requests: List[Dict[str, Any]] = []
+
+    def request(self, method: str, url: str, **kwargs: Any) -> MagicMock:
+        self.requests.append(kwargs)
+        self.release.wait(timeout=10)
+        if url.endswith("/broken"):
+            raise RuntimeError("broken")
+        return MagicMock(status_code=200, headers={}, content=b'{"result": "success", "n": [1]}')
+
+    def run_concurrently(self, *calls: Any) -> List[Any]:
+        with ThreadPoolExecutor(max_workers=len(calls)) as executor:
+            futures = [executor.submit(call) for call in calls]
+            wait_for(lambda: len(self.requests) + self.client.coalesced_requests == len(calls))
+            self.release.set()
+            return [future.exception() or future.result() for future in futures]
+
+    def test_identical_gets(self) -> None:
+        metrics = RequestMetrics()
+        self.client.request_hooks.append(metrics)
+        with patch.object(self.session, "request", side_effect=self.request):
+            results = self.run_concurrently(*[self.client.get_profile] * 5)
+
+        self.assertEqual(len(self.requests), 1)
+        self.assertEqual(self.client.coalesced_requests, 4)
+        self.assertEqual(metrics.to_dict()["GET users/me"]["coalesced"], 4)
+        self.assertEqual(results, [{"result": "success", "n": [1]}] * 5)
+        # Nobody's changes to their result are seen by the others.
+        self.assertEqual(len({id(result["n"]) for result in results}), 5)
+
+    def test_different_requests(self) -> None:
+        with patch.object(self.session, "request", side_effect=self.request):
+            self.run_concurrently(
+                lambda: self.client.get_stream_id("devel"),
+                lambda: self.client.get_stream_id("design"),
+                lambda: self.client.send_message({"type": "stream", "to": "devel"}),
+                lambda: self.client.send_message({"type": "stream", "to": "devel"}),
+            )
+        self.assertEqual(len(self.requests), 4)
+        self.assertEqual(self.client.coalesced_requests, 0)
+
+    def test_disabled(self) -> None:
+        self.client.coalesce_requests = False
+        with patch.object(self.session, "request", side_effect=self.request):
+            self.run_concurrently(self.client.get_profile, self.client.get_profile)
+        self.assertEqual(len(self.requests), 2)
+
+    def test_error(self) -> None:
+        with patch.object(self.session, "request", side_effect=self.request):
+            results = self.run_concurrently(
+                *[lambda: self.client.call_endpoint("broken", method="GET")] * 3
+            )
+        self.assertEqual(len(self.requests), 1)
+        for result in results:
+            self.assertIsInstance(result, RuntimeError)
+
+
+class TestAsyncCoalescing(IsolatedAsyncioTestCase):
+    async def test_identical_gets(self) -> None:
+        release = asyncio.Event()
+        calls = 0
+
+        async def handle(request: web.Request) -> web.Response:
+            nonlocal calls
+            calls += 1
+            await release.wait()
+            return web.json_response({"result": "success", "n": [1]})
+
+        app = web.Application()
+        app.router.add_get("/api/v1/users/me", handle)
+        server = TestServer(app)
+        await server.start_server()
+        self.addAsyncCleanup(server.close)
+        client = make_async_client(site=str(server.make_url("")))
+        self.addAsyncCleanup(client.close)
+
+        tasks = [asyncio.ensure_future(client.get_profile()) for _ in range(4)]
+        while calls == 0:
+            await asyncio.sleep(0.001)
+        # The caller whose request the others share is cancelled.
+        tasks[0].cancel()
+        release.set()
+        results = await asyncio.gather(*tasks[1:])
+
+        self.assertEqual(calls, 1)
+        self.assertEqual(client.coalesced_requests, 3)
+        self.assertEqual(results, [{"result": "success", "n": [1]}] * 3)
+        self.assertEqual(len({id(result["n"]) for result in results}), 3)
+
+        # Once the request is done, the next call makes a new one.
+        await client.get_profile()
+        self.assertEqual(calls, 2)
@@ -0,0 +1,212 @@
+import threading
+from typing import Any, Dict
+from unittest import TestCase
+from unittest.mock import MagicMock
+
+from typing_extensions import override
+
+from zulip.directory import RealmDirectory
+
+INITIAL_STATE: Dict[str, Any] = {
+    "result": "success",
+    "queue_id": "1:1",
+    "last_event_id": -1,
+    "realm_users": [
+        {"user_id": 1, "email": "Iago@zulip.com", "full_name": "Iago"},
+        {"user_id": 2, "email": "othello@zulip.com", "full_name": "Othello"},
+    ],
+    "realm_non_active_users": [
+        {"user_id": 4, "email": "polonius@zulip.com", "full_name": "Polonius", "is_active": False},
+    ],
+    "streams": [
+        {"stream_id": 10, "name": "Denmark"},
+        {"stream_id": 11, "name": "Verona"},
+    ],
+    "subscriptions": [
+        {"stream_id": 10, "name": "Denmark"},
+        {"stream_id": 12, "name": "secret"},
+    ],
+}
+
+
+class TestRealmDirectory(TestCase):
+    @override
+    def setUp(self) -> None:
+        self.directory = RealmDirectory()
+        self.directory.load_state(INITIAL_STATE)
+
+    def test_initial_state(self) -> None:
+        directory = self.directory
+        self.assertEqual(directory.get_stream_id("denmark"), 10)
+        self.assertEqual(directory.get_stream_id("secret"), 12)
+        self.assertIsNone(directory.get_stream_id("Rome"))
+        self.assertEqual(directory.get_stream(11), {"stream_id": 11, "name": "Verona"})
+        self.assertTrue(directory.is_subscribed("Denmark"))
+        self.assertTrue(directory.is_subscribed(12))
+        self.assertFalse(directory.is_subscribed("Verona"))
+        self.assertFalse(directory.is_subscribed("Rome"))
+        user = directory.get_user_by_email("iago@zulip.com")
+        assert user is not None
+        self.assertEqual(user["user_id"], 1)
+        self.assertEqual(directory.get_user(2), INITIAL_STATE["realm_users"][1])
+
+    def test_user_events(self) -> None:
+        directory = self.directory
+        directory.handle_event(
+            {
+                "type": "realm_user",
+                "op": "add",
+                "person": {"user_id": 3, "email": "hamlet@zulip.com", "full_name": "Hamlet"},
+            }
+        )
+        directory.handle_event(
+            {
+                "type": "realm_user",
+                "op": "update",
+                "person": {"user_id": 1, "new_email": "iago@example.com"},
+            }
+        )
+        directory.handle_event(
+            {"type": "realm_user", "op": "update", "person": {"user_id": 2, "is_active": False}}
+        )
+        self.assertEqual(directory.get_user(3), directory.get_user_by_email("HAMLET@zulip.com"))
+        self.assertIsNone(directory.get_user_by_email("iago@zulip.com"))
+        self.assertEqual(directory.get_user_by_email("iago@example.com"), directory.get_user(1))
+        self.assertIsNone(directory.get_user(2))
+        self.assertIsNone(directory.get_user_by_email("othello@zulip.com"))
+
+    def test_reactivation(self) -> None:
+        directory = self.directory
+        self.assertIsNone(directory.get_user(4))
+        for user_id in [2, 4]:
+            directory.handle_event(
+                {
+                    "type": "realm_user",
+                    "op": "update",
+                    "person": {"user_id": user_id, "is_active": False},
+                }
+            )
+            self.assertIsNone(directory.get_user(user_id))
+            # Deactivated users are still kept current.
+            directory.handle_event(
+                {
+                    "type": "realm_user",
+                    "op": "update",
+                    "person": {"user_id": user_id, "full_name": "Renamed"},
+                }
+            )
+            self.assertIsNone(directory.get_user(user_id))
+            directory.handle_event(
+                {
+                    "type": "realm_user",
+                    "op": "update",
+                    "person": {"user_id": user_id, "is_active": True},
+                }
+            )
+            user = directory.get_user(user_id)
+            assert user is not None
+            self.assertEqual(user["full_name"], "Renamed")
+            self.assertTrue(user["is_active"])
+            self.assertEqual(directory.get_user_by_email(user["email"]), user)
+
+    def test_stream_events(self) -> None:
+        directory = self.directory
+        directory.handle_event(
+            {"type": "stream", "op": "create", "streams": [{"stream_id": 13, "name": "Rome"}]}
+        )
+        directory.handle_event(
+            {"type": "stream", "op": "update", "stream_id": 10, "property": "name", "value": "DK"}
+        )
+        directory.handle_event(
+            {"type": "stream", "op": "delete", "streams": [{"stream_id": 12, "name": "secret"}]}
+        )
+        self.assertEqual(directory.get_stream_id("rome"), 13)
+        self.assertIsNone(directory.get_stream_id("Denmark"))
+        self.assertEqual(directory.get_stream_id("dk"), 10)
+        self.assertTrue(directory.is_subscribed("DK"))
+        self.assertIsNone(directory.get_stream_id("secret"))
+        self.assertFalse(directory.is_subscribed(12))
+
+    def test_subscription_events(self) -> None:
+        directory = self.directory
+        directory.handle_event(
+            {
+                "type": "subscription",
+                "op": "add",
+                "subscriptions": [{"stream_id": 11, "name": "Verona"}],
+            }
+        )
+        directory.handle_event(
+            {
+                "type": "subscription",
+                "op": "remove",
+                "subscriptions": [{"stream_id": 10, "name": "Denmark"}],
+            }
+        )
+        directory.handle_event({"type": "message", "message": {}})
+        self.assertTrue(directory.is_subscribed("Verona"))
+        self.assertFalse(directory.is_subscribed("Denmark"))
+
+    def test_start(self) -> None:
+        client = MagicMock()
+        client.register.return_value = INITIAL_STATE
+        handled = threading.Event()
+        stopped = threading.Event()
+
+        def get_events(queue_id: str, last_event_id: int) -> Dict[str, Any]:
+            if last_event_id == -1:
+                return {
+                    "result": "success",
+                    "events": [
+                        {
+                            "id": 0,
+                            "type": "stream",
+                            "op": "create",
+                            "streams": [{"stream_id": 13, "name": "Rome"}],
+                        }
+                    ],
+                }
+            handled.set()
+            stopped.wait(timeout=10)
+            return {"result": "error", "code": "BAD_EVENT_QUEUE_ID", "msg": "Bad event queue id"}
+
+        client.get_events.side_effect = get_events
+        client.deregister.side_effect = lambda queue_id: stopped.set()
+
+        directory = RealmDirectory(client)
+        directory.start()
+        self.assertTrue(handled.wait(timeout=10))
+        self.assertEqual(directory.get_stream_id("Rome"), 13)
+        client.register.assert_called_once_with(
+            ["realm_user", "stream", "subscription"],
+            fetch_event_types=["realm_user", "stream", "subscription"],
+        )
+        client.get_events.assert_called_with(queue_id="1:1", last_event_id=0)
+
+        directory.stop()
+        client.deregister.assert_called_once_with("1:1")
+        assert directory._thread is not None  # noqa: SLF001
+        directory._thread.join(timeout=10)  # noqa: SLF001
+        self.assertFalse(directory._thread.is_alive())  # noqa: SLF001
+        # Stopping doesn't count as losing the queue.
+        client.register.assert_called_once()
+
+    def test_stop_while_registering(self) -> None:
+        client = MagicMock()
+        registering = threading.Event()
+
+        def register(*args: Any, **kwargs: Any) -> Dict[str, Any]:
+            registering.set()
+            return {"result": "error", "msg": "Internal server error"}
+
+        client.register.side_effect = register
+        directory = RealmDirectory(client)
+        with self.assertLogs("zulip", "WARNING"):
+            thread = threading.Thread(target=directory.start)
+            thread.start()
+            self.assertTrue(registering.wait(timeout=10))
+            directory.stop()
+            thread.join(timeout=10)
+        self.assertFalse(thread.is_alive())
+        client.get_events.assert_not_called()
+        client.deregister.assert_not_called()
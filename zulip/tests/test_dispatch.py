@@ -0,0 +1,129 @@
+import threading
+import time
+from typing import Any, Dict, List
+from unittest import TestCase
+
+from zulip.dispatch import KeyedDispatcher, conversation_key
+from zulip.fake_server import FakeZulipServer
+
+
+def stream_message(topic: str, content: str) -> Dict[str, Any]:
+    return {
+        "type": "stream",
+        "stream_id": 1,
+        "display_recipient": "devel",
+        "subject": topic,
+        "content": content,
+    }
+
+
+class TestConversationKey(TestCase):
+    def test_conversation_key(self) -> None:
+        self.assertEqual(conversation_key(stream_message("Topic", "")), ("stream", 1, "topic"))
+        self.assertEqual(
+            conversation_key({"type": "message", "message": stream_message("topic", "")}),
+            ("stream", 1, "topic"),
+        )
+        direct = {"type": "private", "display_recipient": [{"id": 9}, {"id": 8}]}
+        self.assertEqual(conversation_key(direct), ("private", (8, 9)))
+        self.assertIsNone(conversation_key({"type": "reaction", "message_id": 1}))
+
+
+class TestKeyedDispatcher(TestCase):
+    def test_ordering_and_parallelism(self) -> None:
+        handled: Dict[str, List[str]] = {"a": [], "b": []}
+        running = 0
+        most_running = 0
+        lock = threading.Lock()
+
+        def callback(message: Dict[str, Any]) -> None:
+            nonlocal running, most_running
+            with lock:
+                running += 1
+                most_running = max(most_running, running)
+            time.sleep(0.01)
+            handled[message["subject"]].append(message["content"])
+            with lock:
+                running -= 1
+
+        with KeyedDispatcher(callback, max_workers=4) as dispatcher:
+            for i in range(10):
+                dispatcher(stream_message("a", str(i)))
+                dispatcher(stream_message("b", str(i)))
+        self.assertEqual(handled["a"], [str(i) for i in range(10)])
+        self.assertEqual(handled["b"], [str(i) for i in range(10)])
+        # Only one event per key runs at a time.
+        self.assertEqual(most_running, 2)
+
+    def test_stats_and_backpressure(self) -> None:
+        release = threading.Event()
+        dispatcher = KeyedDispatcher(lambda message: release.wait(), max_pending=3)
+        self.addCleanup(dispatcher.close)
+        self.addCleanup(release.set)
+        dispatcher(stream_message("a", "1"))
+        dispatcher(stream_message("a", "2"))
+        dispatcher(stream_message("b", "1"))
+        stats = dispatcher.stats()
+        self.assertEqual(stats[("stream", 1, "a")].depth, 2)
+        self.assertEqual(stats[("stream", 1, "b")].depth, 1)
+        self.assertGreaterEqual(stats[("stream", 1, "a")].lag, 0)
+
+        blocked = threading.Thread(target=dispatcher, args=[stream_message("c", "1")])
+        blocked.start()
+        blocked.join(0.1)
+        self.assertTrue(blocked.is_alive())
+        release.set()
+        blocked.join()
+        dispatcher.wait()
+        self.assertEqual(dispatcher.stats(), {})
+
+    def test_errors(self) -> None:
+        def callback(message: Dict[str, Any]) -> None:
+            if message["content"] == "bad":
+                raise ValueError(message["content"])
+
+        dispatcher = KeyedDispatcher(callback)
+        self.addCleanup(dispatcher.close)
+        dispatcher(stream_message("a", "bad"))
+        with self.assertRaisesRegex(ValueError, "bad"):
+            dispatcher.wait()
+        # Later events are still handled.
+        dispatcher(stream_message("a", "good"))
+        dispatcher.wait()
+
+    def test_call_on_each_message(self) -> None:
+        server = FakeZulipServer(heartbeat_interval=0.1)
+        server.add_user("bot@example.com", "Bot", is_bot=True)
+        server.add_stream("devel", subscribers=["bot@example.com"])
+        client = server.client("bot@example.com")
+        handled: List[str] = []
+
+        def callback(message: Dict[str, Any]) -> None:
+            handled.append(message["content"])
+            if message["content"] == "stop":
+                raise ValueError("stop")
+
+        def send(content: str) -> None:
+            client.send_message(
+                {"type": "stream", "to": "devel", "topic": "test", "content": content}
+            )
+
+        def send_messages() -> None:
+            while not server.request_counts.get("POST register"):
+                time.sleep(0.01)
+            for content in ["0", "1", "2", "stop"]:
+                send(content)
+            # The callback's exception is raised when the next message
+            # is dispatched.
+            while handled[-1:] != ["stop"] or dispatcher.stats():
+                time.sleep(0.01)
+            send("after")
+
+        dispatcher = KeyedDispatcher(callback)
+        self.addCleanup(dispatcher.close)
+        sender = threading.Thread(target=send_messages)
+        sender.start()
+        with self.assertRaisesRegex(ValueError, "stop"):
+            client.call_on_each_message(dispatcher)
+        sender.join()
+        self.assertEqual(handled, ["0", "1", "2", "stop"])
@@ -0,0 +1,109 @@
+import asyncio
+import threading
+import time
+from typing import Any, Dict, List
+from unittest import IsolatedAsyncioTestCase, TestCase
+from unittest.mock import MagicMock, patch
+
+from typing_extensions import override
+
+from .client_test_lib import (
+    StopConsumingError,
+    events_response,
+    make_async_client,
+    make_client,
+    registered,
+)
+
+
+def batch(event_id: int) -> Dict[str, Any]:
+    return events_response({"id": event_id, "type": "message"})
+
+
+class TestPrefetch(TestCase):
+    @override
+    def setUp(self) -> None:
+        self.client = make_client()
+        self.get_events = MagicMock(side_effect=lambda **kwargs: batch(kwargs["last_event_id"] + 1))
+        patcher = patch.multiple(
+            self.client, register=MagicMock(return_value=registered()), get_events=self.get_events
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def wait_for_calls(self, count: int) -> None:
+        deadline = time.monotonic() + 5
+        while self.get_events.call_count < count and time.monotonic() < deadline:
+            time.sleep(0.01)
+        # Give any further calls time to happen.
+        time.sleep(0.1)
+
+    def test_overlaps_callback(self) -> None:
+        handled: List[int] = []
+        release = threading.Event()
+
+        def callback(event: Dict[str, Any]) -> None:
+            handled.append(event["id"])
+            if event["id"] == 0:
+                # While the callback is stuck, the next two batches are
+                # fetched: one fills the buffer, and the other waits
+                # for room in it.
+                self.wait_for_calls(3)
+                self.assertEqual(self.get_events.call_count, 3)
+                release.set()
+            elif event["id"] == 5:
+                raise StopConsumingError
+
+        with self.assertRaises(StopConsumingError):
+            self.client.call_on_each_event(callback, ["message"], prefetch=1)
+        self.assertTrue(release.is_set())
+        self.assertEqual(handled, [0, 1, 2, 3, 4, 5])
+        # Events are acknowledged in order, each once.
+        self.assertEqual(
+            [call.kwargs["last_event_id"] for call in self.get_events.call_args_list[:6]],
+            [-1, 0, 1, 2, 3, 4],
+        )
+
+        # Once the consumer has stopped, so does fetching.
+        calls = self.get_events.call_count
+        time.sleep(0.1)
+        self.assertEqual(self.get_events.call_count, calls)
+
+    def test_errors_are_raised_in_caller(self) -> None:
+        self.get_events.side_effect = [batch(0), StopConsumingError]
+        handled: List[int] = []
+        with self.assertRaises(StopConsumingError):
+            self.client.call_on_each_event(
+                lambda event: handled.append(event["id"]), ["message"], prefetch=2
+            )
+        self.assertEqual(handled, [0])
+
+
+class TestAsyncPrefetch(IsolatedAsyncioTestCase):
+    async def test_overlaps_callback(self) -> None:
+        client = make_async_client()
+        self.addAsyncCleanup(client.close)
+        fetched: List[int] = []
+
+        async def get_events(**kwargs: Any) -> Dict[str, Any]:
+            fetched.append(kwargs["last_event_id"])
+            return batch(kwargs["last_event_id"] + 1)
+
+        async def register(*args: Any, **kwargs: Any) -> Dict[str, Any]:
+            return registered()
+
+        handled: List[int] = []
+
+        async def callback(event: Dict[str, Any]) -> None:
+            handled.append(event["id"])
+            if event["id"] == 0:
+                await asyncio.sleep(0.05)
+                self.assertEqual(fetched, [-1, 0, 1])
+            elif event["id"] == 3:
+                raise StopConsumingError
+
+        with patch.multiple(client, register=register, get_events=get_events), self.assertRaises(
+            StopConsumingError
+        ):
+            await client.call_on_each_event(callback, ["message"], prefetch=1)
+        self.assertEqual(handled, [0, 1, 2, 3])
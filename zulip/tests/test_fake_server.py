@@ -0,0 +1,139 @@
+import io
+import threading
+import time
+from unittest import IsolatedAsyncioTestCase, TestCase
+
+from typing_extensions import override
+
+from zulip.fake_server import FakeZulipServer
+
+from .client_test_lib import make_async_client
+
+
+def make_server(
+    heartbeat_interval: float = 0.2, latency: float = 0.0, jitter: float = 0.0
+) -> FakeZulipServer:
+    server = FakeZulipServer(latency=latency, jitter=jitter, heartbeat_interval=heartbeat_interval)
+    server.add_user("bot@example.com", "Bot", is_bot=True)
+    server.add_user("iago@example.com", "Iago")
+    server.add_stream("devel", subscribers=["bot@example.com", "iago@example.com"])
+    return server
+
+
+class TestFakeZulipServer(TestCase):
+    @override
+    def setUp(self) -> None:
+        self.server = make_server()
+        self.bot = self.server.client("bot@example.com")
+        self.iago = self.server.client("iago@example.com")
+
+    def test_events(self) -> None:
+        queue = self.bot.register(["message"], [["stream", "devel"]])
+        self.assertEqual(queue["last_event_id"], -1)
+
+        # A long-poll is answered as soon as there is an event.
+        timer = threading.Timer(
+            0.05,
+            self.iago.send_message,
+            [{"type": "stream", "to": "devel", "topic": "test", "content": "Hello"}],
+        )
+        timer.start()
+        result = self.bot.get_events(queue_id=queue["queue_id"], last_event_id=-1)
+        timer.join()
+        [event] = result["events"]
+        self.assertEqual(event["id"], 0)
+        self.assertEqual(event["message"]["sender_email"], "iago@example.com")
+        self.assertEqual(event["message"]["display_recipient"], "devel")
+
+        # Direct messages are outside the queue's narrow, so nothing
+        # but a heartbeat arrives.
+        self.iago.send_message({"type": "private", "to": ["bot@example.com"], "content": "Hi"})
+        result = self.bot.get_events(queue_id=queue["queue_id"], last_event_id=0)
+        self.assertEqual(result["events"], [{"type": "heartbeat", "id": 1}])
+
+        self.assertEqual(self.bot.deregister(queue["queue_id"])["result"], "success")
+        result = self.bot.get_events(queue_id=queue["queue_id"], last_event_id=1)
+        self.assertEqual(result["code"], "BAD_EVENT_QUEUE_ID")
+
+    def test_messages(self) -> None:
+        for i in range(5):
+            self.iago.send_message(
+                {"type": "stream", "to": "devel", "topic": f"topic {i % 2}", "content": str(i)}
+            )
+        self.iago.send_message({"type": "private", "to": "bot@example.com", "content": "DM"})
+        result = self.bot.get_messages(
+            {
+                "anchor": "newest",
+                "num_before": 1,
+                "num_after": 0,
+                "narrow": [{"operator": "topic", "operand": "topic 0"}],
+            }
+        )
+        self.assertEqual([m["content"] for m in result["messages"]], ["2", "4"])
+        self.assertFalse(result["found_oldest"])
+        result = self.bot.get_messages({"anchor": 2, "num_before": 1, "num_after": 10})
+        self.assertEqual(
+            [m["content"] for m in result["messages"]], ["0", "1", "2", "3", "4", "DM"]
+        )
+
+        result = self.bot.send_message({"type": "stream", "to": "nowhere", "content": "Hi"})
+        self.assertEqual(result["code"], "STREAM_DOES_NOT_EXIST")
+
+    def test_subscriptions_and_storage(self) -> None:
+        self.bot.add_subscriptions([{"name": "new"}])
+        self.assertEqual(
+            [s["name"] for s in self.bot.get_subscriptions()["subscriptions"]], ["devel", "new"]
+        )
+        self.assertEqual(self.bot.get_stream_id("new")["stream_id"], 2)
+        self.bot.remove_subscriptions(["devel"])
+        self.assertEqual(
+            [s["name"] for s in self.bot.get_subscriptions()["subscriptions"]], ["new"]
+        )
+
+        self.bot.update_storage({"storage": {"a": "1", "b": "2"}})
+        self.assertEqual(self.bot.get_storage({"keys": ["a"]})["storage"], {"a": "1"})
+        self.assertEqual(self.iago.get_storage()["storage"], {})
+        self.assertEqual(self.bot.get_storage({"keys": ["c"]})["result"], "error")
+
+    def test_uploads(self) -> None:
+        file = io.BytesIO(b"data" * 100_000)
+        file.name = "data.bin"
+        url = self.bot.upload_file(file)["uri"]
+        self.assertEqual(b"".join(self.bot.iter_attachment(url)), file.getvalue())
+        [attachment] = self.bot.get_attachments()["attachments"]
+        self.assertEqual(attachment["size"], 400_000)
+        self.assertEqual(self.server.request_counts["GET user_uploads/:path"], 1)
+
+    def test_errors_and_latency(self) -> None:
+        client = self.server.client("bot@example.com")
+        assert client.session is not None
+        client.session.auth = ("bot@example.com", "wrong")
+        self.assertEqual(client.get_profile()["code"], "UNAUTHORIZED")
+
+        server = make_server(latency=0.05, jitter=0.01)
+        client = server.client("bot@example.com")
+        started = time.monotonic()
+        self.assertEqual(client.get_profile()["full_name"], "Bot")
+        self.assertGreaterEqual(time.monotonic() - started, 0.05)
+
+
+class TestFakeZulipServerHTTP(IsolatedAsyncioTestCase):
+    async def test_async_client(self) -> None:
+        server = make_server()
+        with server.serve() as url:
+            client = make_async_client(site=url, api_key=server.api_key("bot@example.com"))
+            self.addAsyncCleanup(client.close)
+            queue = await client.register(["message"])
+            await client.send_message(
+                {"type": "stream", "to": "devel", "topic": "test", "content": "Hello"}
+            )
+            result = await client.get_events(queue_id=queue["queue_id"], last_event_id=-1)
+            self.assertEqual(result["events"][0]["message"]["content"], "Hello")
+
+            file = io.BytesIO(b"data")
+            file.name = "data.txt"
+            uploaded = await client.upload_file(file)
+            self.assertEqual(
+                b"".join([chunk async for chunk in client.iter_attachment(uploaded["url"])]),
+                b"data",
+            )
@@ -0,0 +1,124 @@
+import threading
+from typing import Any, Dict, List
+from unittest import IsolatedAsyncioTestCase, TestCase
+from unittest.mock import patch
+
+from typing_extensions import override
+
+import zulip
+
+from .client_test_lib import make_async_client, make_client
+
+MESSAGE_IDS = list(range(10, 110, 10))
+
+
+def get_messages(request: Dict[str, Any], supports_include_anchor: bool = True) -> Dict[str, Any]:
+    """A server's answer to `request` if its narrow matched MESSAGE_IDS."""
+    anchor = request["anchor"]
+    if anchor == "oldest":
+        anchor = MESSAGE_IDS[0]
+    elif anchor == "newest":
+        anchor = MESSAGE_IDS[-1]
+    before = [message_id for message_id in MESSAGE_IDS if message_id < anchor]
+    after = [message_id for message_id in MESSAGE_IDS if message_id > anchor]
+    include_anchor = request.get("include_anchor", True) or not supports_include_anchor
+    message_ids = (
+        before[len(before) - request["num_before"] :]
+        + ([anchor] if anchor in MESSAGE_IDS and include_anchor else [])
+        + after[: request["num_after"]]
+    )
+    return {
+        "result": "success",
+        "msg": "",
+        "messages": [{"id": message_id} for message_id in message_ids],
+        "found_oldest": len(before) <= request["num_before"],
+        "found_newest": len(after) <= request["num_after"],
+    }
+
+
+class TestIterMessages(TestCase):
+    @override
+    def setUp(self) -> None:
+        self.client = make_client()
+        self.requests: List[Dict[str, Any]] = []
+
+    def iter_message_ids(self, supports_include_anchor: bool = True, **kwargs: Any) -> List[int]:
+        def fake_get_messages(request: Dict[str, Any]) -> Dict[str, Any]:
+            self.requests.append(request)
+            return get_messages(request, supports_include_anchor)
+
+        with patch.object(self.client, "get_messages", side_effect=fake_get_messages):
+            return [message["id"] for message in self.client.iter_messages(**kwargs)]
+
+    def test_newer(self) -> None:
+        narrow = [{"operator": "stream", "operand": "devel"}]
+        self.assertEqual(self.iter_message_ids(narrow=narrow, batch_size=3), MESSAGE_IDS)
+        self.assertEqual([request["anchor"] for request in self.requests], ["oldest", 40, 70])
+        self.assertEqual(
+            [request["include_anchor"] for request in self.requests], [True, False, False]
+        )
+        self.assertTrue(all(request["narrow"] == narrow for request in self.requests))
+
+    def test_older(self) -> None:
+        self.assertEqual(
+            self.iter_message_ids(batch_size=4, direction="older", apply_markdown=False),
+            MESSAGE_IDS[::-1],
+        )
+        self.assertEqual([request["anchor"] for request in self.requests], ["newest", 60, 20])
+        self.assertFalse(self.requests[0]["apply_markdown"])
+
+    def test_anchor(self) -> None:
+        self.assertEqual(self.iter_message_ids(batch_size=3, anchor=50), MESSAGE_IDS[4:])
+        self.assertEqual(
+            self.iter_message_ids(batch_size=3, anchor=50, direction="older"),
+            MESSAGE_IDS[4::-1],
+        )
+
+    def test_without_include_anchor(self) -> None:
+        self.assertEqual(
+            self.iter_message_ids(supports_include_anchor=False, batch_size=3, prefetch=False),
+            MESSAGE_IDS,
+        )
+
+    def test_error(self) -> None:
+        error = {"result": "error", "msg": "Invalid narrow operator"}
+        with patch.object(self.client, "get_messages", return_value=error), self.assertRaisesRegex(
+            zulip.ZulipError, "Invalid narrow operator"
+        ):
+            next(self.client.iter_messages())
+
+    def test_prefetch(self) -> None:
+        second_page_requested = threading.Event()
+
+        def fake_get_messages(request: Dict[str, Any]) -> Dict[str, Any]:
+            if request["anchor"] != "oldest":
+                second_page_requested.set()
+            return get_messages(request)
+
+        with patch.object(self.client, "get_messages", side_effect=fake_get_messages):
+            messages = self.client.iter_messages(batch_size=5)
+            next(messages)
+            # The second page is requested while the caller is still
+            # working through the first.
+            self.assertTrue(second_page_requested.wait(timeout=10))
+
+
+class TestAsyncIterMessages(IsolatedAsyncioTestCase):
+    async def test_iter_messages(self) -> None:
+        client = make_async_client()
+
+        async def fake_get_messages(request: Dict[str, Any]) -> Dict[str, Any]:
+            return get_messages(request)
+
+        with patch.object(client, "get_messages", side_effect=fake_get_messages):
+            self.assertEqual(
+                [message["id"] async for message in client.iter_messages(batch_size=3)],
+                MESSAGE_IDS,
+            )
+            self.assertEqual(
+                [
+                    message["id"]
+                    async for message in client.iter_messages(batch_size=3, direction="older")
+                ],
+                MESSAGE_IDS[::-1],
+            )
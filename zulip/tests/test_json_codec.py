@@ -0,0 +1,50 @@
+import importlib.util
+import os
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
+
+import zulip
+
+from .client_test_lib import make_client
+
+
+class TestJSONCodec(TestCase):
+    def test_codecs(self) -> None:
+        value = {"content": "ünïcode ✨ </p>", "to": [1, 2], "flag": None, 3: True}
+        for name in ["json", "orjson", "ujson"]:
+            if importlib.util.find_spec(name) is None:
+                continue
+            with self.subTest(codec=name):
+                codec = zulip.make_json_codec(name)
+                self.assertEqual(codec.name, name)
+                self.assertEqual(
+                    codec.loads(codec.dumps(value)),
+                    {"content": "ünïcode ✨ </p>", "to": [1, 2], "flag": None, "3": True},
+                )
+                self.assertEqual(codec.loads(b'{"a": [1]}'), {"a": [1]})
+
+        with self.assertRaises(ValueError):
+            zulip.make_json_codec("bogus")
+
+    def test_environment_override(self) -> None:
+        zulip.get_json_codec.cache_clear()
+        self.addCleanup(zulip.get_json_codec.cache_clear)
+        with patch.dict(os.environ, {"ZULIP_JSON_CODEC": "json"}):
+            self.assertEqual(zulip.get_json_codec().name, "json")
+
+    def test_encode_request(self) -> None:
+        request = {"content": "hi", "to": [1, 2], "local_id": None}
+        encoded = zulip.encode_request(request)
+        self.assertEqual(encoded["content"], "hi")
+        self.assertEqual(zulip.get_json_codec().loads(encoded["to"]), [1, 2])
+        self.assertEqual(encoded["local_id"], "null")
+        self.assertEqual(list(zulip.encode_request(request, drop_none=True)), ["content", "to"])
+
+    def test_call_endpoint_omits_none(self) -> None:
+        client = make_client()
+        send_request = MagicMock(return_value={"result": "success"})
+        with patch.object(client, "_send_request", send_request):
+            client.call_endpoint("messages", request={"content": "hi", "anchor": None})
+            client.do_api_query({"content": "hi", "anchor": None}, "v1/messages")
+        self.assertEqual(send_request.call_args_list[0][0][0], {"content": "hi"})
+        self.assertEqual(send_request.call_args_list[1][0][0], {"content": "hi", "anchor": "null"})
@@ -0,0 +1,41 @@
+import os
+import subprocess
+import sys
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
+
+import zulip
+
+from .client_test_lib import make_client
+
+
+class TestLazyImports(TestCase):
+    def test_import_zulip_skips_heavy_modules(self) -> None:
+        code = (
+            "import sys, zulip\n"
+            "zulip.Client(email='bot@example.com', api_key='key',"
+            " site='https://zulip.example.com', config_file='/nonexistent')\n"
+            "print(' '.join(m for m in ('requests', 'distro', 'argparse', 'optparse', 'aiohttp')"
+            " if m in sys.modules))"
+        )
+        result = subprocess.run(
+            [sys.executable, "-c", code],
+            env=dict(os.environ, PYTHONPATH=os.path.dirname(os.path.dirname(zulip.__file__))),
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        self.assertEqual(result.stdout.strip(), "")
+
+    @patch("platform.system", return_value="Linux")
+    @patch("distro.version", return_value="24.04")
+    @patch("distro.name", return_value="Ubuntu")
+    def test_user_agent_computed_once(
+        self, mock_name: MagicMock, mock_version: MagicMock, mock_system: MagicMock
+    ) -> None:
+        zulip._get_platform_description.cache_clear()  # noqa: SLF001
+        self.addCleanup(zulip._get_platform_description.cache_clear)  # noqa: SLF001
+        for client_name in ("first", "second"):
+            client = make_client(client=client_name)
+            self.assertEqual(client.get_user_agent(), f"{client_name} (Ubuntu; 24.04)")
+        mock_name.assert_called_once()
@@ -0,0 +1,92 @@
+from typing import Any, List
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
+
+import requests
+
+from zulip.fake_server import FakeZulipServer
+
+from .client_test_lib import StopConsumingError, events_response, make_client, registered
+
+
+class TestLongpollTimeout(TestCase):
+    def test_timeout_follows_heartbeats(self) -> None:
+        server = FakeZulipServer(heartbeat_interval=0.2)
+        server.add_user("bot@example.com", "Bot", is_bot=True)
+        client = server.client("bot@example.com")
+        assert client.session is not None
+        send = client.session.request
+        timeouts: List[float] = []
+
+        def request(method: str, url: str, **kwargs: Any) -> requests.Response:
+            if url.endswith("/events"):
+                timeouts.append(kwargs["timeout"])
+                if len(timeouts) == 1:
+                    # The connection has silently died.
+                    raise requests.exceptions.ReadTimeout
+                if len(timeouts) == 4:
+                    raise StopConsumingError
+            return send(method, url, **kwargs)
+
+        with patch.object(client.session, "request", side_effect=request), self.assertRaises(
+            StopConsumingError
+        ):
+            client.call_on_each_event(lambda event: None, ["message"])
+
+        # The interval from register's response sets the timeout, and
+        # is kept after a timeout, so a dead connection is replaced
+        # quickly.
+        self.assertEqual(timeouts[:2], [5.2, 5.2])
+        assert client.heartbeat_interval is not None
+        self.assertGreater(client.heartbeat_interval, 0.2)
+        self.assertLess(client.heartbeat_interval, 1)
+        for timeout in timeouts[2:]:
+            self.assertAlmostEqual(timeout, 5.2, delta=0.5)
+
+
+@patch("time.sleep")
+class TestEventErrorBackoff(TestCase):
+    def test_backoff(self, mock_sleep: MagicMock) -> None:
+        client = make_client()
+        error = {"result": "error", "msg": "Internal server error"}
+        success = events_response({"id": 0, "type": "heartbeat"})
+        register = MagicMock(return_value=registered())
+        get_events = MagicMock(
+            side_effect=[error, error, error, success, error, StopConsumingError]
+        )
+        with patch.multiple(client, register=register, get_events=get_events), self.assertLogs(
+            "zulip", "WARNING"
+        ), self.assertRaises(StopConsumingError):
+            client.call_on_each_event(lambda event: None, ["message"])
+
+        delays = [call.args[0] for call in mock_sleep.call_args_list]
+        self.assertEqual(len(delays), 4)
+        self.assertEqual(delays[0], 2)
+        self.assertIn(delays[1], (3, 4))
+        self.assertIn(delays[2], (3, 4))
+        # Success starts the backoff over.
+        self.assertEqual(delays[3], 2)
+
+    def test_request_retries(self, mock_sleep: MagicMock) -> None:
+        client = make_client()
+        client.ensure_session()
+        assert client.session is not None
+        error = MagicMock(status_code=502, headers={}, content=b"Bad gateway")
+        success = MagicMock(status_code=200, headers={}, content=b'{"result": "success"}')
+
+        # Most requests are retried after a fixed second, so that they
+        # fail quickly if the server doesn't come back.
+        with patch.object(client.session, "request", side_effect=[error, error, success]):
+            self.assertEqual(client.get_profile()["result"], "success")
+        self.assertEqual([call.args[0] for call in mock_sleep.call_args_list], [1.0, 1.0])
+
+        # Long-polling requests back off.
+        mock_sleep.reset_mock()
+        with patch.object(
+            client.session, "request", side_effect=[error, error, error, success]
+        ), self.assertLogs("zulip", "WARNING"):
+            client.get_events(queue_id="1:1", last_event_id=-1)
+        delays = [call.args[0] for call in mock_sleep.call_args_list]
+        self.assertEqual(delays[0], 2)
+        self.assertIn(delays[1], (3, 4))
+        self.assertIn(delays[2], (3, 4))
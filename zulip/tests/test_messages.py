@@ -0,0 +1,93 @@
+import pickle
+from typing import Any, Dict, List
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
+
+from zulip.fake_server import FakeZulipServer
+from zulip.messages import CompactMessage
+
+from .client_test_lib import StopConsumingError, events_response, make_client, registered
+
+
+def stream_message(message_id: int, **fields: Any) -> Dict[str, Any]:
+    return {
+        "id": message_id,
+        "type": "stream",
+        "stream_id": 5,
+        "display_recipient": "devel",
+        "subject": "BRIDGE".lower(),  # Not interned.
+        "content": "<p>Héllo</p>",
+        "sender_id": 8,
+        "sender_email": "iago@example.com",
+        "sender_full_name": "Iago",
+        "timestamp": 1704067200,
+        "flags": ["read"],
+        "reactions": [],
+        **fields,
+    }
+
+
+class TestCompactMessage(TestCase):
+    def test_mapping(self) -> None:
+        message = stream_message(1)
+        compact = CompactMessage(message)
+        self.assertEqual(compact, message)
+        self.assertEqual(compact.to_dict(), message)
+        self.assertEqual(len(compact), len(message))
+        self.assertEqual(compact["content"], "<p>Héllo</p>")
+        self.assertEqual(compact["flags"], ["read"])
+        self.assertEqual(compact.get("edit_history", []), [])
+        with self.assertRaises(KeyError):
+            compact["edit_history"]
+
+        self.assertEqual(compact.id, 1)
+        self.assertEqual(compact.subject, "bridge")
+        self.assertEqual(compact.display_recipient, "devel")
+        self.assertIs(compact.subject, CompactMessage(stream_message(2)).subject)
+
+        self.assertEqual(pickle.loads(pickle.dumps(compact)), message)  # noqa: S301
+
+    def test_direct_message(self) -> None:
+        recipients = [{"id": 8, "email": "iago@example.com"}, {"id": 9, "email": "bot@example.com"}]
+        message = stream_message(1, type="private", display_recipient=recipients, subject="")
+        del message["stream_id"]
+        compact = CompactMessage(message)
+        self.assertEqual(compact.display_recipient, recipients)
+        self.assertIsNone(compact.stream_id)
+        self.assertNotIn("stream_id", compact)
+        self.assertEqual(compact, message)
+
+
+class TestClientCompactMessages(TestCase):
+    def test_get_messages(self) -> None:
+        server = FakeZulipServer()
+        server.add_user("bot@example.com", "Bot", is_bot=True)
+        server.add_stream("devel", subscribers=["bot@example.com"])
+        client = server.client("bot@example.com")
+        for i in range(3):
+            client.send_message(
+                {"type": "stream", "to": "devel", "topic": "test", "content": str(i)}
+            )
+        expected = list(client.iter_messages())
+
+        client.compact_messages = True
+        messages = list(client.iter_messages(batch_size=2))
+        self.assertTrue(all(isinstance(message, CompactMessage) for message in messages))
+        self.assertEqual(messages, expected)
+
+    def test_call_on_each_message(self) -> None:
+        client = make_client()
+        client.compact_messages = True
+        message = stream_message(1)
+        register = MagicMock(return_value=registered())
+        events = events_response({"id": 0, "type": "message", "message": message})
+        get_events = MagicMock(side_effect=[events, StopConsumingError])
+        received: List[Dict[str, Any]] = []
+        with patch.multiple(client, register=register, get_events=get_events), self.assertRaises(
+            StopConsumingError
+        ):
+            client.call_on_each_message(received.append)
+
+        [compact] = received
+        self.assertIsInstance(compact, CompactMessage)
+        self.assertEqual(compact, message)
@@ -0,0 +1,170 @@
+import json
+from typing import Any, List, Tuple
+from unittest import IsolatedAsyncioTestCase, TestCase
+from unittest.mock import MagicMock, patch
+
+import requests
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from typing_extensions import override
+
+import zulip
+from zulip.metrics import RequestHook, RequestMetrics, RequestRecord, endpoint_name
+
+from .client_test_lib import make_async_client, make_client
+
+
+class RecordingHook(RequestHook):
+    def __init__(self) -> None:
+        self.records: List[RequestRecord] = []
+        self.sleeps: List[Tuple[str, str, float]] = []
+
+    @override
+    def on_request(self, record: RequestRecord) -> None:
+        self.records.append(record)
+
+    @override
+    def on_sleep(self, endpoint: str, reason: str, seconds: float) -> None:
+        self.sleeps.append((endpoint, reason, seconds))
+
+
+def mock_response(status_code: int, content: bytes, request_body: Any = None) -> MagicMock:
+    response = MagicMock(status_code=status_code, headers={}, content=content)
+    response.json.side_effect = lambda: json.loads(content)
+    response.request.body = request_body
+    return response
+
+
+class TestEndpointName(TestCase):
+    def test_endpoint_name(self) -> None:
+        for method, url, expected in [
+            ("POST", "v1/messages", "POST messages"),
+            ("GET", "v1/messages/123/history", "GET messages/:id/history"),
+            ("GET", "v1/get_stream_id?stream=devel", "GET get_stream_id"),
+            ("GET", "v1/users/iago@zulip.com/presence", "GET users/:email/presence"),
+            ("DELETE", "v1/streams/12", "DELETE streams/:id"),
+        ]:
+            with self.subTest(url=url):
+                self.assertEqual(endpoint_name(method, url), expected)
+
+
+class TestRequestMetrics(TestCase):
+    def test_aggregation(self) -> None:
+        metrics = RequestMetrics(buckets=[0.1, 1.0])
+        metrics.on_request(RequestRecord("POST messages", 502, 0.05, 100, 10, 0))
+        metrics.on_sleep("POST messages", "retry", 1.0)
+        metrics.on_request(RequestRecord("POST messages", 200, 0.5, 100, 50, 1))
+        metrics.on_request(RequestRecord("GET events", None, 2.0, 0, 0, 0, "ConnectionError"))
+        metrics.on_coalesce("GET events")
+        metrics.on_cache("GET streams", "hit")
+        metrics.on_cache("GET streams", "hit")
+        metrics.on_cache("GET streams", "miss")
+
+        data = json.loads(metrics.to_json())
+        self.assertEqual(
+            data["POST messages"],
+            {
+                "requests": {"502": 1, "200": 1},
+                "duration_seconds": {"count": 2, "sum": 0.55, "buckets": {"0.1": 1, "1.0": 2}},
+                "retries": 1,
+                "coalesced": 0,
+                "cache": {},
+                "request_bytes": 200,
+                "response_bytes": 60,
+                "sleep_seconds": {"retry": 1.0},
+            },
+        )
+        self.assertEqual(data["GET events"]["requests"], {"ConnectionError": 1})
+        self.assertEqual(data["GET events"]["coalesced"], 1)
+        self.assertEqual(data["GET streams"]["cache"], {"hit": 2, "miss": 1})
+        self.assertEqual(data["GET events"]["duration_seconds"]["buckets"], {"0.1": 0, "1.0": 0})
+
+        prometheus = metrics.to_prometheus().splitlines()
+        for line in [
+            "# TYPE zulip_api_requests_total counter",
+            'zulip_api_requests_total{endpoint="POST messages",status="200"} 1',
+            'zulip_api_requests_total{endpoint="GET events",status="ConnectionError"} 1',
+            "# TYPE zulip_api_request_duration_seconds histogram",
+            'zulip_api_request_duration_seconds_bucket{endpoint="POST messages",le="0.1"} 1',
+            'zulip_api_request_duration_seconds_bucket{endpoint="GET events",le="+Inf"} 1',
+            'zulip_api_request_duration_seconds_count{endpoint="POST messages"} 2',
+            'zulip_api_retries_total{endpoint="POST messages"} 1',
+            'zulip_api_coalesced_total{endpoint="GET events"} 1',
+            'zulip_api_cache_lookups_total{endpoint="GET streams",outcome="hit"} 2',
+            'zulip_api_response_bytes_total{endpoint="POST messages"} 60',
+            'zulip_api_sleep_seconds_total{endpoint="POST messages",reason="retry"} 1.0',
+        ]:
+            self.assertIn(line, prometheus)
+
+
+class TestClientHooks(TestCase):
+    @override
+    def setUp(self) -> None:
+        self.client = make_client()
+        self.client.rate_limiter = zulip.RateLimiter()
+        self.client.ensure_session()
+        assert self.client.session is not None
+        self.session = self.client.session
+        self.hook = RecordingHook()
+        self.client.request_hooks.append(self.hook)
+
+    @patch("time.sleep")
+    def test_retry(self, mock_sleep: MagicMock) -> None:
+        success = b'{"result": "success", "msg": "", "id": 42}'
+        with patch.object(
+            self.session,
+            "request",
+            side_effect=[
+                mock_response(502, b"Bad gateway", b"content=hi"),
+                mock_response(200, success, b"content=hi&dont_block=true"),
+            ],
+        ):
+            self.client.send_message({"type": "stream", "to": "devel", "content": "hi"})
+
+        self.assertEqual(
+            [(r.endpoint, r.status_code, r.attempt) for r in self.hook.records],
+            [("POST messages", 502, 0), ("POST messages", 200, 1)],
+        )
+        self.assertEqual(
+            [(r.request_bytes, r.response_bytes) for r in self.hook.records],
+            [(10, 11), (26, len(success))],
+        )
+        self.assertEqual(self.hook.sleeps, [("POST messages", "retry", 1.0)])
+
+    def test_connection_error(self) -> None:
+        with patch.object(
+            self.session, "request", side_effect=requests.exceptions.ConnectionError
+        ), self.assertRaises(zulip.UnrecoverableNetworkError):
+            self.client.get_profile()
+        [record] = self.hook.records
+        self.assertEqual((record.status_code, record.error), (None, "ConnectionError"))
+
+    def test_no_hooks(self) -> None:
+        self.client.request_hooks.clear()
+        with patch.object(
+            self.session, "request", return_value=mock_response(200, b'{"result": "success"}')
+        ), patch("zulip.metrics.endpoint_name") as mock_endpoint_name:
+            self.client.get_profile()
+        mock_endpoint_name.assert_not_called()
+
+
+class TestAsyncClientHooks(IsolatedAsyncioTestCase):
+    async def test_hooks(self) -> None:
+        async def handle(request: web.Request) -> web.Response:
+            return web.json_response({"result": "success", "msg": ""})
+
+        app = web.Application()
+        app.router.add_route("*", "/{tail:.*}", handle)
+        server = TestServer(app)
+        await server.start_server()
+        self.addAsyncCleanup(server.close)
+        client = make_async_client(site=str(server.make_url("")))
+        self.addAsyncCleanup(client.close)
+        metrics = RequestMetrics()
+        client.request_hooks.append(metrics)
+
+        await client.update_message({"message_id": 12, "content": "hello"})
+        data = metrics.to_dict()
+        self.assertEqual(list(data), ["PATCH messages/:id"])
+        self.assertEqual(data["PATCH messages/:id"]["requests"], {"200": 1})
+        self.assertGreater(data["PATCH messages/:id"]["request_bytes"], 0)
@@ -0,0 +1,183 @@
+import email.parser
+import io
+import os
+import tempfile
+from typing import Any, Dict, List, Tuple
+from unittest import IsolatedAsyncioTestCase, TestCase
+from unittest.mock import MagicMock, patch
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from typing_extensions import override
+
+import zulip
+from zulip.multipart import MultipartEncoder
+
+from .client_test_lib import make_async_client, make_client
+
+
+def parse_body(content_type: str, body: bytes) -> Dict[str, Tuple[Any, bytes]]:
+    message = email.parser.BytesParser().parsebytes(
+        f"Content-Type: {content_type}\r\n\r\n".encode() + body
+    )
+    return {
+        part.get_param("name", header="content-disposition"): (
+            part.get_filename(),
+            part.get_payload(decode=True),
+        )
+        for part in message.get_payload()
+    }
+
+
+class TestMultipartEncoder(TestCase):
+    def test_encoding(self) -> None:
+        file = io.BytesIO(b"skipped" + os.urandom(200_000))
+        file.name = "dist/build.tar.gz"
+        file.seek(len(b"skipped"))
+        text = io.StringIO("Hello ✨")
+        text.name = "hello.txt"
+        progress: List[Tuple[int, int]] = []
+        encoder = MultipartEncoder(
+            {"dont_block": "true"}, [file, text], progress=lambda *a: progress.append(a)
+        )
+
+        chunks = []
+        while chunk := encoder.read(8192):
+            self.assertLessEqual(len(chunk), 8192)
+            chunks.append(chunk)
+        body = b"".join(chunks)
+        self.assertEqual(len(body), len(encoder))
+        self.assertEqual(progress[-1], (len(encoder), len(encoder)))
+        self.assertEqual(progress, sorted(progress))
+        self.assertEqual(
+            parse_body(encoder.content_type, body),
+            {
+                "dont_block": (None, b"true"),
+                "dist/build.tar.gz": ("build.tar.gz", file.getvalue()[len(b"skipped") :]),
+                "hello.txt": ("hello.txt", "Hello ✨".encode()),
+            },
+        )
+
+    def test_text_file(self) -> None:
+        with tempfile.NamedTemporaryFile("w+", encoding="utf-8", suffix=".txt") as file:
+            file.write("Hello ✨")
+            file.seek(0)
+            encoder = MultipartEncoder({}, [file])
+            [(filename, content)] = parse_body(encoder.content_type, encoder.readall()).values()
+        self.assertEqual(filename, os.path.basename(file.name))
+        self.assertEqual(content, "Hello ✨".encode())
+
+    def test_truncated_file(self) -> None:
+        with tempfile.NamedTemporaryFile() as file:
+            file.write(b"x" * 1000)
+            file.seek(0)
+            encoder = MultipartEncoder({}, [file])
+            file.truncate(10)
+            with self.assertRaises(ValueError):
+                encoder.read()
+
+
+class TestUploads(TestCase):
+    @override
+    def setUp(self) -> None:
+        self.client = make_client()
+        self.client.rate_limiter = zulip.RateLimiter()
+        self.client.ensure_session()
+        assert self.client.session is not None
+        self.session = self.client.session
+        self.uploads: List[Dict[str, Tuple[Any, bytes]]] = []
+
+    def respond(
+        self, method: str, url: str, data: Any, headers: Dict[str, str], **kwargs: Any
+    ) -> MagicMock:
+        upload = parse_body(headers["Content-Type"], data.read())
+        self.uploads.append(upload)
+        [(filename, _)] = [value for value in upload.values() if value[0] is not None]
+        if filename == "broken.txt":
+            content = b'{"result": "error", "msg": "File too large"}'
+        else:
+            content = b'{"result": "success", "msg": "", "uri": "/user_uploads/1/%s"}' % (
+                filename.encode(),
+            )
+        return MagicMock(status_code=200, headers={}, content=content)
+
+    @patch("time.sleep")
+    def test_retry_resends_file(self, mock_sleep: MagicMock) -> None:
+        file = io.BytesIO(b"contents")
+        file.name = "log.txt"
+        responses = [MagicMock(status_code=502, headers={}, content=b"Bad gateway")]
+
+        def request(*args: Any, **kwargs: Any) -> MagicMock:
+            if responses:
+                kwargs["data"].read(3)
+                return responses.pop()
+            return self.respond(*args, **kwargs)
+
+        progress = MagicMock()
+        with patch.object(self.session, "request", side_effect=request):
+            result = self.client.upload_file(file, progress=progress)
+        self.assertEqual(result["uri"], "/user_uploads/1/log.txt")
+        self.assertEqual(self.uploads[0]["log.txt"], ("log.txt", b"contents"))
+        self.assertEqual(self.uploads[0]["dont_block"], (None, b"true"))
+        total = progress.call_args[0][1]
+        progress.assert_called_with(total, total)
+
+    def test_upload_files(self) -> None:
+        with tempfile.TemporaryDirectory() as directory:
+            paths = []
+            for name in ["a.txt", "b.txt", "c.txt"]:
+                paths.append(os.path.join(directory, name))
+                with open(paths[-1], "w") as f:
+                    f.write(name)
+            progress = MagicMock()
+            with patch.object(self.session, "request", side_effect=self.respond):
+                self.assertEqual(
+                    self.client.upload_files(paths, max_workers=2, progress=progress),
+                    ["/user_uploads/1/a.txt", "/user_uploads/1/b.txt", "/user_uploads/1/c.txt"],
+                )
+            self.assertEqual({call[0][0] for call in progress.call_args_list}, set(paths))
+
+            broken = os.path.join(directory, "broken.txt")
+            with open(broken, "w") as f:
+                f.write("broken")
+            with patch.object(
+                self.session, "request", side_effect=self.respond
+            ), self.assertRaisesRegex(zulip.ZulipError, "File too large"):
+                self.client.upload_files([*paths, broken])
+
+
+class TestAsyncUploads(IsolatedAsyncioTestCase):
+    async def test_upload_files(self) -> None:
+        received: Dict[str, bytes] = {}
+
+        async def handle(request: web.Request) -> web.Response:
+            form = await request.post()
+            [field] = [value for value in form.values() if isinstance(value, web.FileField)]
+            received[field.filename] = field.file.read()
+            return web.json_response(
+                {"result": "success", "msg": "", "url": f"/user_uploads/1/{field.filename}"}
+            )
+
+        app = web.Application()
+        app.router.add_post("/api/v1/user_uploads", handle)
+        server = TestServer(app)
+        await server.start_server()
+        self.addAsyncCleanup(server.close)
+        client = make_async_client(site=str(server.make_url("")))
+        self.addAsyncCleanup(client.close)
+
+        progress = MagicMock()
+        with tempfile.TemporaryDirectory() as directory:
+            paths = []
+            for name in ["a.txt", "b.txt"]:
+                paths.append(os.path.join(directory, name))
+                with open(paths[-1], "w") as f:
+                    f.write(name * 100_000)
+            self.assertEqual(
+                await client.upload_files(paths, progress=progress),
+                ["/user_uploads/1/a.txt", "/user_uploads/1/b.txt"],
+            )
+        self.assertEqual(received, {"a.txt": b"a.txt" * 100_000, "b.txt": b"b.txt" * 100_000})
+        path, sent, total = progress.call_args[0]
+        self.assertEqual(sent, total)
+        self.assertGreater(total, 500_000)
@@ -0,0 +1,96 @@
+import asyncio
+import itertools
+from typing import Any, Dict, List
+from unittest import IsolatedAsyncioTestCase
+
+import aiohttp
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from typing_extensions import override
+
+from zulip.multiplex import EventMultiplexer
+
+from .client_test_lib import make_async_client
+
+
+class StopError(Exception):
+    pass
+
+
+class TestEventMultiplexer(IsolatedAsyncioTestCase):
+    @override
+    async def asyncSetUp(self) -> None:
+        queue_numbers = itertools.count()
+        never = asyncio.Event()
+
+        async def handle(request: web.Request) -> web.Response:
+            user = aiohttp.BasicAuth.decode(request.headers["Authorization"]).login
+            if request.path == "/api/v1/register":
+                queue_id = f"{user}:{next(queue_numbers)}"
+                return web.json_response(
+                    {"result": "success", "msg": "", "queue_id": queue_id, "last_event_id": -1}
+                )
+            assert request.path == "/api/v1/events"
+            if request.query["last_event_id"] != "-1":
+                # Long-poll forever; the queue only has one message.
+                await never.wait()
+            message = {"id": 0, "queue_id": request.query["queue_id"]}
+            return web.json_response(
+                {
+                    "result": "success",
+                    "msg": "",
+                    "events": [{"id": 0, "type": "message", "message": message}],
+                }
+            )
+
+        app = web.Application()
+        app.router.add_route("*", "/{tail:.*}", handle)
+        self.server = TestServer(app)
+        await self.server.start_server()
+        self.clients = [
+            make_async_client(email, str(self.server.make_url("")))
+            for email in ("alice@example.com", "bob@example.com")
+        ]
+
+    @override
+    async def asyncTearDown(self) -> None:
+        for client in self.clients:
+            await client.close()
+        await self.server.close()
+
+    async def test_consumes_queues_concurrently(self) -> None:
+        multiplexer = EventMultiplexer()
+        received: List[Dict[str, Any]] = []
+        done = asyncio.Event()
+
+        async def callback(message: Dict[str, Any]) -> None:
+            received.append(message)
+            if len(received) == 20:
+                done.set()
+
+        for client in self.clients:
+            for _ in range(10):
+                multiplexer.add_message_callback(client, callback)
+        self.assertEqual(multiplexer.clients, self.clients)
+
+        run = asyncio.ensure_future(multiplexer.run_async())
+        await asyncio.wait_for(done.wait(), timeout=10)
+        self.assertEqual(
+            {message["queue_id"].split(":")[0] for message in received},
+            {"alice@example.com", "bob@example.com"},
+        )
+        self.assertEqual(len({message["queue_id"] for message in received}), 20)
+        run.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await run
+
+    async def test_callback_error_stops_everything(self) -> None:
+        multiplexer = EventMultiplexer()
+        multiplexer.add(self.clients[0], lambda event: None, ["message"])
+
+        def fail(event: Dict[str, Any]) -> None:
+            raise StopError
+
+        multiplexer.add(self.clients[1], fail, ["message"])
+        with self.assertRaises(StopError):
+            await asyncio.wait_for(multiplexer.run_async(), timeout=10)
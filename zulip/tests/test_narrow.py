@@ -0,0 +1,125 @@
+from typing import Any, Dict, List, Tuple
+from unittest import TestCase
+from unittest.mock import MagicMock
+
+from zulip.narrow import NarrowRouter, compile_narrow, parse_narrow
+
+
+def stream_message(
+    stream: str = "Devel", topic: str = "Bridge", content: str = "<p>Hello world</p>", **fields: Any
+) -> Dict[str, Any]:
+    return {
+        "id": 1,
+        "type": "stream",
+        "stream_id": 5,
+        "display_recipient": stream,
+        "subject": topic,
+        "content": content,
+        "sender_id": 8,
+        "sender_email": "iago@example.com",
+        "flags": [],
+        **fields,
+    }
+
+
+def direct_message(*emails: str) -> Dict[str, Any]:
+    return {
+        "id": 2,
+        "type": "private",
+        "display_recipient": [{"id": i, "email": email} for i, email in enumerate(emails)],
+        "subject": "",
+        "content": "<p>Hi</p>",
+        "sender_id": 0,
+        "sender_email": emails[0],
+        "flags": ["read"],
+    }
+
+
+class TestCompileNarrow(TestCase):
+    def test_parse_narrow(self) -> None:
+        self.assertEqual(
+            parse_narrow(
+                [
+                    ["channel", "devel"],
+                    ["-subject", "x"],
+                    {"operator": "pm-with", "operand": "a@example.com", "negated": True},
+                ]
+            ),
+            [("stream", "devel", False), ("topic", "x", True), ("dm", "a@example.com", True)],
+        )
+
+    def test_operators(self) -> None:
+        message = stream_message(
+            content='<p>Read <a href="https://example.com">the performance guide</a></p>'
+        )
+        cases: List[Tuple[List[List[Any]], bool]] = [
+            ([], True),
+            ([["stream", "devel"], ["topic", "bridge"]], True),
+            ([["stream", 5]], True),
+            ([["stream", "devel"], ["topic", "other"]], False),
+            ([["-topic", "other"]], True),
+            ([["sender", "IAGO@example.com"]], True),
+            ([["sender", 9]], False),
+            ([["is", "dm"]], False),
+            ([["is", "unread"]], True),
+            ([["has", "link"]], True),
+            ([["has", "image"]], False),
+            ([["search", "perf guide"]], True),
+            ([["search", "bridge"]], True),
+            ([["search", "href"]], False),
+            ([["id", "1"]], True),
+        ]
+        for narrow, expected in cases:
+            with self.subTest(narrow=narrow):
+                self.assertEqual(compile_narrow(narrow)(message), expected)
+
+    def test_dm(self) -> None:
+        message = direct_message("iago@example.com", "bot@example.com")
+        self.assertTrue(compile_narrow([["dm", "iago@example.com"]], "bot@example.com")(message))
+        self.assertTrue(compile_narrow([["dm", "iago@example.com"]])(message))
+        self.assertFalse(compile_narrow([["dm", "othello@example.com"]])(message))
+        self.assertTrue(compile_narrow([["dm", [0]]])(message))
+        group = direct_message("iago@example.com", "bot@example.com", "othello@example.com")
+        self.assertFalse(compile_narrow([["dm", "iago@example.com"]], "bot@example.com")(group))
+
+    def test_unsupported(self) -> None:
+        with self.assertRaisesRegex(ValueError, "near"):
+            compile_narrow([["near", "1"]])
+        with self.assertRaisesRegex(ValueError, "is:followed"):
+            compile_narrow([["is", "followed"]])
+
+
+class TestNarrowRouter(TestCase):
+    def test_route(self) -> None:
+        router = NarrowRouter("bot@example.com")
+        received: Dict[str, List[int]] = {}
+
+        def subscriber(name: str) -> Any:
+            return lambda message: received.setdefault(name, []).append(message["id"])
+
+        router.add([["stream", "devel"]], subscriber("devel"))
+        router.add([["stream", "devel"], ["topic", "bridge"]], subscriber("bridge"))
+        router.add([["stream", 5], ["-topic", "bridge"]], subscriber("not bridge"))
+        router.add([["is", "dm"]], subscriber("dm"))
+        router.add([["search", "hello"]], subscriber("search"))
+        removed = router.add([], subscriber("removed"))
+        router.remove(removed)
+
+        router({"type": "message", "id": 0, "message": stream_message()})
+        router(stream_message(topic="other", id=3))
+        router(direct_message("iago@example.com", "bot@example.com"))
+        router({"type": "reaction", "id": 1, "message_id": 1})
+        self.assertEqual(
+            received,
+            {"devel": [1, 3], "bridge": [1], "not bridge": [3], "search": [1, 3], "dm": [2]},
+        )
+
+    def test_index(self) -> None:
+        router = NarrowRouter()
+        callbacks = []
+        for i in range(100):
+            callback = MagicMock()
+            router.add([["stream", "devel"], ["topic", f"topic {i}"]], callback)
+            callbacks.append(callback)
+        self.assertEqual(router.match(stream_message(topic="Topic 42")), [callbacks[42]])
+        self.assertEqual(router.match(stream_message(stream="other", topic="topic 42")), [])
@@ -0,0 +1,115 @@
+import json
+from typing import Dict, Optional
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
+
+from typing_extensions import override
+
+import zulip
+
+from .client_test_lib import make_client
+
+NOW = 1_700_000_000.0
+
+
+def rate_limit_headers(limit: int, remaining: int, reset_in: float) -> Dict[str, str]:
+    return {
+        "X-RateLimit-Limit": str(limit),
+        "X-RateLimit-Remaining": str(remaining),
+        "X-RateLimit-Reset": str(NOW + reset_in),
+    }
+
+
+@patch("time.time", return_value=NOW)
+class TestRateLimiter(TestCase):
+    def test_unknown_limit_never_delays(self, mock_time: MagicMock) -> None:
+        limiter = zulip.RateLimiter()
+        self.assertEqual([limiter.reserve() for _ in range(100)], [0.0] * 100)
+
+    def test_delays_once_budget_is_spent(self, mock_time: MagicMock) -> None:
+        limiter = zulip.RateLimiter()
+        limiter.update(rate_limit_headers(limit=20, remaining=3, reset_in=10))
+        self.assertEqual([limiter.reserve() for _ in range(3)], [0.0] * 3)
+        # The budget refills at (20 - 3) / 10 requests per second.
+        self.assertAlmostEqual(limiter.reserve(), 10 / 17)
+        self.assertAlmostEqual(limiter.reserve(), 2 * 10 / 17)
+        self.assertEqual(limiter.stats()["delayed_requests"], 2)
+
+    def test_refills_over_time(self, mock_time: MagicMock) -> None:
+        limiter = zulip.RateLimiter()
+        limiter.update(rate_limit_headers(limit=10, remaining=0, reset_in=10))
+        mock_time.return_value = NOW + 5
+        self.assertEqual(limiter.stats()["remaining"], 5)
+        self.assertEqual([limiter.reserve() for _ in range(5)], [0.0] * 5)
+        # Once the reset time has passed, we know nothing more.
+        mock_time.return_value = NOW + 11
+        self.assertIsNone(limiter.stats()["remaining"])
+        self.assertEqual(limiter.reserve(), 0.0)
+
+    def test_rate_limited(self, mock_time: MagicMock) -> None:
+        limiter = zulip.RateLimiter()
+        limiter.rate_limited(3.5)
+        self.assertEqual(limiter.reserve(), 3.5)
+        self.assertEqual(limiter.stats()["rate_limited_responses"], 1)
+
+    def test_ignores_missing_or_malformed_headers(self, mock_time: MagicMock) -> None:
+        limiter = zulip.RateLimiter()
+        limiter.update({"X-RateLimit-Remaining": "0"})
+        limiter.update({**rate_limit_headers(10, 0, 10), "X-RateLimit-Reset": "soon"})
+        self.assertIsNone(limiter.stats()["limit"])
+
+    def test_shared_per_user(self, mock_time: MagicMock) -> None:
+        def client(email: str) -> zulip.Client:
+            return make_client(email, "https://ratelimit.example.com")
+
+        self.assertIs(client("a@example.com").rate_limiter, client("a@example.com").rate_limiter)
+        self.assertIsNot(client("a@example.com").rate_limiter, client("b@example.com").rate_limiter)
+
+
+def mock_response(
+    status_code: int, body: Dict[str, object], headers: Optional[Dict[str, str]] = None
+) -> MagicMock:
+    response = MagicMock(status_code=status_code, headers=headers or {})
+    response.content = json.dumps(body).encode()
+    response.json.return_value = body
+    return response
+
+
+class TestRateLimitedRequests(TestCase):
+    @override
+    def setUp(self) -> None:
+        self.client = make_client()
+        self.client.rate_limiter = zulip.RateLimiter()
+        self.client.ensure_session()
+        assert self.client.session is not None
+        self.session = self.client.session
+
+    @patch("time.sleep")
+    def test_retries_after_429(self, mock_sleep: MagicMock) -> None:
+        rate_limited = {"result": "error", "code": "RATE_LIMIT_HIT", "retry-after": 0.25}
+        success: Dict[str, object] = {"result": "success", "msg": ""}
+        with patch.object(
+            self.session,
+            "request",
+            side_effect=[
+                mock_response(429, rate_limited, {"Retry-After": "2"}),
+                mock_response(429, rate_limited),
+                mock_response(200, success, rate_limit_headers(200, 150, 60)),
+            ],
+        ) as mock_request, patch("time.time", return_value=NOW):
+            result = self.client.get_profile()
+            self.assertEqual(self.client.rate_limiter.stats()["remaining"], 150)
+
+        self.assertEqual(result, success)
+        self.assertEqual(mock_request.call_count, 3)
+        # The clock is frozen, so the second, shorter Retry-After doesn't
+        # shorten the wait from the first.
+        self.assertEqual([call.args[0] for call in mock_sleep.call_args_list], [2.0, 2.0])
+
+    @patch("time.sleep")
+    def test_gives_up_without_retry_on_errors(self, mock_sleep: MagicMock) -> None:
+        self.client.retry_on_errors = False
+        rate_limited = {"result": "error", "code": "RATE_LIMIT_HIT", "retry-after": 1}
+        with patch.object(self.session, "request", return_value=mock_response(429, rate_limited)):
+            self.assertEqual(self.client.get_profile(), rate_limited)
+        mock_sleep.assert_not_called()
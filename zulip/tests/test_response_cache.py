@@ -0,0 +1,136 @@
+import json
+import tempfile
+from typing import Any, Dict, List, Tuple
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
+
+from typing_extensions import override
+
+import zulip
+from zulip.metrics import RequestMetrics
+from zulip.response_cache import ResponseCache, resource_name
+
+from .client_test_lib import make_client
+
+
+class TestResourceName(TestCase):
+    def test_resource_name(self) -> None:
+        for endpoint, expected in [
+            ("streams", "streams"),
+            ("streams/:id", "streams"),
+            ("get_stream_id", "streams"),
+            ("users/me/subscriptions", "subscriptions"),
+            ("users/me/subscriptions/properties", "subscriptions"),
+            ("users/:id", "users"),
+            ("realm/emoji/:id", "realm"),
+        ]:
+            with self.subTest(endpoint=endpoint):
+                self.assertEqual(resource_name(endpoint), expected)
+
+
+class TestResponseCache(TestCase):
+    @override
+    def setUp(self) -> None:
+        self.client = self.new_client()
+        self.requests: List[Tuple[str, str, Dict[str, Any]]] = []
+        self.version = 1
+
+    def new_client(self, cache: Any = None) -> zulip.Client:
+        client = make_client()
+        client.rate_limiter = zulip.RateLimiter()
+        client.response_cache = cache or ResponseCache()
+        client.ensure_session()
+        return client
+
+    def request(self, method: str, url: str, **kwargs: Any) -> MagicMock:
+        self.requests.append((method, url, kwargs))
+        etag = f'"v{self.version}"'
+        if method != "GET":
+            self.version += 1
+            content = b'{"result": "success", "msg": ""}'
+        elif kwargs.get("headers", {}).get("If-None-Match") == etag:
+            return MagicMock(status_code=304, headers={"ETag": etag}, content=b"")
+        elif url.endswith("/broken"):
+            content = b'{"result": "error", "msg": "Broken"}'
+        else:
+            content = json.dumps(
+                {"result": "success", "msg": "", "streams": [{"version": self.version}]}
+            ).encode()
+        return MagicMock(status_code=200, headers={"ETag": etag}, content=content)
+
+    def test_hit(self) -> None:
+        metrics = RequestMetrics()
+        self.client.request_hooks.append(metrics)
+        assert self.client.session is not None
+        with patch.object(self.client.session, "request", side_effect=self.request):
+            first = self.client.get_streams()
+            first["streams"].append("changed by the caller")
+            second = self.client.get_streams()
+            # Other parameters, other endpoints and errors aren't cached.
+            self.client.get_streams(include_public=False)
+            self.client.get_messages({"anchor": "newest", "num_before": 1, "num_after": 0})
+            self.client.call_endpoint("streams/broken", method="GET")
+            self.client.call_endpoint("streams/broken", method="GET")
+
+        self.assertEqual(second, {"result": "success", "msg": "", "streams": [{"version": 1}]})
+        self.assertEqual(
+            [url.split("/api/v1/")[1] for _, url, _ in self.requests],
+            ["streams", "streams", "messages", "streams/broken", "streams/broken"],
+        )
+        self.assertEqual(metrics.to_dict()["GET streams"]["cache"], {"hit": 1, "miss": 2})
+
+    def test_revalidation(self) -> None:
+        metrics = RequestMetrics()
+        self.client.request_hooks.append(metrics)
+        assert self.client.response_cache is not None
+        self.client.response_cache.ttls["streams"] = 0
+        assert self.client.session is not None
+        with patch.object(self.client.session, "request", side_effect=self.request):
+            first = self.client.get_streams()
+            second = self.client.get_streams()
+        self.assertEqual(first, second)
+        self.assertEqual(len(self.requests), 2)
+        self.assertNotIn("headers", self.requests[0][2])
+        self.assertEqual(self.requests[1][2]["headers"]["If-None-Match"], '"v1"')
+        self.assertEqual(metrics.to_dict()["GET streams"]["cache"], {"miss": 1, "revalidated": 1})
+
+    def test_invalidation(self) -> None:
+        assert self.client.session is not None
+        with patch.object(self.client.session, "request", side_effect=self.request):
+            self.client.get_streams()
+            self.client.get_members()
+            self.client.update_stream({"stream_id": 1, "description": "New"})
+            self.assertEqual(self.client.get_streams()["streams"], [{"version": 2}])
+            self.client.get_members()
+            self.assertEqual(len(self.requests), 4)
+
+            # Subscribing can create streams.
+            self.client.add_subscriptions([{"name": "new"}])
+            self.assertEqual(self.client.get_streams()["streams"], [{"version": 3}])
+            self.assertEqual(len(self.requests), 6)
+
+    def test_disk_cache(self) -> None:
+        with tempfile.TemporaryDirectory() as directory:
+            clients = [self.new_client(ResponseCache(directory=directory)) for _ in range(2)]
+            for client in clients:
+                assert client.session is not None
+                with patch.object(client.session, "request", side_effect=self.request):
+                    self.assertEqual(client.get_streams()["streams"], [{"version": 1}])
+            self.assertEqual(len(self.requests), 1)
+
+            # Invalidation removes the response from the disk as well.
+            assert clients[0].session is not None
+            with patch.object(clients[0].session, "request", side_effect=self.request):
+                clients[0].update_stream({"stream_id": 1, "description": "New"})
+            client = self.new_client(ResponseCache(directory=directory))
+            assert client.session is not None
+            with patch.object(client.session, "request", side_effect=self.request):
+                self.assertEqual(client.get_streams()["streams"], [{"version": 2}])
+
+            # Responses aren't shared between users.
+            other = self.new_client(ResponseCache(directory=directory))
+            other.email = "other-bot@example.com"
+            assert other.session is not None
+            with patch.object(other.session, "request", side_effect=self.request):
+                other.get_streams()
+            self.assertEqual(len(self.requests), 4)
@@ -0,0 +1,66 @@
+import tempfile
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
+
+from typing_extensions import override
+
+from .client_test_lib import make_client
+
+SERVER_SETTINGS = {
+    "result": "success",
+    "msg": "",
+    "zulip_version": "9.0",
+    "zulip_feature_level": 237,
+}
+
+
+@patch("zulip.Client.get_server_settings", return_value=SERVER_SETTINGS)
+class TestLazyServerSettings(TestCase):
+    @override
+    def setUp(self) -> None:
+        self.cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.cache_dir.cleanup)
+
+    def test_constructor_does_not_contact_server(self, mock_settings: MagicMock) -> None:
+        make_client()
+        mock_settings.assert_not_called()
+
+    def test_fetched_once_on_first_use(self, mock_settings: MagicMock) -> None:
+        client = make_client()
+        self.assertEqual(client.feature_level, 237)
+        self.assertEqual(client.zulip_version, "9.0")
+        mock_settings.assert_called_once()
+
+    def test_disk_cache_shared_between_clients(self, mock_settings: MagicMock) -> None:
+        self.assertEqual(make_client(server_settings_cache=self.cache_dir.name).feature_level, 237)
+        self.assertEqual(make_client(server_settings_cache=self.cache_dir.name).feature_level, 237)
+        mock_settings.assert_called_once()
+
+        # Caches are per site.
+        other = make_client(
+            site="https://other.example.com", server_settings_cache=self.cache_dir.name
+        )
+        self.assertEqual(other.feature_level, 237)
+        self.assertEqual(mock_settings.call_count, 2)
+
+    def test_disk_cache_from_environment(self, mock_settings: MagicMock) -> None:
+        with patch.dict("os.environ", {"ZULIP_SERVER_SETTINGS_CACHE": self.cache_dir.name}):
+            make_client().ensure_server_settings()
+            make_client().ensure_server_settings()
+        mock_settings.assert_called_once()
+
+    def test_disk_cache_expiry(self, mock_settings: MagicMock) -> None:
+        make_client(server_settings_cache=self.cache_dir.name).ensure_server_settings()
+        client = make_client(server_settings_cache=self.cache_dir.name)
+        assert client.server_settings_cache is not None
+        client.server_settings_cache.ttl = 0
+        with patch("time.time", return_value=2**40):
+            client.ensure_server_settings()
+        self.assertEqual(mock_settings.call_count, 2)
+
+    def test_invalidate(self, mock_settings: MagicMock) -> None:
+        client = make_client(server_settings_cache=self.cache_dir.name)
+        client.ensure_server_settings()
+        client.invalidate_server_settings()
+        make_client(server_settings_cache=self.cache_dir.name).ensure_server_settings()
+        self.assertEqual(mock_settings.call_count, 2)
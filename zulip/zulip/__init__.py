@@ -1,11 +1,12 @@
-import argparse
+import contextlib
+import copy
+import functools
 import json
 import logging
-import optparse
 import os
-import platform
 import random
 import sys
+import threading
 import time
 import traceback
 import types
@@ -14,20 +15,24 @@ from configparser import ConfigParser
 from datetime import datetime
 from typing import (
     IO,
+    TYPE_CHECKING,
     Any,
     Callable,
+    ClassVar,
     Dict,
+    Generator,
     Iterable,
+    Iterator,
     List,
     Mapping,
+    NamedTuple,
     Optional,
     Sequence,
     Tuple,
+    TypeVar,
     Union,
 )
 
-import distro
-import requests
 from typing_extensions import Literal, override
 
 __version__ = "0.9.1"
@@ -35,17 +40,34 @@ __version__ = "0.9.1"
 # Ensure the Python version is supported
 assert sys.version_info >= (3, 6)
 
-if sys.version_info < (3, 11):
-    from backports.datetime_fromisoformat import (
-        datetime_fromisoformat as datetime_fromisoformat,  # noqa: PLC0414
-    )
-else:
+# Modules that are slow to import (requests alone more than doubles
+# the time `import zulip` takes) are imported where they are first
+# needed, so that short-lived scripts such as commit hooks only pay for
+# what they use.  See tools/benchmark-import-time.
+if TYPE_CHECKING:
+    import argparse
+    import optparse
+
+    import requests
+
+    # Re-exported (see __getattr__ below).
+    from zulip.async_client import AsyncClient as AsyncClient  # noqa: PLC0414
+    from zulip.attachments import AttachmentCache, UploadIndex
+    from zulip.batch import Batch
+    from zulip.checkpoint import CheckpointStore, EventQueueCheckpoint
+    from zulip.metrics import RequestHook
+    from zulip.multipart import ProgressCallback
+    from zulip.response_cache import ResponseCache
+
+if sys.version_info >= (3, 11):
     datetime_fromisoformat = datetime.fromisoformat
 
 logger = logging.getLogger(__name__)
 
 API_VERSTRING = "v1/"
 
+_T = TypeVar("_T")
+
 # An optional parameter to `move_topic` and `update_message` actions
 # See eg. https://zulip.com/api/update-message#parameter-propagate_mode
 EditPropagateMode = Literal["change_one", "change_all", "change_later"]
@@ -132,6 +154,12 @@ class CountingBackoff:
 class RandomExponentialBackoff(CountingBackoff):
     @override
     def fail(self) -> None:
+        time.sleep(self.fail_without_sleeping())
+
+    def fail_without_sleeping(self) -> float:
+        """Like `fail`, but returns how long to wait instead of
+        sleeping, for callers that wait some other way (such as
+        asyncio.sleep)."""
         super().fail()
         # Exponential growth with ratio sqrt(2); compute random delay
         # between x and 2x where x is growing exponentially
@@ -142,7 +170,7 @@ class RandomExponentialBackoff(CountingBackoff):
             logger.warning(message)
         except NameError:
             print(message)
-        time.sleep(delay)
+        return delay
 
 
 def _default_client() -> str:
@@ -150,10 +178,12 @@ def _default_client() -> str:
 
 
 def add_default_arguments(
-    parser: argparse.ArgumentParser,
+    parser: "argparse.ArgumentParser",
     patch_error_handling: bool = True,
     allow_provisioning: bool = False,
-) -> argparse.ArgumentParser:
+) -> "argparse.ArgumentParser":
+    import argparse
+
     if patch_error_handling:
 
         def custom_error_handling(self: argparse.ArgumentParser, message: str) -> None:
@@ -226,7 +256,11 @@ def add_default_arguments(
 # except for the fact that is uses the deprecated `optparse` module.
 # We still keep it for legacy support of out-of-tree bots and integrations
 # depending on it.
-def generate_option_group(parser: optparse.OptionParser, prefix: str = "") -> optparse.OptionGroup:
+def generate_option_group(
+    parser: "optparse.OptionParser", prefix: str = ""
+) -> "optparse.OptionGroup":
+    import optparse
+
     logging.warning(
         """zulip.generate_option_group is based on optparse, which
                     is now deprecated. We recommend migrating to argparse and
@@ -385,7 +419,369 @@ class TimeZoneMissingError(ZulipError):
     pass
 
 
-class Client:
+def _message_page_request(
+    narrow: Sequence[Any],
+    anchor: Union[int, str],
+    first_page: bool,
+    batch_size: int,
+    direction: Literal["newer", "older"],
+    request: Mapping[str, Any],
+) -> Dict[str, Any]:
+    return {
+        **request,
+        "narrow": narrow,
+        "anchor": anchor,
+        # Every page after the first starts at the last message of
+        # the previous one, which we've already returned.
+        "include_anchor": first_page,
+        "num_before": batch_size if direction == "older" else 0,
+        "num_after": batch_size if direction == "newer" else 0,
+    }
+
+
+def _read_message_page(
+    result: Dict[str, Any],
+    previous_message_id: Optional[int],
+    direction: Literal["newer", "older"],
+) -> Tuple[List[Dict[str, Any]], Optional[int]]:
+    """Returns the messages of a `get_messages` response in the order
+    `iter_messages` yields them, and the anchor of the next page (or
+    None if this was the last one)."""
+    if result["result"] != "success":
+        raise ZulipError("Error fetching messages: {}".format(result.get("msg")))
+    # Servers older than feature level 155 don't support include_anchor.
+    messages = [message for message in result["messages"] if message["id"] != previous_message_id]
+    if direction == "older":
+        messages.reverse()
+    if not messages or result.get("found_newest" if direction == "newer" else "found_oldest"):
+        return messages, None
+    return messages, messages[-1]["id"]
+
+
+def _uploaded_file_url(result: Dict[str, Any]) -> str:
+    # Servers older than feature level 272 only return "uri".
+    return result["url"] if "url" in result else result["uri"]
+
+
+def _prefetch(items: Iterator[_T], size: int) -> Generator[_T, None, None]:
+    """Iterates over `items` in a background thread, running up to
+    `size` items ahead of the caller; exceptions are re-raised in the
+    caller's thread."""
+    import queue
+
+    buffer: "queue.Queue[Tuple[bool, Any]]" = queue.Queue(size)
+    stopped = threading.Event()
+
+    def produce() -> None:
+        try:
+            for item in items:
+                buffer.put((True, item))
+                if stopped.is_set():
+                    return
+        except BaseException as e:
+            buffer.put((False, e))
+        else:
+            buffer.put((False, None))
+
+    threading.Thread(target=produce, name="zulip-prefetch", daemon=True).start()
+    try:
+        while True:
+            ok, value = buffer.get()
+            if not ok:
+                if value is None:
+                    return
+                raise value
+            yield value
+    finally:
+        # Make room for the producer's next item, after which it sees
+        # that it should stop.
+        stopped.set()
+        with contextlib.suppress(queue.Empty):
+            while True:
+                buffer.get_nowait()
+
+
+class RateLimiter:
+    """A client-side token bucket tracking the server's rate limit.
+
+    The Zulip server reports how many requests a user has left in the
+    X-RateLimit-* headers of its responses.  This keeps a local copy of
+    that budget, refilling it linearly until the reset time the server
+    reported, so that callers can be delayed just enough to stay under
+    the limit rather than hitting it and getting 429 responses.
+
+    Rate limits are per user, so there is one RateLimiter per
+    (site, email), shared by every Client for that user in the process;
+    see `for_user`.
+    """
+
+    _instances: ClassVar[Dict[Tuple[str, str], "RateLimiter"]] = {}
+    _instances_lock: ClassVar[threading.Lock] = threading.Lock()
+
+    @classmethod
+    def for_user(cls, site: str, email: str) -> "RateLimiter":
+        with cls._instances_lock:
+            if (site, email) not in cls._instances:
+                cls._instances[(site, email)] = cls()
+            return cls._instances[(site, email)]
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        # None until the server has told us about its limits.
+        self.limit: Optional[int] = None
+        self.remaining: Optional[float] = None
+        self.reset_at = 0.0
+        self.refill_rate = 0.0
+        self.updated_at = 0.0
+        # Set from Retry-After when the server responds with a 429.
+        self.blocked_until = 0.0
+
+        # Statistics.
+        self.delayed_requests = 0
+        self.time_delayed = 0.0
+        self.rate_limited_responses = 0
+
+    def _refill(self, now: float) -> None:
+        if self.remaining is None or self.limit is None:
+            return
+        if now >= self.reset_at:
+            # The server's budget has fully reset; we know nothing
+            # more until the next response.
+            self.remaining = None
+            return
+        self.remaining = min(
+            float(self.limit), self.remaining + (now - self.updated_at) * self.refill_rate
+        )
+        self.updated_at = now
+
+    def reserve(self) -> float:
+        """Takes one request's worth of budget, returning how many
+        seconds the caller should wait before sending the request."""
+        with self.lock:
+            now = time.time()
+            delay = max(0.0, self.blocked_until - now)
+            self._refill(now)
+            if self.remaining is not None:
+                self.remaining -= 1
+                if self.remaining < 0:
+                    if self.refill_rate > 0:
+                        delay = max(delay, -self.remaining / self.refill_rate)
+                    else:
+                        delay = max(delay, self.reset_at - now)
+            if delay > 0:
+                self.delayed_requests += 1
+                self.time_delayed += delay
+            return delay
+
+    def acquire(self) -> float:
+        """Sleeps as long as `reserve` says to; returns the delay."""
+        delay = self.reserve()
+        if delay > 0:
+            time.sleep(delay)
+        return delay
+
+    def update(self, headers: Mapping[str, str]) -> None:
+        """Records the budget reported in a response's headers."""
+        values = [
+            headers.get(name)
+            for name in ("X-RateLimit-Limit", "X-RateLimit-Remaining", "X-RateLimit-Reset")
+        ]
+        if not all(isinstance(value, str) for value in values):
+            return
+        try:
+            limit, remaining, reset_at = (float(value) for value in values)  # type: ignore[arg-type] # checked above
+        except ValueError:
+            return
+        with self.lock:
+            now = time.time()
+            self.limit = int(limit)
+            self.remaining = remaining
+            self.reset_at = reset_at
+            self.updated_at = now
+            if reset_at > now:
+                self.refill_rate = (limit - remaining) / (reset_at - now)
+            else:
+                self.refill_rate = 0.0
+
+    def rate_limited(self, retry_after: float) -> None:
+        """Records a 429 response; no request is sent for `retry_after` seconds."""
+        with self.lock:
+            self.rate_limited_responses += 1
+            self.blocked_until = max(self.blocked_until, time.time() + retry_after)
+            if self.remaining is not None:
+                self.remaining = min(self.remaining, 0.0)
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            self._refill(time.time())
+            return {
+                "limit": self.limit,
+                "remaining": self.remaining,
+                "reset_at": self.reset_at if self.remaining is not None else None,
+                "delayed_requests": self.delayed_requests,
+                "time_delayed": self.time_delayed,
+                "rate_limited_responses": self.rate_limited_responses,
+            }
+
+
+def get_retry_after(headers: Mapping[str, str], body: bytes) -> float:
+    """How long a 429 response asks us to wait, in seconds."""
+    value: object = headers.get("Retry-After")
+    if value is None:
+        # Zulip also includes this in its JSON error response.
+        with contextlib.suppress(ValueError, TypeError, AttributeError):
+            value = json.loads(body).get("retry-after")
+    try:
+        return max(0.0, float(value))  # type: ignore[arg-type] # handled below
+    except (ValueError, TypeError):
+        return 1.0
+
+
+class JSONCodec(NamedTuple):
+    name: str
+    dumps: Callable[[Any], str]
+    loads: Callable[[Union[bytes, str]], Any]
+
+
+def make_json_codec(name: str) -> JSONCodec:
+    if name == "orjson":
+        import orjson
+
+        def orjson_dumps(obj: Any) -> str:
+            return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode()
+
+        return JSONCodec("orjson", orjson_dumps, orjson.loads)
+    if name == "ujson":
+        import ujson
+
+        def ujson_dumps(obj: Any) -> str:
+            return ujson.dumps(obj, ensure_ascii=False, escape_forward_slashes=False)
+
+        return JSONCodec("ujson", ujson_dumps, ujson.loads)
+    if name == "json":
+
+        def json_loads(content: Union[bytes, str]) -> Any:
+            # json.loads is slower on bytes, which it decodes with the
+            # "surrogatepass" error handler.
+            return json.loads(content.decode() if isinstance(content, bytes) else content)
+
+        return JSONCodec("json", json.dumps, json_loads)
+    raise ValueError(f"Unknown JSON codec {name!r}")
+
+
+@functools.lru_cache(maxsize=None)
+def get_json_codec() -> JSONCodec:
+    """Returns the codec clients use to encode request parameters and
+    decode responses: orjson or ujson if one is installed, since
+    decoding large event batches with the standard library's json
+    module is a noticeable CPU cost, and json otherwise.  Set the
+    ZULIP_JSON_CODEC environment variable to choose one explicitly."""
+    name = os.environ.get("ZULIP_JSON_CODEC")
+    if name:
+        return make_json_codec(name)
+    for name in ("orjson", "ujson"):
+        with contextlib.suppress(ImportError):
+            return make_json_codec(name)
+    return make_json_codec("json")
+
+
+def encode_request(request: Mapping[str, Any], drop_none: bool = False) -> Dict[str, str]:
+    """Encodes API parameters as form values: strings are sent as they
+    are, and anything else as JSON."""
+    dumps = get_json_codec().dumps
+    return {
+        key: val if isinstance(val, str) else dumps(val)
+        for key, val in request.items()
+        if not (drop_none and val is None)
+    }
+
+
+class ServerSettingsCache:
+    """An on-disk cache of `get_server_settings` responses, keyed by site.
+
+    Short-lived processes (commit hooks, `zulip-send`) create a new
+    client every time they run; with a cache directory configured, only
+    the first of them within `ttl` seconds pays for the round trip
+    needed to learn the server's feature level.
+    """
+
+    def __init__(self, directory: str, ttl: float = 24 * 60 * 60) -> None:
+        self.directory = os.path.abspath(os.path.expanduser(directory))
+        self.ttl = ttl
+
+    def _path(self, site: str) -> str:
+        import hashlib
+
+        key = hashlib.sha256(site.encode()).hexdigest()[:32]
+        return os.path.join(self.directory, f"server_settings-{key}.json")
+
+    def get(self, site: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self._path(site)) as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if entry.get("site") != site or time.time() - entry.get("fetched_at", 0) > self.ttl:
+            return None
+        return entry.get("server_settings")
+
+    def set(self, site: str, server_settings: Dict[str, Any]) -> None:
+        import tempfile
+
+        entry = {"site": site, "fetched_at": time.time(), "server_settings": server_settings}
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            # Write to a temporary file and rename it into place, so
+            # that concurrent processes never see a partial file.
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            with os.fdopen(fd, "w") as f:
+                json.dump(entry, f)
+            os.replace(tmp_path, self._path(site))
+        except OSError:
+            logger.warning("Could not write server settings cache in %s", self.directory)
+
+    def invalidate(self, site: str) -> None:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(self._path(site))
+
+
+# Computing this reads files like /etc/os-release, and the answer can't
+# change while the process is running, so it's only done once.
+@functools.lru_cache(maxsize=None)
+def _get_platform_description() -> Tuple[str, str]:
+    import platform
+
+    vendor = ""
+    vendor_version = ""
+    try:
+        vendor = platform.system()
+        vendor_version = platform.release()
+    except OSError:
+        # If the calling process is handling SIGCHLD, platform.system() can
+        # fail with an IOError.  See http://bugs.python.org/issue9127
+        pass
+
+    if vendor == "Linux":
+        import distro
+
+        vendor = distro.name()
+        vendor_version = distro.version()
+    elif vendor == "Windows":
+        vendor_version = platform.win32_ver()[1]
+    elif vendor == "Darwin":
+        vendor_version = platform.mac_ver()[0]
+
+    return (vendor, vendor_version)
+
+
+class BaseClient:
+    """Configuration shared by the blocking `Client` and the asyncio `AsyncClient`.
+
+    This resolves credentials, the server URL and TLS settings from the
+    constructor arguments, the environment and the zuliprc file; it
+    does not talk to the server.
+    """
+
     def __init__(
         self,
         email: Optional[str] = None,
@@ -399,6 +795,8 @@ class Client:
         insecure: Optional[bool] = None,
         client_cert: Optional[str] = None,
         client_cert_key: Optional[str] = None,
+        server_settings_cache: Optional[str] = None,
+        coalesce_requests: bool = True,
     ) -> None:
         if client is None:
             client = _default_client()
@@ -421,6 +819,8 @@ class Client:
             client_cert_key = os.environ.get("ZULIP_CERT_KEY")
         if cert_bundle is None:
             cert_bundle = os.environ.get("ZULIP_CERT_BUNDLE")
+        if server_settings_cache is None:
+            server_settings_cache = os.environ.get("ZULIP_SERVER_SETTINGS_CACHE")
         if insecure is None:
             # Be quite strict about what is accepted so that users don't
             # disable security unintentionally.
@@ -454,6 +854,8 @@ class Client:
                 client_cert_key = config.get("api", "client_cert_key")
             if cert_bundle is None and config.has_option("api", "cert_bundle"):
                 cert_bundle = config.get("api", "cert_bundle")
+            if server_settings_cache is None and config.has_option("api", "server_settings_cache"):
+                server_settings_cache = config.get("api", "server_settings_cache")
             if insecure is None and config.has_option("api", "insecure"):
                 # Be quite strict about what is accepted so that users don't
                 # disable security unintentionally.
@@ -521,14 +923,296 @@ class Client:
         self.client_cert = client_cert
         self.client_cert_key = client_cert_key
 
-        self.session: Optional[requests.Session] = None
+        self.rate_limiter = RateLimiter.for_user(self.base_url, self.email)
+
+        self.server_settings_cache: Optional[ServerSettingsCache] = None
+        if server_settings_cache is not None:
+            self.server_settings_cache = ServerSettingsCache(server_settings_cache)
 
         self.has_connected = False
 
-        server_settings = self.get_server_settings()
-        self.zulip_version: Optional[str] = server_settings.get("zulip_version")
-        self.feature_level: int = server_settings.get("zulip_feature_level", 0)
-        assert self.zulip_version is not None
+        # How long the server waits before answering an idle
+        # long-polling request with a heartbeat event, once known; see
+        # `_longpoll_timeout`.
+        self.heartbeat_interval: Optional[float] = None
+        # The interval as reported by `register`, if the server does.
+        self._registered_heartbeat_interval: Optional[float] = None
+
+        # See zulip.metrics; with no hooks, requests aren't measured.
+        self.request_hooks: List["RequestHook"] = []
+
+        # Whether identical GET requests made at the same time share a
+        # single request to the server, and how many calls have been
+        # answered that way.
+        self.coalesce_requests = coalesce_requests
+        self.coalesced_requests = 0
+
+        # Used by download_attachment and iter_attachment if set.
+        self.attachment_cache: Optional["AttachmentCache"] = None
+        # Used by upload_file if set, to avoid uploading files twice.
+        self.upload_index: Optional["UploadIndex"] = None
+        # Whether get_messages, iter_messages and call_on_each_event
+        # return messages as zulip.messages.CompactMessage objects.
+        self.compact_messages = False
+
+    def get_user_agent(self) -> str:
+        vendor, vendor_version = _get_platform_description()
+        return f"{self.client_name} ({vendor}; {vendor_version})"
+
+    def _attachment_path(self, path: str) -> str:
+        """Normalizes a link to an uploaded file to the form
+        user_uploads/<realm_id>/<...>, which is also the API endpoint
+        returning a temporary URL for it."""
+        site = self.base_url[: -len("api/")]
+        if path.startswith(site):
+            path = path[len(site) :]
+        path = path.lstrip("/")
+        if not path.startswith("user_uploads/"):
+            raise ZulipError(f"{path} is not a link to an uploaded file")
+        return path
+
+    def _open_download(self, path: str, dest: str) -> Tuple[IO[bytes], int]:
+        """Opens `dest + ".part"` for downloading the uploaded file at
+        `path`, and returns it with the number of bytes it already holds.
+
+        Which file is being downloaded is recorded alongside, so that
+        only an interrupted download of the same file is resumed;
+        anything else left there is overwritten."""
+        part = dest + ".part"
+        source = self.base_url + path
+        try:
+            with open(part + ".source") as f:
+                resume = f.read() == source and os.path.exists(part)
+        except FileNotFoundError:
+            resume = False
+        if resume:
+            return open(part, "ab"), os.path.getsize(part)  # noqa: SIM115
+        with open(part + ".source", "w") as f:
+            f.write(source)
+        return open(part, "wb"), 0  # noqa: SIM115
+
+    def _finish_download(self, dest: str) -> None:
+        os.replace(dest + ".part", dest)
+        os.remove(dest + ".part.source")
+
+    def _compact_messages(self, result: Dict[str, Any]) -> Dict[str, Any]:
+        if self.compact_messages and "messages" in result:
+            from zulip.messages import CompactMessage
+
+            result["messages"] = [CompactMessage(message) for message in result["messages"]]
+        return result
+
+    def _compact_event(self, event: Dict[str, Any]) -> Dict[str, Any]:
+        if self.compact_messages and event["type"] == "message":
+            from zulip.messages import CompactMessage
+
+            event["message"] = CompactMessage(event["message"])
+        return event
+
+    def _longpoll_timeout(self) -> float:
+        # The server answers a long-polling request with a heartbeat
+        # event if nothing else happens for `heartbeat_interval`
+        # seconds, so a request taking much longer than that is on a
+        # dead connection (say, one dropped by a NAT gateway), and
+        # should be retried on a new one.  Until the interval is known,
+        # 90s is a balance between a low traffic rate and a still
+        # reasonable latency time in case of a connection failure.
+        if self.heartbeat_interval is None:
+            return 90.0
+        return min(90.0, self.heartbeat_interval + max(5.0, self.heartbeat_interval / 4))
+
+    def _observe_longpoll(self, events: List[Dict[str, Any]], waited: float) -> None:
+        """Learns the heartbeat interval from a `get_events` response
+        that took `waited` seconds."""
+        # A request that outlasted the timeout was retried, and so
+        # doesn't measure the interval.
+        if (
+            events
+            and all(event["type"] == "heartbeat" for event in events)
+            and waited < self._longpoll_timeout()
+        ):
+            self.heartbeat_interval = waited
+
+    def _longpoll_timed_out(self) -> None:
+        # The interval may have changed since it was measured, so
+        # forget it, unless the server told us what it is; that
+        # doesn't change with the connection, so a retry can find out
+        # quickly whether the new connection is dead too.
+        self.heartbeat_interval = self._registered_heartbeat_interval
+
+    def _report_request(
+        self,
+        method: str,
+        url: str,
+        started: float,
+        attempt: int,
+        status_code: Optional[int] = None,
+        request_bytes: int = 0,
+        response_bytes: int = 0,
+        error: Optional[BaseException] = None,
+    ) -> None:
+        from zulip.metrics import RequestRecord, endpoint_name
+
+        record = RequestRecord(
+            endpoint=endpoint_name(method, url),
+            status_code=status_code,
+            duration=time.monotonic() - started,
+            request_bytes=request_bytes,
+            response_bytes=response_bytes,
+            attempt=attempt,
+            error=None if error is None else type(error).__name__,
+        )
+        for hook in self.request_hooks:
+            hook.on_request(record)
+
+    def _report_coalesce(self, method: str, url: str) -> None:
+        from zulip.metrics import endpoint_name
+
+        endpoint = endpoint_name(method, url)
+        for hook in self.request_hooks:
+            hook.on_coalesce(endpoint)
+
+    def _report_cache(self, method: str, url: str, outcome: str) -> None:
+        from zulip.metrics import endpoint_name
+
+        endpoint = endpoint_name(method, url)
+        for hook in self.request_hooks:
+            hook.on_cache(endpoint, outcome)
+
+    def _report_sleep(self, method: str, url: str, reason: str, seconds: float) -> None:
+        from zulip.metrics import endpoint_name
+
+        endpoint = endpoint_name(method, url)
+        for hook in self.request_hooks:
+            hook.on_sleep(endpoint, reason, seconds)
+
+
+class _Flight:
+    """A GET request made on behalf of several callers; see
+    `Client._send_coalesced`."""
+
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.waiters = 0
+        self.result: Dict[str, Any] = {}
+        self.response_headers: Dict[str, str] = {}
+        self.error: Optional[BaseException] = None
+
+
+class Client(BaseClient):
+    """A blocking client for the Zulip API.
+
+    A single `Client` may be shared by many threads: its HTTP session is
+    created once, and requests reuse connections from its pool.
+    `connection_pool_size` is how many idle keep-alive connections to
+    the server are kept for reuse; threads beyond that still get a
+    connection, which is closed after use.  If `connection_limit_per_host`
+    is set, at most that many connections are opened, and further
+    requests wait for a free one.  With `keep_alive=False`, every request
+    opens (and TLS-handshakes) a new connection.
+
+    Clients created with `share_connections=True` for the same site
+    (and TLS settings) share one HTTP session and connection pool, and
+    send their own credentials with each request; this lets a process
+    running many bots keep a single pool of connections to the server.
+    """
+
+    # Sessions used by clients with share_connections=True, keyed by
+    # everything about them that doesn't depend on the identity.
+    _shared_sessions: ClassVar[Dict[Tuple[Any, ...], "requests.Session"]] = {}
+    _shared_sessions_lock: ClassVar[threading.Lock] = threading.Lock()
+
+    def __init__(
+        self,
+        email: Optional[str] = None,
+        api_key: Optional[str] = None,
+        config_file: Optional[str] = None,
+        verbose: bool = False,
+        retry_on_errors: bool = True,
+        site: Optional[str] = None,
+        client: Optional[str] = None,
+        cert_bundle: Optional[str] = None,
+        insecure: Optional[bool] = None,
+        client_cert: Optional[str] = None,
+        client_cert_key: Optional[str] = None,
+        server_settings_cache: Optional[str] = None,
+        connection_pool_size: int = 10,
+        connection_limit_per_host: int = 0,
+        keep_alive: bool = True,
+        share_connections: bool = False,
+        coalesce_requests: bool = True,
+    ) -> None:
+        super().__init__(
+            email=email,
+            api_key=api_key,
+            config_file=config_file,
+            verbose=verbose,
+            retry_on_errors=retry_on_errors,
+            site=site,
+            client=client,
+            cert_bundle=cert_bundle,
+            insecure=insecure,
+            client_cert=client_cert,
+            client_cert_key=client_cert_key,
+            server_settings_cache=server_settings_cache,
+            coalesce_requests=coalesce_requests,
+        )
+
+        # Passed to requests.adapters.HTTPAdapter; 0 means unlimited.
+        self.connection_pool_size = connection_pool_size
+        self.connection_limit_per_host = connection_limit_per_host
+        self.keep_alive = keep_alive
+        self.share_connections = share_connections
+
+        self.session: Optional["requests.Session"] = None
+        self._session_lock = threading.Lock()
+        self._server_settings_lock = threading.Lock()
+
+        # GET requests in progress; see `_send_coalesced`.
+        self._flights: Dict[Tuple[Any, ...], _Flight] = {}
+        self._flights_lock = threading.Lock()
+
+        # Used for GET requests to the endpoints it lists, if set.
+        self.response_cache: Optional["ResponseCache"] = None
+
+        # Fetched from the server on first access to `zulip_version`
+        # or `feature_level`; see `ensure_server_settings`.
+        self.server_settings: Optional[Dict[str, Any]] = None
+
+    def ensure_server_settings(self) -> Dict[str, Any]:
+        server_settings = self.server_settings
+        if server_settings is not None:
+            return server_settings
+
+        # Only one thread fetches the settings; the others wait for it.
+        with self._server_settings_lock:
+            if self.server_settings is not None:
+                return self.server_settings
+            if self.server_settings_cache is not None:
+                server_settings = self.server_settings_cache.get(self.base_url)
+            if server_settings is None:
+                server_settings = self.get_server_settings()
+                assert server_settings.get("zulip_version") is not None
+                if self.server_settings_cache is not None:
+                    self.server_settings_cache.set(self.base_url, server_settings)
+            self.server_settings = server_settings
+            return server_settings
+
+    def invalidate_server_settings(self) -> None:
+        """Forgets the server settings, including any copy in the
+        on-disk cache, so that they are fetched again on next use
+        (e.g. after the server has been upgraded)."""
+        self.server_settings = None
+        if self.server_settings_cache is not None:
+            self.server_settings_cache.invalidate(self.base_url)
+
+    @property
+    def zulip_version(self) -> Optional[str]:
+        return self.ensure_server_settings().get("zulip_version")
+
+    @property
+    def feature_level(self) -> int:
+        return self.ensure_server_settings().get("zulip_feature_level", 0)
 
     def ensure_session(self) -> None:
         # Check if the session has been created already, and return
@@ -536,6 +1220,34 @@ class Client:
         if self.session:
             return
 
+        if self.share_connections:
+            self.session = self._shared_session()
+            return
+
+        with self._session_lock:
+            if self.session:
+                return
+            self.session = self._make_session()
+
+    def _shared_session(self) -> "requests.Session":
+        key = (
+            self.base_url,
+            self.tls_verification,
+            self.client_cert,
+            self.client_cert_key,
+            self.connection_pool_size,
+            self.connection_limit_per_host,
+            self.keep_alive,
+        )
+        with self._shared_sessions_lock:
+            session = self._shared_sessions.get(key)
+            if session is None:
+                session = self._shared_sessions[key] = self._make_session()
+            return session
+
+    def _make_session(self) -> "requests.Session":
+        import requests
+
         # Build a client cert object for requests
         if self.client_cert_key is not None:
             assert self.client_cert is not None  # Otherwise ZulipError near end of __init__
@@ -548,32 +1260,20 @@ class Client:
 
         # Actually construct the session
         session = requests.Session()
-        session.auth = requests.auth.HTTPBasicAuth(self.email, self.api_key)
+        if not self.share_connections:
+            session.auth = requests.auth.HTTPBasicAuth(self.email, self.api_key)
+            session.headers.update({"User-agent": self.get_user_agent()})
         session.verify = self.tls_verification
         session.cert = client_cert
-        session.headers.update({"User-agent": self.get_user_agent()})
-        self.session = session
-
-    def get_user_agent(self) -> str:
-        vendor = ""
-        vendor_version = ""
-        try:
-            vendor = platform.system()
-            vendor_version = platform.release()
-        except OSError:
-            # If the calling process is handling SIGCHLD, platform.system() can
-            # fail with an IOError.  See http://bugs.python.org/issue9127
-            pass
-
-        if vendor == "Linux":
-            vendor = distro.name()
-            vendor_version = distro.version()
-        elif vendor == "Windows":
-            vendor_version = platform.win32_ver()[1]
-        elif vendor == "Darwin":
-            vendor_version = platform.mac_ver()[0]
-
-        return f"{self.client_name} ({vendor}; {vendor_version})"
+        if not self.keep_alive:
+            session.headers["Connection"] = "close"
+        adapter = requests.adapters.HTTPAdapter(
+            pool_maxsize=self.connection_limit_per_host or self.connection_pool_size,
+            pool_block=self.connection_limit_per_host > 0,
+        )
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
 
     def do_api_query(
         self,
@@ -584,21 +1284,190 @@ class Client:
         files: Optional[List[IO[Any]]] = None,
         timeout: Optional[float] = None,
     ) -> Dict[str, Any]:
-        if files is None:
-            files = []
+        return self._send_cached(
+            encode_request(orig_request), url, method, longpolling, files, timeout
+        )
 
-        # When long-polling, set timeout to 90 sec as a balance
-        # between a low traffic rate and a still reasonable latency
-        # time in case of a connection failure.
-        # Otherwise, 15s should be plenty of time.
-        request_timeout = 90.0 if longpolling else timeout or 15.0
+    def _send_cached(
+        self,
+        request: Dict[str, str],
+        url: str,
+        method: str,
+        longpolling: bool,
+        files: Optional[List[IO[Any]]],
+        timeout: Optional[float],
+        progress: Optional["ProgressCallback"] = None,
+    ) -> Dict[str, Any]:
+        """Sends a request with `_send_coalesced`, using and updating
+        `response_cache` if it is set."""
+        cache = self.response_cache
+        if cache is None or longpolling:
+            return self._send_coalesced(request, url, method, longpolling, files, timeout, progress)
 
-        request = {
-            key: val if isinstance(val, str) else json.dumps(val)
-            for key, val in orig_request.items()
-        }
+        from zulip.metrics import endpoint_name
+        from zulip.response_cache import CachedResponse
+
+        endpoint = endpoint_name(method, url).split(" ", 1)[1]
+        if method != "GET":
+            try:
+                return self._send_coalesced(
+                    request, url, method, longpolling, files, timeout, progress
+                )
+            finally:
+                # Even a failed request may have changed something.
+                cache.invalidate(endpoint)
+        ttl = cache.ttl(endpoint)
+        if ttl is None:
+            return self._send_coalesced(request, url, method, longpolling, files, timeout, progress)
+
+        codec = get_json_codec()
+        key = cache.key(self.base_url, self.email, url, request)
+        cached = cache.get(endpoint, key)
+        if cached is not None and cached.expires_at > time.time():
+            if self.request_hooks:
+                self._report_cache(method, url, "hit")
+            return codec.loads(cached.body)
+
+        request_headers = {}
+        if cached is not None:
+            if cached.etag is not None:
+                request_headers["If-None-Match"] = cached.etag
+            if cached.last_modified is not None:
+                request_headers["If-Modified-Since"] = cached.last_modified
+        response_headers: Dict[str, str] = {}
+        result = self._send_coalesced(
+            request,
+            url,
+            method,
+            longpolling,
+            files,
+            timeout,
+            progress,
+            request_headers,
+            response_headers,
+        )
+        if cached is not None and response_headers.get(":status") == "304":
+            if self.request_hooks:
+                self._report_cache(method, url, "revalidated")
+            cache.set(endpoint, key, cached._replace(expires_at=time.time() + ttl))
+            return codec.loads(cached.body)
+
+        if self.request_hooks:
+            self._report_cache(method, url, "miss")
+        if result.get("result") == "success":
+            cache.set(
+                endpoint,
+                key,
+                CachedResponse(
+                    codec.dumps(result),
+                    time.time() + ttl,
+                    response_headers.get("etag"),
+                    response_headers.get("last-modified"),
+                ),
+            )
+        return result
+
+    def _send_coalesced(
+        self,
+        request: Dict[str, str],
+        url: str,
+        method: str,
+        longpolling: bool,
+        files: Optional[List[IO[Any]]],
+        timeout: Optional[float],
+        progress: Optional["ProgressCallback"] = None,
+        request_headers: Optional[Mapping[str, str]] = None,
+        response_headers: Optional[Dict[str, str]] = None,
+    ) -> Dict[str, Any]:
+        """Sends a request with `_send_request`; but if it's a GET
+        identical to one already in progress, waits for that one's
+        response instead."""
+        if method != "GET" or longpolling or files or not self.coalesce_requests:
+            return self._send_request(
+                request,
+                url,
+                method,
+                longpolling,
+                files,
+                timeout,
+                progress,
+                request_headers,
+                response_headers,
+            )
 
-        req_files = [(f.name, f) for f in files]
+        key = (url, timeout, *sorted(request.items()), *sorted((request_headers or {}).items()))
+        with self._flights_lock:
+            flight = self._flights.get(key)
+            if flight is None:
+                leader = True
+                flight = self._flights[key] = _Flight()
+            else:
+                leader = False
+                flight.waiters += 1
+                self.coalesced_requests += 1
+        if not leader:
+            if self.request_hooks:
+                self._report_coalesce(method, url)
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            if response_headers is not None:
+                response_headers.update(flight.response_headers)
+            return copy.deepcopy(flight.result)
+
+        try:
+            flight.result = self._send_request(
+                request,
+                url,
+                method,
+                longpolling,
+                files,
+                timeout,
+                request_headers=request_headers,
+                response_headers=flight.response_headers,
+            )
+            if response_headers is not None:
+                response_headers.update(flight.response_headers)
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._flights_lock:
+                del self._flights[key]
+            flight.done.set()
+        # If the response is shared, everyone gets their own copy, so
+        # that nobody sees changes another caller makes to it.
+        return copy.deepcopy(flight.result) if flight.waiters else flight.result
+
+    def _send_request(
+        self,
+        request: Dict[str, str],
+        url: str,
+        method: str,
+        longpolling: bool,
+        files: Optional[List[IO[Any]]],
+        timeout: Optional[float],
+        progress: Optional["ProgressCallback"] = None,
+        request_headers: Optional[Mapping[str, str]] = None,
+        response_headers: Optional[Dict[str, str]] = None,
+    ) -> Dict[str, Any]:
+        """Does the work of `do_api_query`, given parameters already
+        encoded by `encode_request` into a dict it may modify.
+
+        `request_headers` are sent with the request, and the response's
+        headers are added to `response_headers`, with lower-case names,
+        along with its status code as ":status" (as in HTTP/2).  A 304
+        Not Modified response, to a conditional request, is returned as
+        an empty dict.
+        """
+        import requests
+
+        from zulip.multipart import MultipartEncoder
+
+        if files is None:
+            files = []
+        # Where to rewind the files to if the request is retried.
+        file_positions = [f.tell() for f in files]
 
         self.ensure_session()
         assert self.session is not None
@@ -608,6 +1477,12 @@ class Client:
             "request": request,
             "failures": 0,
         }
+        # A long-polling request is retried until the server is back,
+        # ever more slowly, so that a struggling server isn't hammered
+        # by every client waiting for events.  Other requests are
+        # retried after a fixed second, so that a call fails within
+        # about 10 seconds if the server doesn't recover.
+        backoff = RandomExponentialBackoff(delay_cap=30.0) if longpolling else None
 
         def error_retry(error_string: str) -> bool:
             if not self.retry_on_errors or query_state["failures"] >= 10:
@@ -625,7 +1500,10 @@ class Client:
                     sys.stdout.write(".")
                 sys.stdout.flush()
             query_state["request"]["dont_block"] = json.dumps(True)
-            time.sleep(1)
+            delay = 1.0 if backoff is None else backoff.fail_without_sleeping()
+            if self.request_hooks:
+                self._report_sleep(method, url, "retry", delay)
+            time.sleep(delay)
             query_state["failures"] += 1
             return True
 
@@ -636,24 +1514,69 @@ class Client:
                 else:
                     print("Failed!")
 
+        attempt = -1
         while True:
+            attempt += 1
+            # When long-polling, time out once a heartbeat is overdue
+            # (which a timeout on a previous attempt may have changed).
+            # Otherwise, 15s should be plenty of time.
+            request_timeout = self._longpoll_timeout() if longpolling else timeout or 15.0
+            # Wait if needed to stay within the server's rate limit.
+            delay = self.rate_limiter.acquire()
+            if delay > 0 and self.request_hooks:
+                self._report_sleep(method, url, "rate_limit", delay)
             try:
-                kwarg = "params" if method == "GET" else "data"
-
-                kwargs = {kwarg: query_state["request"]}
-
-                if files:
-                    kwargs["files"] = req_files
+                kwargs: Dict[str, Any] = {}
+                headers = dict(request_headers or {})
+                request_bytes = None
+                if method == "GET":
+                    kwargs["params"] = query_state["request"]
+                elif files:
+                    # Stream the files rather than reading them into memory.
+                    for f, position in zip(files, file_positions):
+                        f.seek(position)
+                    encoder = MultipartEncoder(query_state["request"], files, progress)
+                    kwargs["data"] = encoder
+                    headers["Content-Type"] = encoder.content_type
+                    request_bytes = len(encoder)
+                else:
+                    kwargs["data"] = query_state["request"]
+                if self.share_connections:
+                    # The session is shared; send this client's identity.
+                    kwargs["auth"] = (self.email, self.api_key)
+                    headers["User-agent"] = self.get_user_agent()
+                if headers:
+                    kwargs["headers"] = headers
 
                 # Actually make the request!
-                res = self.session.request(
-                    method,
-                    urllib.parse.urljoin(self.base_url, url),
-                    timeout=request_timeout,
-                    **kwargs,
-                )
+                started = time.monotonic()
+                try:
+                    res = self.session.request(
+                        method,
+                        urllib.parse.urljoin(self.base_url, url),
+                        timeout=request_timeout,
+                        **kwargs,
+                    )
+                except Exception as e:
+                    if self.request_hooks:
+                        self._report_request(method, url, started, attempt, error=e)
+                    raise
+                if self.request_hooks:
+                    if request_bytes is None:
+                        body = res.request.body
+                        request_bytes = len(body) if isinstance(body, (bytes, str)) else 0
+                    self._report_request(
+                        method,
+                        url,
+                        started,
+                        attempt,
+                        res.status_code,
+                        request_bytes,
+                        len(res.content),
+                    )
 
                 self.has_connected = True
+                self.rate_limiter.update(res.headers)
 
                 # On 50x errors, try again after a short sleep
                 if str(res.status_code).startswith("5") and error_retry(
@@ -672,7 +1595,8 @@ class Client:
                     raise UnrecoverableNetworkError("SSL Error") from e
                 if longpolling:
                     # When longpolling, we expect the timeout to fire,
-                    # and the correct response is to just retry
+                    # and the correct response is to just retry.
+                    self._longpoll_timed_out()
                     continue
                 else:
                     end_error_retry(False)
@@ -695,8 +1619,26 @@ class Client:
                 # We'll split this out into more cases as we encounter new bugs.
                 raise
 
+            if res.status_code == 429 and self.retry_on_errors and query_state["failures"] < 10:
+                # We've been rate limited; try again once the server
+                # says we may (the wait happens in rate_limiter.acquire).
+                retry_after = get_retry_after(res.headers, res.content)
+                if self.verbose:
+                    print(f"zulip API: rate limited -- retrying in {retry_after:.1f}s")
+                self.rate_limiter.rate_limited(retry_after)
+                query_state["failures"] += 1
+                continue
+
+            if response_headers is not None:
+                response_headers.update(
+                    (name.lower(), value) for name, value in res.headers.items()
+                )
+                response_headers[":status"] = str(res.status_code)
+            if res.status_code == 304:
+                end_error_retry(True)
+                return {}
             try:
-                json_result = res.json()
+                json_result = get_json_codec().loads(res.content)
             except Exception:
                 end_error_retry(False)
                 return {
@@ -716,21 +1658,18 @@ class Client:
         longpolling: bool = False,
         files: Optional[List[IO[Any]]] = None,
         timeout: Optional[float] = None,
+        progress: Optional["ProgressCallback"] = None,
     ) -> Dict[str, Any]:
-        if request is None:
-            request = dict()
-        marshalled_request = {}
-        for k, v in request.items():
-            if v is not None:
-                marshalled_request[k] = v
         versioned_url = API_VERSTRING + (url if url is not None else "")
-        return self.do_api_query(
-            marshalled_request,
+        # Parameters whose value is None are omitted.
+        return self._send_cached(
+            encode_request(request or {}, drop_none=True),
             versioned_url,
-            method=method,
-            longpolling=longpolling,
-            files=files,
-            timeout=timeout,
+            method,
+            longpolling,
+            files,
+            timeout,
+            progress,
         )
 
     def call_on_each_event(
@@ -738,32 +1677,114 @@ class Client:
         callback: Callable[[Dict[str, Any]], None],
         event_types: Optional[List[str]] = None,
         narrow: Optional[List[List[str]]] = None,
+        checkpoint_store: Optional["CheckpointStore"] = None,
+        on_queue_lost: Optional[Callable[["EventQueueCheckpoint"], None]] = None,
+        prefetch: int = 0,
         **kwargs: object,
     ) -> None:
+        """
+        Registers an event queue and calls `callback` with each event
+        delivered to it, forever.
+
+        With a `checkpoint_store` (see zulip.checkpoint), the queue's
+        position is saved after every batch of events, and a restarted
+        process resumes the saved queue rather than registering a new
+        one.  If the server has garbage-collected the queue, any events
+        since the last one handled were lost; `on_queue_lost` is called
+        with the lost queue's checkpoint (by default, a warning is
+        logged) and a new queue is registered.
+
+        By default, the next batch of events is only fetched once
+        `callback` has handled the last one.  With `prefetch`, a
+        background thread keeps fetching while `callback` runs, up to
+        that many batches ahead of it; it stops fetching while the
+        buffer is full, leaving further events queued on the server.
+        Fetching a batch tells the server it can forget the events
+        before it, so if the process dies, buffered events are lost
+        even with a `checkpoint_store`.
+        """
+        batches = self._event_batches(event_types, narrow, checkpoint_store, on_queue_lost, kwargs)
+        if prefetch > 0:
+            batches = _prefetch(batches, prefetch)
+
+        with contextlib.closing(batches):
+            for checkpoint, events in batches:
+                for event in events:
+                    if event["type"] == "heartbeat":
+                        # Heartbeat events are sent to clients regardless
+                        # of the client's requested event types, and are
+                        # intended to be an internal part of the Zulip
+                        # longpolling protocol, not something that clients
+                        # need to handle.
+                        continue
+
+                    callback(self._compact_event(event))
+
+                if checkpoint_store is not None:
+                    checkpoint_store.save(checkpoint)
+
+    def _event_batches(
+        self,
+        event_types: Optional[List[str]],
+        narrow: Optional[List[List[str]]],
+        checkpoint_store: Optional["CheckpointStore"],
+        on_queue_lost: Optional[Callable[["EventQueueCheckpoint"], None]],
+        register_kwargs: Dict[str, object],
+    ) -> Generator[Tuple["EventQueueCheckpoint", List[Dict[str, Any]]], None, None]:
+        """Long-polls an event queue for `call_on_each_event`, forever,
+        yielding each batch of events with the checkpoint to save once
+        it's handled; when a queue is registered, an empty batch."""
+        import requests
+
+        from zulip.checkpoint import EventQueueCheckpoint, registration_key, report_lost_queue
+
         if narrow is None:
             narrow = []
 
+        # Back off after errors, so that bugs in this library or
+        # the server can't turn into a DoS attack against the server.
+        backoff = RandomExponentialBackoff(delay_cap=30.0)
+
         def do_register() -> Tuple[str, int]:
             while True:
                 if event_types is None:
-                    res = self.register(None, None, **kwargs)
+                    res = self.register(None, None, **register_kwargs)
                 else:
-                    res = self.register(event_types, narrow, **kwargs)
+                    res = self.register(event_types, narrow, **register_kwargs)
                 if "error" in res["result"]:
                     if self.verbose:
                         print("Server returned error:\n{}".format(res["msg"]))
-                    time.sleep(1)
+                    backoff.fail()
                 else:
+                    if "event_queue_longpoll_timeout_seconds" in res:
+                        self._registered_heartbeat_interval = float(
+                            res["event_queue_longpoll_timeout_seconds"]
+                        )
+                        self.heartbeat_interval = self._registered_heartbeat_interval
                     return (res["queue_id"], res["last_event_id"])
 
+        registration = registration_key(event_types, narrow, register_kwargs)
         queue_id = None
+        if checkpoint_store is not None:
+            checkpoint = checkpoint_store.load()
+            if checkpoint is not None and checkpoint.registration == registration:
+                queue_id, last_event_id = checkpoint.queue_id, checkpoint.last_event_id
+            elif checkpoint is not None:
+                # The queue was registered for other events, so it's of
+                # no use; delete it rather than leave it for the server
+                # to expire.  It may be gone already, so the result is
+                # ignored.
+                self.deregister(checkpoint.queue_id)
+
         # Make long-polling requests with `get_events`. Once a request
-        # has received an answer, pass it to the callback and before
-        # making a new long-polling request.
+        # has received an answer, yield it before making a new
+        # long-polling request.
         while True:
             if queue_id is None:
                 queue_id, last_event_id = do_register()
+                yield EventQueueCheckpoint(queue_id, last_event_id, registration), []
 
+            started = time.monotonic()
             try:
                 res = self.get_events(queue_id=queue_id, last_event_id=last_event_id)
             except (
@@ -773,13 +1794,11 @@ class Client:
             ):
                 if self.verbose:
                     print(f"Connection error fetching events:\n{traceback.format_exc()}")
-                # TODO: Make this use our backoff library
-                time.sleep(1)
+                backoff.fail()
                 continue
             except Exception:
                 print(f"Unexpected error:\n{traceback.format_exc()}")
-                # TODO: Make this use our backoff library
-                time.sleep(1)
+                backoff.fail()
                 continue
 
             if "error" in res["result"]:
@@ -805,40 +1824,126 @@ class Client:
                         # getting new ones.
                         #
                         # Reset queue_id to register a new event queue.
+                        report_lost_queue(
+                            EventQueueCheckpoint(queue_id, last_event_id, registration),
+                            on_queue_lost,
+                        )
                         queue_id = None
-                # Add a pause here to cover against potential bugs in this library
-                # causing a DoS attack against a server when getting errors.
-                # TODO: Make this back off exponentially.
-                time.sleep(1)
+                backoff.fail()
                 continue
 
-            for event in res["events"]:
-                last_event_id = max(last_event_id, int(event["id"]))
-
-                if event["type"] == "heartbeat":
-                    # Heartbeat events are sent to clients regardless
-                    # of the client's requested event types, and are
-                    # intended to be an internal part of the Zulip
-                    # longpolling protocol, not something that clients
-                    # need to handle.
-                    continue
-
-                callback(event)
+            backoff.succeed()
+            self._observe_longpoll(res["events"], time.monotonic() - started)
+            if res["events"]:
+                for event in res["events"]:
+                    last_event_id = max(last_event_id, int(event["id"]))
+                yield EventQueueCheckpoint(queue_id, last_event_id, registration), res["events"]
 
     def call_on_each_message(
-        self, callback: Callable[[Dict[str, Any]], None], **kwargs: object
+        self,
+        callback: Callable[[Dict[str, Any]], None],
+        checkpoint_store: Optional["CheckpointStore"] = None,
+        on_queue_lost: Optional[Callable[["EventQueueCheckpoint"], None]] = None,
+        prefetch: int = 0,
+        **kwargs: object,
     ) -> None:
         def event_callback(event: Dict[str, Any]) -> None:
             if event["type"] == "message":
                 callback(event["message"])
 
-        self.call_on_each_event(event_callback, ["message"], None, **kwargs)
+        self.call_on_each_event(
+            event_callback, ["message"], None, checkpoint_store, on_queue_lost, prefetch, **kwargs
+        )
+
+    def batch(
+        self, max_workers: int = 8, endpoint_limits: Optional[Mapping[str, int]] = None
+    ) -> "Batch":
+        """
+        Returns a context manager for making many API calls concurrently:
+
+        >>> with client.batch(max_workers=8, endpoint_limits={'add_subscriptions': 2}) as batch:
+        ...     futures = [batch.add_reaction(reaction) for reaction in reactions]
+        >>> [future.result() for future in futures]
+        [{'result': 'success', 'msg': ''}, ...]
+
+        A batch used without `with` must be closed with its `close`
+        method.  See zulip.batch.Batch for details.
+        """
+        from zulip.batch import Batch
+
+        return Batch(self, max_workers=max_workers, endpoint_limits=endpoint_limits)
 
     def get_messages(self, message_filters: Dict[str, Any]) -> Dict[str, Any]:
         """
         See examples/get-messages for example usage
         """
-        return self.call_endpoint(url="messages", method="GET", request=message_filters)
+        return self._compact_messages(
+            self.call_endpoint(url="messages", method="GET", request=message_filters)
+        )
+
+    def iter_messages(
+        self,
+        narrow: Sequence[Any] = (),
+        batch_size: int = 1000,
+        direction: Literal["newer", "older"] = "newer",
+        anchor: Optional[Union[int, str]] = None,
+        prefetch: bool = True,
+        **request: Any,
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        Yields every message matching `narrow`, fetching them from the
+        server `batch_size` at a time.  With `direction="newer"`
+        (the default), messages are yielded oldest first, starting from
+        `anchor` (default "oldest"); with `direction="older"`, newest
+        first, starting from `anchor` (default "newest").  Any other
+        keyword arguments are passed on to `get_messages`.
+
+        With `prefetch`, the next page is fetched in a background thread
+        while the caller works through the current one; at most two
+        pages are held in memory at once.  Raises ZulipError if the
+        server returns an error.
+
+        Example usage:
+
+        >>> for message in client.iter_messages([{"operator": "stream", "operand": "devel"}]):
+        ...     print(message["content"])
+        """
+        import concurrent.futures
+
+        if anchor is None:
+            anchor = "oldest" if direction == "newer" else "newest"
+
+        def fetch_page(
+            anchor: Union[int, str], first_page: bool
+        ) -> Tuple[List[Dict[str, Any]], Optional[int]]:
+            result = self.get_messages(
+                _message_page_request(narrow, anchor, first_page, batch_size, direction, request)
+            )
+            return _read_message_page(result, None if first_page else int(anchor), direction)
+
+        executor = (
+            concurrent.futures.ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix="zulip-messages"
+            )
+            if prefetch
+            else None
+        )
+        try:
+            messages, next_anchor = fetch_page(anchor, True)
+            while True:
+                next_page = None
+                if next_anchor is not None and executor is not None:
+                    next_page = executor.submit(fetch_page, next_anchor, False)
+                yield from messages
+                if next_anchor is None:
+                    return
+                if next_page is not None:
+                    messages, next_anchor = next_page.result()
+                else:
+                    messages, next_anchor = fetch_page(next_anchor, False)
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=False, cancel_futures=True)
 
     def check_messages_match_narrow(self, **request: Dict[str, Any]) -> Dict[str, Any]:
         """
@@ -870,11 +1975,181 @@ class Client:
             request=message_data,
         )
 
-    def upload_file(self, file: IO[Any]) -> Dict[str, Any]:
+    def upload_file(
+        self, file: IO[Any], progress: Optional["ProgressCallback"] = None
+    ) -> Dict[str, Any]:
         """
         See examples/upload-file for example usage.
+
+        The file is streamed to the server rather than read into memory;
+        `progress` is called with the number of bytes sent so far and
+        the total as the upload proceeds.
+
+        If the client has an `upload_index` (see zulip.attachments.UploadIndex),
+        and this user has uploaded a file with the same contents before,
+        the earlier upload's URL is returned instead of uploading it again.
+        """
+        if self.upload_index is None:
+            return self.call_endpoint(url="user_uploads", files=[file], progress=progress)
+
+        from zulip.attachments import file_digest
+
+        digest = file_digest(file)
+        url = self.upload_index.lookup(self.base_url, self.email, digest)
+        if url is not None:
+            return {"result": "success", "msg": "", "uri": url, "url": url}
+        result = self.call_endpoint(url="user_uploads", files=[file], progress=progress)
+        if result["result"] == "success":
+            self.upload_index.record(self.base_url, self.email, digest, _uploaded_file_url(result))
+        return result
+
+    def upload_files(
+        self,
+        paths: Sequence[str],
+        max_workers: int = 4,
+        progress: Optional[Callable[[str, int, int], None]] = None,
+    ) -> List[str]:
+        """
+        Uploads files from disk, up to `max_workers` at a time, and
+        returns their /user_uploads/ URLs in the same order.  Raises
+        ZulipError if any upload fails.  `progress` is called as for
+        `upload_file`, with the path being uploaded as first argument.
+
+        >>> client.upload_files(["build.log", "dist/app.tar.gz"])
+        ['/user_uploads/2/1e/.../build.log', '/user_uploads/2/a0/.../app.tar.gz']
+        """
+        from concurrent.futures import ThreadPoolExecutor
+
+        def upload(path: str) -> str:
+            with open(path, "rb") as file:
+                result = self.upload_file(
+                    file, None if progress is None else functools.partial(progress, path)
+                )
+            if result["result"] != "success":
+                raise ZulipError("Error uploading {}: {}".format(path, result.get("msg")))
+            return _uploaded_file_url(result)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(upload, paths))
+
+    def iter_attachment(self, path: str, chunk_size: int = 64 * 1024) -> Iterator[bytes]:
+        """
+        Yields the contents of an uploaded file, given its /user_uploads/
+        link, in chunks of up to `chunk_size` bytes.  If the connection
+        breaks, the download resumes where it stopped.  With an
+        `attachment_cache`, the file is read from the cache if present,
+        and added to it once downloaded.
+
+        >>> for chunk in client.iter_attachment("/user_uploads/2/ab/cdef/cat.png"):
+        ...     out.write(chunk)
+        """
+        path = self._attachment_path(path)
+        if self.attachment_cache is None:
+            yield from self._stream_attachment(path, 0, chunk_size)
+            return
+
+        cached = self.attachment_cache.open(path)
+        if cached is not None:
+            with cached:
+                while chunk := cached.read(chunk_size):
+                    yield chunk
+            return
+        with self.attachment_cache.writer(path) as writer:
+            for chunk in self._stream_attachment(path, 0, chunk_size):
+                writer.write(chunk)
+                yield chunk
+
+    def download_attachment(self, path: str, dest: Union[str, IO[bytes]]) -> None:
+        """
+        Saves an uploaded file, given its /user_uploads/ link, to `dest`:
+        a binary file object, or a filename.  The file is streamed rather
+        than read into memory; see `iter_attachment`.
+
+        When `dest` is a filename, the file is downloaded to `dest + ".part"`
+        and renamed into place once complete; an interrupted download
+        left there is resumed by the next call for the same file.
+
+        >>> client.download_attachment("/user_uploads/2/ab/cdef/cat.png", "cat.png")
         """
-        return self.call_endpoint(url="user_uploads", files=[file])
+        import shutil
+
+        if not isinstance(dest, str):
+            for chunk in self.iter_attachment(path):
+                dest.write(chunk)
+            return
+
+        path = self._attachment_path(path)
+        if self.attachment_cache is not None:
+            cached = self.attachment_cache.open(path)
+            if cached is not None:
+                with cached, open(dest, "wb") as f:
+                    shutil.copyfileobj(cached, f)
+                return
+
+        part, offset = self._open_download(path, dest)
+        with part:
+            for chunk in self._stream_attachment(path, offset, 64 * 1024):
+                part.write(chunk)
+        self._finish_download(dest)
+        if self.attachment_cache is not None:
+            self.attachment_cache.put(path, dest)
+
+    def _stream_attachment(self, path: str, offset: int, chunk_size: int) -> Iterator[bytes]:
+        """Yields the contents of the uploaded file at `path`, starting
+        `offset` bytes in, resuming with a Range request if the
+        connection breaks."""
+        import requests
+
+        self.ensure_session()
+        assert self.session is not None
+
+        failures = 0
+        backoff = RandomExponentialBackoff(delay_cap=30.0)
+        while True:
+            # Temporary URLs are only valid for a minute, so a new one
+            # is fetched for every attempt.
+            result = self.call_endpoint(url=path, method="GET")
+            if result["result"] != "success":
+                raise ZulipError("Error downloading {}: {}".format(path, result.get("msg")))
+            # Ranges would count bytes of the compressed file.
+            headers = {"Accept-Encoding": "identity"}
+            if offset > 0:
+                headers["Range"] = f"bytes={offset}-"
+            try:
+                with self.session.get(
+                    urllib.parse.urljoin(self.base_url, result["url"]),
+                    headers=headers,
+                    stream=True,
+                    timeout=15.0,
+                ) as res:
+                    if res.status_code == 416:
+                        # The range starts at the end of the file.
+                        return
+                    if res.status_code not in (200, 206):
+                        raise ZulipError(f"Error downloading {path}: HTTP {res.status_code}")
+                    # Servers may ignore the Range header and send the
+                    # whole file; skip what we already have.
+                    position = offset if res.status_code == 206 else 0
+                    for chunk in res.iter_content(chunk_size):
+                        start = position
+                        position += len(chunk)
+                        if position > offset:
+                            data = chunk[max(0, offset - start) :]
+                            offset = position
+                            yield data
+            except (
+                requests.exceptions.ConnectionError,
+                requests.exceptions.ChunkedEncodingError,
+                requests.exceptions.Timeout,
+            ):
+                failures += 1
+                if not self.retry_on_errors or failures >= 10:
+                    raise
+                if self.verbose:
+                    print(f"zulip API: download of {path} interrupted -- resuming.")
+                backoff.fail()
+            else:
+                return
 
     def get_attachments(self) -> Dict[str, Any]:
         """
@@ -1785,6 +3060,20 @@ def hash_util_decode(string: str) -> str:
     return urllib.parse.unquote(string.replace(".", "%"))
 
 
+def __getattr__(name: str) -> Any:
+    # `AsyncClient` lives in its own module so that `import zulip`
+    # doesn't require (or pay the import cost of) aiohttp.
+    if name == "AsyncClient":
+        from zulip.async_client import AsyncClient
+
+        return AsyncClient
+    if sys.version_info < (3, 11) and name == "datetime_fromisoformat":
+        from backports.datetime_fromisoformat import datetime_fromisoformat
+
+        return datetime_fromisoformat
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
 ########################################################################
 # The below hackery is designed to allow running the Zulip's automated
 # tests for its API documentation from old server versions against
@@ -0,0 +1,1189 @@
+import asyncio
+import base64
+import contextlib
+import copy
+import functools
+import inspect
+import json
+import shutil
+import ssl
+import sys
+import time
+import traceback
+import urllib.parse
+from typing import (
+    IO,
+    Any,
+    AsyncGenerator,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    Tuple,
+    TypeVar,
+    Union,
+)
+
+import aiohttp
+from typing_extensions import Literal
+
+from zulip import (
+    API_VERSTRING,
+    BaseClient,
+    EditPropagateMode,
+    RandomExponentialBackoff,
+    UnrecoverableNetworkError,
+    ZulipError,
+    _message_page_request,
+    _read_message_page,
+    _uploaded_file_url,
+    encode_request,
+    get_json_codec,
+    get_retry_after,
+    logger,
+)
+from zulip.attachments import file_digest
+from zulip.checkpoint import (
+    CheckpointStore,
+    EventQueueCheckpoint,
+    registration_key,
+    report_lost_queue,
+)
+from zulip.multipart import CHUNK_SIZE, MultipartEncoder, ProgressCallback
+
+# A callback passed to `AsyncClient.call_on_each_event` may either be a
+# plain function or a coroutine function.
+AsyncEventCallback = Callable[[Dict[str, Any]], Union[None, Awaitable[None]]]
+
+_T = TypeVar("_T")
+
+
+async def _stream_body(
+    encoder: MultipartEncoder, progress: Optional[ProgressCallback]
+) -> AsyncIterator[bytes]:
+    # Files are read in a worker thread, as aiohttp does for file
+    # uploads; progress is reported from the event loop's thread.
+    loop = asyncio.get_running_loop()
+    sent = 0
+    while True:
+        chunk = await loop.run_in_executor(None, encoder.read, CHUNK_SIZE)
+        if not chunk:
+            return
+        yield chunk
+        sent += len(chunk)
+        if progress is not None:
+            progress(sent, len(encoder))
+
+
+async def _prefetch(items: AsyncGenerator[_T, None], size: int) -> AsyncGenerator[_T, None]:
+    """Like `zulip._prefetch`, iterating over `items` in another task."""
+    buffer: "asyncio.Queue[Tuple[bool, Any]]" = asyncio.Queue(size)
+
+    async def produce() -> None:
+        try:
+            async for item in items:
+                await buffer.put((True, item))
+        except Exception as e:
+            await buffer.put((False, e))
+        else:
+            await buffer.put((False, None))
+        finally:
+            await items.aclose()
+
+    task = asyncio.ensure_future(produce())
+    try:
+        while True:
+            ok, value = await buffer.get()
+            if not ok:
+                if value is None:
+                    return
+                raise value
+            yield value
+    finally:
+        task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await task
+
+
+class _Flight:
+    """A GET request made on behalf of several callers; see
+    `AsyncClient._send_coalesced`."""
+
+    def __init__(self, task: "asyncio.Future[Dict[str, Any]]") -> None:
+        self.task = task
+        self.waiters = 0
+
+
+class AsyncClient(BaseClient):
+    """An asyncio version of `zulip.Client`.
+
+    It is configured exactly like `zulip.Client` and has the same
+    endpoint methods, except that they are coroutines.  All requests
+    made by one `AsyncClient` share a single pooled `aiohttp` session,
+    so a single event loop can have many requests (including
+    long-polling `get_events` calls) in flight at once.
+
+    Example usage:
+
+    >>> async with zulip.AsyncClient(config_file="~/zuliprc") as client:
+    ...     await client.send_message({"type": "stream", "to": "devel", ...})
+
+    Since attribute access can't be asynchronous, `zulip_version` and
+    `feature_level` are only filled in once `ensure_server_settings`
+    has been awaited.
+    """
+
+    def __init__(
+        self,
+        email: Optional[str] = None,
+        api_key: Optional[str] = None,
+        config_file: Optional[str] = None,
+        verbose: bool = False,
+        retry_on_errors: bool = True,
+        site: Optional[str] = None,
+        client: Optional[str] = None,
+        cert_bundle: Optional[str] = None,
+        insecure: Optional[bool] = None,
+        client_cert: Optional[str] = None,
+        client_cert_key: Optional[str] = None,
+        server_settings_cache: Optional[str] = None,
+        connection_limit: int = 100,
+        connection_limit_per_host: int = 0,
+        coalesce_requests: bool = True,
+    ) -> None:
+        super().__init__(
+            email=email,
+            api_key=api_key,
+            config_file=config_file,
+            verbose=verbose,
+            retry_on_errors=retry_on_errors,
+            site=site,
+            client=client,
+            cert_bundle=cert_bundle,
+            insecure=insecure,
+            client_cert=client_cert,
+            client_cert_key=client_cert_key,
+            server_settings_cache=server_settings_cache,
+            coalesce_requests=coalesce_requests,
+        )
+        # Passed to aiohttp.TCPConnector; 0 means unlimited.
+        self.connection_limit = connection_limit
+        self.connection_limit_per_host = connection_limit_per_host
+
+        self.session: Optional[aiohttp.ClientSession] = None
+
+        # GET requests in progress; see `_send_coalesced`.
+        self._flights: Dict[Tuple[Any, ...], _Flight] = {}
+
+        self.zulip_version: Optional[str] = None
+        self.feature_level: Optional[int] = None
+
+    async def __aenter__(self) -> "AsyncClient":
+        await self.ensure_session()
+        return self
+
+    async def __aexit__(self, *exc_info: object) -> None:
+        await self.close()
+
+    def get_ssl_context(self) -> ssl.SSLContext:
+        if isinstance(self.tls_verification, str):
+            context = ssl.create_default_context(cafile=self.tls_verification)
+        else:
+            context = ssl.create_default_context()
+            if not self.tls_verification:
+                context.check_hostname = False
+                context.verify_mode = ssl.CERT_NONE
+        if self.client_cert is not None:
+            context.load_cert_chain(self.client_cert, self.client_cert_key)
+        return context
+
+    async def ensure_session(self) -> None:
+        # Check if the session has been created already, and return
+        # immediately if so.
+        if self.session is not None and not self.session.closed:
+            return
+
+        connector = aiohttp.TCPConnector(
+            limit=self.connection_limit,
+            limit_per_host=self.connection_limit_per_host,
+            ssl=self.get_ssl_context(),
+        )
+        # aiohttp.BasicAuth is deprecated, and its replacement isn't in
+        # the older versions of aiohttp we support; credentials are
+        # encoded as requests does.
+        credentials = f"{self.email}:{self.api_key}".encode("latin1")
+        self.session = aiohttp.ClientSession(
+            connector=connector,
+            headers={
+                "Authorization": "Basic " + base64.b64encode(credentials).decode(),
+                "User-agent": self.get_user_agent(),
+            },
+        )
+
+    async def close(self) -> None:
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def ensure_server_settings(self) -> None:
+        """Fills in `zulip_version` and `feature_level`, which
+        `zulip.Client` fetches on first use."""
+        if self.zulip_version is not None:
+            return
+        server_settings = None
+        if self.server_settings_cache is not None:
+            server_settings = self.server_settings_cache.get(self.base_url)
+        if server_settings is None:
+            server_settings = await self.get_server_settings()
+            if self.server_settings_cache is not None:
+                self.server_settings_cache.set(self.base_url, server_settings)
+        self.zulip_version = server_settings.get("zulip_version")
+        self.feature_level = server_settings.get("zulip_feature_level", 0)
+        assert self.zulip_version is not None
+
+    def invalidate_server_settings(self) -> None:
+        self.zulip_version = None
+        self.feature_level = None
+        if self.server_settings_cache is not None:
+            self.server_settings_cache.invalidate(self.base_url)
+
+    async def do_api_query(
+        self,
+        orig_request: Mapping[str, Any],
+        url: str,
+        method: str = "POST",
+        longpolling: bool = False,
+        files: Optional[List[IO[Any]]] = None,
+        timeout: Optional[float] = None,
+    ) -> Dict[str, Any]:
+        return await self._send_coalesced(
+            encode_request(orig_request), url, method, longpolling, files, timeout
+        )
+
+    async def _send_coalesced(
+        self,
+        request: Dict[str, str],
+        url: str,
+        method: str,
+        longpolling: bool,
+        files: Optional[List[IO[Any]]],
+        timeout: Optional[float],
+        progress: Optional[ProgressCallback] = None,
+    ) -> Dict[str, Any]:
+        """See `zulip.Client._send_coalesced`."""
+        if method != "GET" or longpolling or files or not self.coalesce_requests:
+            return await self._send_request(
+                request, url, method, longpolling, files, timeout, progress
+            )
+
+        key = (url, timeout, *sorted(request.items()))
+        flight = self._flights.get(key)
+        if flight is None or flight.task.done():
+            # The request runs in a task of its own, so that it carries
+            # on for the others if the caller that started it is
+            # cancelled.
+            flight = self._flights[key] = _Flight(
+                asyncio.ensure_future(
+                    self._send_request(request, url, method, longpolling, files, timeout)
+                )
+            )
+            flight.task.add_done_callback(lambda task: self._end_flight(key, task))
+        else:
+            flight.waiters += 1
+            self.coalesced_requests += 1
+            if self.request_hooks:
+                self._report_coalesce(method, url)
+        result = await asyncio.shield(flight.task)
+        return copy.deepcopy(result) if flight.waiters else result
+
+    def _end_flight(self, key: Tuple[Any, ...], task: "asyncio.Future[Dict[str, Any]]") -> None:
+        flight = self._flights.get(key)
+        if flight is not None and flight.task is task:
+            del self._flights[key]
+
+    async def _send_request(
+        self,
+        request: Dict[str, str],
+        url: str,
+        method: str,
+        longpolling: bool,
+        files: Optional[List[IO[Any]]],
+        timeout: Optional[float],
+        progress: Optional[ProgressCallback] = None,
+    ) -> Dict[str, Any]:
+        """See `zulip.Client._send_request`."""
+        if files is None:
+            files = []
+        file_positions = [f.tell() for f in files]
+
+        await self.ensure_session()
+        assert self.session is not None
+
+        had_error_retry = False
+        failures = 0
+        # See zulip.Client._send_request.
+        backoff = RandomExponentialBackoff(delay_cap=30.0) if longpolling else None
+
+        async def error_retry(error_string: str) -> bool:
+            nonlocal had_error_retry, failures
+            if not self.retry_on_errors or failures >= 10:
+                return False
+            if self.verbose:
+                if not had_error_retry:
+                    sys.stdout.write(
+                        "zulip API({}): connection error{} -- retrying.".format(
+                            url.split(API_VERSTRING, 2)[0],
+                            error_string,
+                        )
+                    )
+                    had_error_retry = True
+                else:
+                    sys.stdout.write(".")
+                sys.stdout.flush()
+            request["dont_block"] = json.dumps(True)
+            delay = 1.0 if backoff is None else backoff.fail_without_sleeping()
+            if self.request_hooks:
+                self._report_sleep(method, url, "retry", delay)
+            await asyncio.sleep(delay)
+            failures += 1
+            return True
+
+        def end_error_retry(succeeded: bool) -> None:
+            if had_error_retry and self.verbose:
+                if succeeded:
+                    print("Success!")
+                else:
+                    print("Failed!")
+
+        attempt = -1
+        while True:
+            attempt += 1
+            # Same timeouts as zulip.Client._send_request.
+            request_timeout = self._longpoll_timeout() if longpolling else timeout or 15.0
+            kwargs: Dict[str, Any] = {}
+            request_bytes = 0
+            if method == "GET":
+                kwargs["params"] = request
+            elif files:
+                for f, position in zip(files, file_positions):
+                    f.seek(position)
+                encoder = MultipartEncoder(request, files)
+                kwargs["data"] = _stream_body(encoder, progress)
+                kwargs["headers"] = {
+                    "Content-Type": encoder.content_type,
+                    "Content-Length": str(len(encoder)),
+                }
+                request_bytes = len(encoder)
+            else:
+                kwargs["data"] = request
+                request_bytes = len(urllib.parse.urlencode(request))
+
+            # Wait if needed to stay within the server's rate limit.
+            delay = self.rate_limiter.reserve()
+            if delay > 0:
+                if self.request_hooks:
+                    self._report_sleep(method, url, "rate_limit", delay)
+                await asyncio.sleep(delay)
+
+            started = time.monotonic()
+            try:
+                # Actually make the request!
+                async with self.session.request(
+                    method,
+                    urllib.parse.urljoin(self.base_url, url),
+                    timeout=aiohttp.ClientTimeout(total=request_timeout),
+                    **kwargs,
+                ) as res:
+                    self.has_connected = True
+                    self.rate_limiter.update(res.headers)
+                    body = await res.read()
+                    if self.request_hooks:
+                        self._report_request(
+                            method,
+                            url,
+                            started,
+                            attempt,
+                            res.status,
+                            request_bytes,
+                            len(body),
+                        )
+
+                    # On 50x errors, try again after a short sleep
+                    if 500 <= res.status < 600 and await error_retry(f" (server {res.status})"):
+                        continue
+
+                    if res.status == 429 and self.retry_on_errors and failures < 10:
+                        # Rate limited; the next reserve() waits it out.
+                        retry_after = get_retry_after(res.headers, body)
+                        if self.verbose:
+                            print(f"zulip API: rate limited -- retrying in {retry_after:.1f}s")
+                        self.rate_limiter.rate_limited(retry_after)
+                        failures += 1
+                        continue
+
+                    try:
+                        json_result = get_json_codec().loads(body)
+                    except ValueError:
+                        json_result = None
+                    status_code = res.status
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if self.request_hooks:
+                    self._report_request(method, url, started, attempt, error=e)
+                if isinstance(e, (aiohttp.ClientSSLError, aiohttp.ServerFingerprintMismatch)):
+                    raise UnrecoverableNetworkError("SSL Error") from e
+                if isinstance(e, asyncio.TimeoutError):
+                    if longpolling:
+                        # When longpolling, we expect the timeout to fire,
+                        # and the correct response is to just retry; see
+                        # zulip.Client._send_request.
+                        self._longpoll_timed_out()
+                        continue
+                    end_error_retry(False)
+                    raise
+                if isinstance(e, aiohttp.ClientConnectionError):
+                    if not self.has_connected:
+                        # If we have never successfully connected to the server, don't
+                        # go into retry logic; see zulip.Client.do_api_query.
+                        raise UnrecoverableNetworkError(
+                            "cannot connect to server " + self.base_url
+                        ) from e
+
+                    if await error_retry(""):
+                        continue
+                    end_error_retry(False)
+                raise
+
+            if not isinstance(json_result, dict):
+                end_error_retry(False)
+                return {
+                    "msg": "Unexpected error from the server",
+                    "result": "http-error",
+                    "status_code": status_code,
+                }
+
+            end_error_retry(True)
+            return json_result
+
+    async def call_endpoint(
+        self,
+        url: Optional[str] = None,
+        method: str = "POST",
+        request: Optional[Dict[str, Any]] = None,
+        longpolling: bool = False,
+        files: Optional[List[IO[Any]]] = None,
+        timeout: Optional[float] = None,
+        progress: Optional[ProgressCallback] = None,
+    ) -> Dict[str, Any]:
+        versioned_url = API_VERSTRING + (url if url is not None else "")
+        # Parameters whose value is None are omitted.
+        return await self._send_coalesced(
+            encode_request(request or {}, drop_none=True),
+            versioned_url,
+            method,
+            longpolling,
+            files,
+            timeout,
+            progress,
+        )
+
+    async def call_on_each_event(
+        self,
+        callback: AsyncEventCallback,
+        event_types: Optional[List[str]] = None,
+        narrow: Optional[List[List[str]]] = None,
+        checkpoint_store: Optional[CheckpointStore] = None,
+        on_queue_lost: Optional[Callable[[EventQueueCheckpoint], None]] = None,
+        prefetch: int = 0,
+        **kwargs: object,
+    ) -> None:
+        """Like `zulip.Client.call_on_each_event`; `callback` may also be
+        a coroutine function, in which case it is awaited before the
+        next event is handled.  With `prefetch`, batches are fetched
+        ahead of `callback` by another task."""
+        batches = self._event_batches(event_types, narrow, checkpoint_store, on_queue_lost, kwargs)
+        if prefetch > 0:
+            batches = _prefetch(batches, prefetch)
+
+        try:
+            async for checkpoint, events in batches:
+                for event in events:
+                    if event["type"] == "heartbeat":
+                        continue
+
+                    result = callback(self._compact_event(event))
+                    if inspect.isawaitable(result):
+                        await result
+
+                if checkpoint_store is not None:
+                    checkpoint_store.save(checkpoint)
+        finally:
+            await batches.aclose()
+
+    async def _event_batches(
+        self,
+        event_types: Optional[List[str]],
+        narrow: Optional[List[List[str]]],
+        checkpoint_store: Optional[CheckpointStore],
+        on_queue_lost: Optional[Callable[[EventQueueCheckpoint], None]],
+        register_kwargs: Dict[str, object],
+    ) -> AsyncGenerator[Tuple[EventQueueCheckpoint, List[Dict[str, Any]]], None]:
+        """Like `zulip.Client._event_batches`."""
+        if narrow is None:
+            narrow = []
+
+        backoff = RandomExponentialBackoff(delay_cap=30.0)
+
+        async def do_register() -> Tuple[str, int]:
+            while True:
+                if event_types is None:
+                    res = await self.register(None, None, **register_kwargs)
+                else:
+                    res = await self.register(event_types, narrow, **register_kwargs)
+                if "error" in res["result"]:
+                    if self.verbose:
+                        print("Server returned error:\n{}".format(res["msg"]))
+                    await asyncio.sleep(backoff.fail_without_sleeping())
+                else:
+                    if "event_queue_longpoll_timeout_seconds" in res:
+                        self._registered_heartbeat_interval = float(
+                            res["event_queue_longpoll_timeout_seconds"]
+                        )
+                        self.heartbeat_interval = self._registered_heartbeat_interval
+                    return (res["queue_id"], res["last_event_id"])
+
+        registration = registration_key(event_types, narrow, register_kwargs)
+        queue_id = None
+        if checkpoint_store is not None:
+            checkpoint = checkpoint_store.load()
+            if checkpoint is not None and checkpoint.registration == registration:
+                queue_id, last_event_id = checkpoint.queue_id, checkpoint.last_event_id
+            elif checkpoint is not None:
+                # The queue was registered for other events, so it's of
+                # no use; delete it rather than leave it for the server
+                # to expire.  It may be gone already, so the result is
+                # ignored.
+                await self.deregister(checkpoint.queue_id)
+
+        while True:
+            if queue_id is None:
+                queue_id, last_event_id = await do_register()
+                yield EventQueueCheckpoint(queue_id, last_event_id, registration), []
+
+            started = time.monotonic()
+            try:
+                res = await self.get_events(queue_id=queue_id, last_event_id=last_event_id)
+            except (asyncio.TimeoutError, aiohttp.ClientError):
+                if self.verbose:
+                    print(f"Connection error fetching events:\n{traceback.format_exc()}")
+                await asyncio.sleep(backoff.fail_without_sleeping())
+                continue
+            except Exception:
+                print(f"Unexpected error:\n{traceback.format_exc()}")
+                await asyncio.sleep(backoff.fail_without_sleeping())
+                continue
+
+            if "error" in res["result"]:
+                if res["result"] == "http-error":
+                    if self.verbose:
+                        print("HTTP error fetching events -- probably a server restart")
+                else:
+                    if self.verbose:
+                        print("Server returned error:\n{}".format(res["msg"]))
+                    if res.get("code") == "BAD_EVENT_QUEUE_ID" or res["msg"].startswith(
+                        "Bad event queue id:"
+                    ):
+                        # Our event queue went away; register a new one.
+                        report_lost_queue(
+                            EventQueueCheckpoint(queue_id, last_event_id, registration),
+                            on_queue_lost,
+                        )
+                        queue_id = None
+                await asyncio.sleep(backoff.fail_without_sleeping())
+                continue
+
+            backoff.succeed()
+            self._observe_longpoll(res["events"], time.monotonic() - started)
+            if res["events"]:
+                for event in res["events"]:
+                    last_event_id = max(last_event_id, int(event["id"]))
+                yield EventQueueCheckpoint(queue_id, last_event_id, registration), res["events"]
+
+    async def call_on_each_message(
+        self,
+        callback: AsyncEventCallback,
+        checkpoint_store: Optional[CheckpointStore] = None,
+        on_queue_lost: Optional[Callable[[EventQueueCheckpoint], None]] = None,
+        prefetch: int = 0,
+        **kwargs: object,
+    ) -> None:
+        async def event_callback(event: Dict[str, Any]) -> None:
+            if event["type"] == "message":
+                result = callback(event["message"])
+                if inspect.isawaitable(result):
+                    await result
+
+        await self.call_on_each_event(
+            event_callback, ["message"], None, checkpoint_store, on_queue_lost, prefetch, **kwargs
+        )
+
+    # The endpoint methods below mirror those of zulip.Client; see
+    # there for documentation and example usage.
+
+    async def get_messages(self, message_filters: Dict[str, Any]) -> Dict[str, Any]:
+        return self._compact_messages(
+            await self.call_endpoint(url="messages", method="GET", request=message_filters)
+        )
+
+    async def iter_messages(
+        self,
+        narrow: Sequence[Any] = (),
+        batch_size: int = 1000,
+        direction: Literal["newer", "older"] = "newer",
+        anchor: Optional[Union[int, str]] = None,
+        prefetch: bool = True,
+        **request: Any,
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """Like `zulip.Client.iter_messages`, as an asynchronous iterator;
+        with `prefetch`, the next page is fetched in a task."""
+        if anchor is None:
+            anchor = "oldest" if direction == "newer" else "newest"
+
+        async def fetch_page(
+            anchor: Union[int, str], first_page: bool
+        ) -> Tuple[List[Dict[str, Any]], Optional[int]]:
+            result = await self.get_messages(
+                _message_page_request(narrow, anchor, first_page, batch_size, direction, request)
+            )
+            return _read_message_page(result, None if first_page else int(anchor), direction)
+
+        next_page: Optional[asyncio.Future[Tuple[List[Dict[str, Any]], Optional[int]]]] = None
+        try:
+            messages, next_anchor = await fetch_page(anchor, True)
+            while True:
+                if next_anchor is not None and prefetch:
+                    next_page = asyncio.ensure_future(fetch_page(next_anchor, False))
+                for message in messages:
+                    yield message
+                if next_anchor is None:
+                    return
+                if next_page is not None:
+                    messages, next_anchor = await next_page
+                    next_page = None
+                else:
+                    messages, next_anchor = await fetch_page(next_anchor, False)
+        finally:
+            if next_page is not None:
+                next_page.cancel()
+
+    async def check_messages_match_narrow(self, **request: Dict[str, Any]) -> Dict[str, Any]:
+        return await self.call_endpoint(
+            url="messages/matches_narrow", method="GET", request=request
+        )
+
+    async def get_raw_message(self, message_id: int, apply_markdown: bool = True) -> Dict[str, str]:
+        return await self.call_endpoint(
+            url=f"messages/{message_id}",
+            method="GET",
+            request={"apply_markdown": apply_markdown},
+        )
+
+    async def send_message(self, message_data: Dict[str, Any]) -> Dict[str, Any]:
+        return await self.call_endpoint(url="messages", request=message_data)
+
+    async def upload_file(
+        self, file: IO[Any], progress: Optional[ProgressCallback] = None
+    ) -> Dict[str, Any]:
+        if self.upload_index is None:
+            return await self.call_endpoint(url="user_uploads", files=[file], progress=progress)
+
+        # Hashing large files takes a while; do it off the event loop.
+        digest = await asyncio.get_running_loop().run_in_executor(None, file_digest, file)
+        url = self.upload_index.lookup(self.base_url, self.email, digest)
+        if url is not None:
+            return {"result": "success", "msg": "", "uri": url, "url": url}
+        result = await self.call_endpoint(url="user_uploads", files=[file], progress=progress)
+        if result["result"] == "success":
+            self.upload_index.record(self.base_url, self.email, digest, _uploaded_file_url(result))
+        return result
+
+    async def upload_files(
+        self,
+        paths: Sequence[str],
+        max_workers: int = 4,
+        progress: Optional[Callable[[str, int, int], None]] = None,
+    ) -> List[str]:
+        semaphore = asyncio.Semaphore(max_workers)
+
+        async def upload(path: str) -> str:
+            async with semaphore:
+                with open(path, "rb") as file:
+                    result = await self.upload_file(
+                        file, None if progress is None else functools.partial(progress, path)
+                    )
+            if result["result"] != "success":
+                raise ZulipError("Error uploading {}: {}".format(path, result.get("msg")))
+            return _uploaded_file_url(result)
+
+        return list(await asyncio.gather(*(upload(path) for path in paths)))
+
+    async def iter_attachment(self, path: str, chunk_size: int = 64 * 1024) -> AsyncIterator[bytes]:
+        path = self._attachment_path(path)
+        if self.attachment_cache is None:
+            async for chunk in self._stream_attachment(path, 0, chunk_size):
+                yield chunk
+            return
+
+        cached = self.attachment_cache.open(path)
+        if cached is not None:
+            with cached:
+                while chunk := cached.read(chunk_size):
+                    yield chunk
+            return
+        with self.attachment_cache.writer(path) as writer:
+            async for chunk in self._stream_attachment(path, 0, chunk_size):
+                writer.write(chunk)
+                yield chunk
+
+    async def download_attachment(self, path: str, dest: Union[str, IO[bytes]]) -> None:
+        """See `zulip.Client.download_attachment`."""
+        if not isinstance(dest, str):
+            async for chunk in self.iter_attachment(path):
+                dest.write(chunk)
+            return
+
+        path = self._attachment_path(path)
+        if self.attachment_cache is not None:
+            cached = self.attachment_cache.open(path)
+            if cached is not None:
+                with cached, open(dest, "wb") as f:
+                    shutil.copyfileobj(cached, f)
+                return
+
+        part, offset = self._open_download(path, dest)
+        with part:
+            async for chunk in self._stream_attachment(path, offset, 64 * 1024):
+                part.write(chunk)
+        self._finish_download(dest)
+        if self.attachment_cache is not None:
+            self.attachment_cache.put(path, dest)
+
+    async def _stream_attachment(
+        self, path: str, offset: int, chunk_size: int
+    ) -> AsyncIterator[bytes]:
+        """See `zulip.Client._stream_attachment`."""
+        await self.ensure_session()
+        assert self.session is not None
+
+        failures = 0
+        backoff = RandomExponentialBackoff(delay_cap=30.0)
+        while True:
+            result = await self.call_endpoint(url=path, method="GET")
+            if result["result"] != "success":
+                raise ZulipError("Error downloading {}: {}".format(path, result.get("msg")))
+            headers = {"Accept-Encoding": "identity"}
+            if offset > 0:
+                headers["Range"] = f"bytes={offset}-"
+            try:
+                async with self.session.get(
+                    urllib.parse.urljoin(self.base_url, result["url"]),
+                    headers=headers,
+                    timeout=aiohttp.ClientTimeout(sock_connect=15.0, sock_read=15.0),
+                ) as res:
+                    if res.status == 416:
+                        return
+                    if res.status not in (200, 206):
+                        raise ZulipError(f"Error downloading {path}: HTTP {res.status}")
+                    position = offset if res.status == 206 else 0
+                    async for chunk in res.content.iter_chunked(chunk_size):
+                        start = position
+                        position += len(chunk)
+                        if position > offset:
+                            data = chunk[max(0, offset - start) :]
+                            offset = position
+                            yield data
+            except (
+                aiohttp.ClientPayloadError,
+                aiohttp.ClientConnectionError,
+                asyncio.TimeoutError,
+            ):
+                failures += 1
+                if not self.retry_on_errors or failures >= 10:
+                    raise
+                if self.verbose:
+                    print(f"zulip API: download of {path} interrupted -- resuming.")
+                await asyncio.sleep(backoff.fail_without_sleeping())
+            else:
+                return
+
+    async def get_attachments(self) -> Dict[str, Any]:
+        return await self.call_endpoint(url="attachments", method="GET")
+
+    async def update_message(self, message_data: Dict[str, Any]) -> Dict[str, Any]:
+        return await self.call_endpoint(
+            url="messages/%d" % (message_data["message_id"],),
+            method="PATCH",
+            request=message_data,
+        )
+
+    async def delete_message(self, message_id: int) -> Dict[str, Any]:
+        return await self.call_endpoint(url=f"messages/{message_id}", method="DELETE")
+
+    async def update_message_flags(self, update_data: Dict[str, Any]) -> Dict[str, Any]:
+        return await self.call_endpoint(url="messages/flags", method="POST", request=update_data)
+
+    async def mark_all_as_read(self) -> Dict[str, Any]:
+        return await self.call_endpoint(url="mark_all_as_read", method="POST")
+
+    async def mark_stream_as_read(self, stream_id: int) -> Dict[str, Any]:
+        return await self.call_endpoint(
+            url="mark_stream_as_read",
+            method="POST",
+            request={"stream_id": stream_id},
+        )
+
+    async def mark_topic_as_read(self, stream_id: int, topic_name: str) -> Dict[str, Any]:
+        return await self.call_endpoint(
+            url="mark_topic_as_read",
+            method="POST",
+            request={
+                "stream_id": stream_id,
+                "topic_name": topic_name,
+            },
+        )
+
+    async def get_message_history(self, message_id: int) -> Dict[str, Any]:
+        return await self.call_endpoint(url=f"messages/{message_id}/history", method="GET")
+
+    async def add_reaction(self, reaction_data: Dict[str, Any]) -> Dict[str, Any]:
+        return await self.call_endpoint(
+            url="messages/{}/reactions".format(reaction_data["message_id"]),
+            method="POST",
+            request=reaction_data,
+        )
+
+    async def remove_reaction(self, reaction_data: Dict[str, Any]) -> Dict[str, Any]:
+        return await self.call_endpoint(
+            url="messages/{}/reactions".format(reaction_data["message_id"]),
+            method="DELETE",
+            request=reaction_data,
+        )
+
+    async def get_realm_emoji(self) -> Dict[str, Any]:
+        return await self.call_endpoint(url="realm/emoji", method="GET")
+
+    async def upload_custom_emoji(self, emoji_name: str, file_obj: IO[Any]) -> Dict[str, Any]:
+        return await self.call_endpoint(
+            f"realm/emoji/{emoji_name}", method="POST", files=[file_obj]
+        )
+
+    async def delete_custom_emoji(self, emoji_name: str) -> Dict[str, Any]:
+        return await self.call_endpoint(url=f"realm/emoji/{emoji_name}", method="DELETE")
+
+    async def get_realm_linkifiers(self) -> Dict[str, Any]:
+        return await self.call_endpoint(url="realm/linkifiers", method="GET")
+
+    async def add_realm_filter(self, pattern: str, url_template: str) -> Dict[str, Any]:
+        await self.ensure_server_settings()
+        assert self.feature_level is not None
+        data = {"pattern": pattern}
+        if self.feature_level >= 176:
+            # Starting from feature level 176, we use RFC 6570 compliant URL
+            # templates instead.
+            data["url_template"] = url_template
+        else:
+            data["url_format_string"] = url_template
+        return await self.call_endpoint(url="realm/filters", method="POST", request=data)
+
+    async def remove_realm_filter(self, filter_id: int) -> Dict[str, Any]:
+        return await self.call_endpoint(url=f"realm/filters/{filter_id}", method="DELETE")
+
+    async def get_realm_profile_fields(self) -> Dict[str, Any]:
+        return await self.call_endpoint(url="realm/profile_fields", method="GET")
+
+    async def create_realm_profile_field(self, **request: Any) -> Dict[str, Any]:
+        return await self.call_endpoint(url="realm/profile_fields", method="POST", request=request)
+
+    async def remove_realm_profile_field(self, field_id: int) -> Dict[str, Any]:
+        return await self.call_endpoint(url=f"realm/profile_fields/{field_id}", method="DELETE")
+
+    async def reorder_realm_profile_fields(self, **request: Any) -> Dict[str, Any]:
+        return await self.call_endpoint(url="realm/profile_fields", method="PATCH", request=request)
+
+    async def update_realm_profile_field(self, field_id: int, **request: Any) -> Dict[str, Any]:
+        return await self.call_endpoint(
+            url=f"realm/profile_fields/{field_id}", method="PATCH", request=request
+        )
+
+    async def get_server_settings(self) -> Dict[str, Any]:
+        return await self.call_endpoint(url="server_settings", method="GET")
+
+    async def get_events(self, **request: Any) -> Dict[str, Any]:
+        return await self.call_endpoint(
+            url="events", method="GET", longpolling=True, request=request
+        )
+
+    async def register(
+        self,
+        event_types: Optional[Iterable[str]] = None,
+        narrow: Optional[List[List[str]]] = None,
+        **kwargs: object,
+    ) -> Dict[str, Any]:
+        if narrow is None:
+            narrow = []
+
+        request = dict(event_types=event_types, narrow=narrow, **kwargs)
+
+        return await self.call_endpoint(url="register", request=request)
+
+    async def deregister(self, queue_id: str, timeout: Optional[float] = None) -> Dict[str, Any]:
+        request = dict(queue_id=queue_id)
+
+        return await self.call_endpoint(
+            url="events", method="DELETE", request=request, timeout=timeout
+        )
+
+    async def get_profile(self, request: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        return await self.call_endpoint(url="users/me", method="GET", request=request)
+
+    async def get_user_presence(self, email: str) -> Dict[str, Any]:
+        return await self.call_endpoint(url=f"users/{email}/presence", method="GET")
+
+    async def get_realm_presence(self) -> Dict[str, Any]:
+        return await self.call_endpoint(url="realm/presence", method="GET")
+
+    async def update_presence(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        return await self.call_endpoint(url="users/me/presence", method="POST", request=request)
+
+    async def get_streams(self, **request: Any) -> Dict[str, Any]:
+        return await self.call_endpoint(url="streams", method="GET", request=request)
+
+    async def update_stream(self, stream_data: Dict[str, Any]) -> Dict[str, Any]:
+        return await self.call_endpoint(
+            url="streams/{}".format(stream_data["stream_id"]),
+            method="PATCH",
+            request=stream_data,
+        )
+
+    async def delete_stream(self, stream_id: int) -> Dict[str, Any]:
+        return await self.call_endpoint(url=f"streams/{stream_id}", method="DELETE")
+
+    async def add_default_stream(self, stream_id: int) -> Dict[str, Any]:
+        return await self.call_endpoint(
+            url="default_streams", method="POST", request={"stream_id": stream_id}
+        )
+
+    async def get_user_by_id(self, user_id: int, **request: Any) -> Dict[str, Any]:
+        return await self.call_endpoint(url=f"users/{user_id}", method="GET", request=request)
+
+    async def deactivate_user_by_id(self, user_id: int) -> Dict[str, Any]:
+        return await self.call_endpoint(url=f"users/{user_id}", method="DELETE")
+
+    async def reactivate_user_by_id(self, user_id: int) -> Dict[str, Any]:
+        return await self.call_endpoint(url=f"users/{user_id}/reactivate", method="POST")
+
+    async def update_user_by_id(self, user_id: int, **request: Any) -> Dict[str, Any]:
+        if "full_name" in request:
+            await self.ensure_server_settings()
+            assert self.feature_level is not None
+            if self.feature_level < 106:
+                # See zulip.Client.update_user_by_id.
+                request["full_name"] = json.dumps(request["full_name"])
+
+        return await self.call_endpoint(url=f"users/{user_id}", method="PATCH", request=request)
+
+    async def get_users(self, request: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        return await self.call_endpoint(url="users", method="GET", request=request)
+
+    async def get_members(self, request: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        return await self.get_users(request=request)
+
+    async def get_alert_words(self) -> Dict[str, Any]:
+        return await self.call_endpoint(url="users/me/alert_words", method="GET")
+
+    async def add_alert_words(self, alert_words: List[str]) -> Dict[str, Any]:
+        return await self.call_endpoint(
+            url="users/me/alert_words", method="POST", request={"alert_words": alert_words}
+        )
+
+    async def remove_alert_words(self, alert_words: List[str]) -> Dict[str, Any]:
+        return await self.call_endpoint(
+            url="users/me/alert_words", method="DELETE", request={"alert_words": alert_words}
+        )
+
+    async def get_subscriptions(self, request: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        return await self.call_endpoint(url="users/me/subscriptions", method="GET", request=request)
+
+    async def list_subscriptions(self, request: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        logger.warning(
+            "list_subscriptions() is deprecated. Please use get_subscriptions() instead."
+        )
+        return await self.get_subscriptions(request)
+
+    async def add_subscriptions(
+        self, streams: Iterable[Dict[str, Any]], **kwargs: Any
+    ) -> Dict[str, Any]:
+        request = dict(subscriptions=streams, **kwargs)
+
+        return await self.call_endpoint(url="users/me/subscriptions", request=request)
+
+    async def remove_subscriptions(
+        self,
+        streams: Iterable[str],
+        principals: Optional[Union[Sequence[str], Sequence[int]]] = None,
+    ) -> Dict[str, Any]:
+        request: Dict[str, object] = dict(subscriptions=streams)
+        if principals is not None:
+            request["principals"] = principals
+        return await self.call_endpoint(
+            url="users/me/subscriptions", method="DELETE", request=request
+        )
+
+    async def get_subscription_status(self, user_id: int, stream_id: int) -> Dict[str, Any]:
+        return await self.call_endpoint(
+            url=f"users/{user_id}/subscriptions/{stream_id}", method="GET"
+        )
+
+    async def mute_topic(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        return await self.call_endpoint(
+            url="users/me/subscriptions/muted_topics", method="PATCH", request=request
+        )
+
+    async def update_subscription_settings(
+        self, subscription_data: List[Dict[str, Any]]
+    ) -> Dict[str, Any]:
+        return await self.call_endpoint(
+            url="users/me/subscriptions/properties",
+            method="POST",
+            request={"subscription_data": subscription_data},
+        )
+
+    async def update_notification_settings(
+        self, notification_settings: Dict[str, Any]
+    ) -> Dict[str, Any]:
+        return await self.call_endpoint(
+            url="settings/notifications", method="PATCH", request=notification_settings
+        )
+
+    async def get_stream_id(self, stream: str) -> Dict[str, Any]:
+        stream_encoded = urllib.parse.quote(stream, safe="")
+        url = f"get_stream_id?stream={stream_encoded}"
+        return await self.call_endpoint(url=url, method="GET", request=None)
+
+    async def get_stream_topics(self, stream_id: int) -> Dict[str, Any]:
+        return await self.call_endpoint(url=f"users/me/{stream_id}/topics", method="GET")
+
+    async def get_stream_email_address(self, stream_id: int) -> Dict[str, Any]:
+        return await self.call_endpoint(url=f"streams/{stream_id}/email_address", method="GET")
+
+    async def get_user_groups(self) -> Dict[str, Any]:
+        return await self.call_endpoint(url="user_groups", method="GET")
+
+    async def create_user_group(self, group_data: Dict[str, Any]) -> Dict[str, Any]:
+        return await self.call_endpoint(url="user_groups/create", method="POST", request=group_data)
+
+    async def update_user_group(self, group_data: Dict[str, Any]) -> Dict[str, Any]:
+        return await self.call_endpoint(
+            url="user_groups/{}".format(group_data["group_id"]),
+            method="PATCH",
+            request=group_data,
+        )
+
+    async def remove_user_group(self, group_id: int) -> Dict[str, Any]:
+        return await self.call_endpoint(url=f"user_groups/{group_id}", method="DELETE")
+
+    async def update_user_group_members(
+        self, user_group_id: int, group_data: Dict[str, Any]
+    ) -> Dict[str, Any]:
+        return await self.call_endpoint(
+            url=f"user_groups/{user_group_id}/members", method="POST", request=group_data
+        )
+
+    async def get_subscribers(self, **request: Any) -> Dict[str, Any]:
+        response = await self.get_stream_id(request["stream"])
+        if response["result"] == "error":
+            return response
+
+        stream_id = response["stream_id"]
+        url = "streams/%d/members" % (stream_id,)
+        return await self.call_endpoint(url=url, method="GET", request=request)
+
+    async def render_message(self, request: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        return await self.call_endpoint(url="messages/render", method="POST", request=request)
+
+    async def create_user(self, request: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        return await self.call_endpoint(method="POST", url="users", request=request)
+
+    async def update_storage(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        return await self.call_endpoint(url="bot_storage", method="PUT", request=request)
+
+    async def get_storage(self, request: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        return await self.call_endpoint(url="bot_storage", method="GET", request=request)
+
+    async def set_typing_status(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        return await self.call_endpoint(url="typing", method="POST", request=request)
+
+    async def move_topic(
+        self,
+        stream: str,
+        new_stream: str,
+        topic: str,
+        new_topic: Optional[str] = None,
+        message_id: Optional[int] = None,
+        propagate_mode: EditPropagateMode = "change_all",
+        notify_old_topic: bool = True,
+        notify_new_topic: bool = True,
+    ) -> Dict[str, Any]:
+        # get IDs for source and target streams
+        result = await self.get_stream_id(stream)
+        if result["result"] != "success":
+            return result
+        stream_id = result["stream_id"]
+
+        result = await self.get_stream_id(new_stream)
+        if result["result"] != "success":
+            return result
+        new_stream_id = result["stream_id"]
+
+        if message_id is None:
+            if propagate_mode != "change_all":
+                raise AttributeError(
+                    'A message_id must be provided if propagate_mode isn\'t "change_all"'
+                )
+
+            # ask the server for the latest message ID in the topic.
+            result = await self.get_messages(
+                {
+                    "anchor": "newest",
+                    "narrow": [
+                        {"operator": "stream", "operand": stream_id},
+                        {"operator": "topic", "operand": topic},
+                    ],
+                    "num_before": 1,
+                    "num_after": 0,
+                }
+            )
+
+            if result["result"] != "success":
+                return result
+
+            if len(result["messages"]) <= 0:
+                return {"result": "error", "msg": f'No messages found in topic: "{topic}"'}
+
+            message_id = result["messages"][0]["id"]
+
+        # move topic containing message to new stream
+        request = {
+            "stream_id": new_stream_id,
+            "propagate_mode": propagate_mode,
+            "topic": new_topic,
+            "send_notification_to_old_thread": notify_old_topic,
+            "send_notification_to_new_thread": notify_new_topic,
+        }
+        return await self.call_endpoint(
+            url=f"messages/{message_id}", method="PATCH", request=request
+        )
@@ -0,0 +1,243 @@
+import contextlib
+import hashlib
+import os
+import tempfile
+import time
+from typing import IO, TYPE_CHECKING, Any, Iterator, Optional
+
+from zulip import ZulipError
+
+if TYPE_CHECKING:
+    import sqlite3
+
+    from zulip import Client
+
+# How much of a file is read or written at a time.
+CHUNK_SIZE = 64 * 1024
+
+
+class AttachmentCache:
+    """An on-disk cache of downloaded uploaded files, used by
+    `download_attachment` and `iter_attachment` when set as a client's
+    `attachment_cache`.
+
+    Files are stored under the SHA-256 of their contents, so a file
+    that was uploaded several times is only stored once.  When the
+    files in the cache add up to more than `max_size` bytes, the least
+    recently used ones are deleted.  Several processes may share a
+    cache directory.
+    """
+
+    def __init__(self, directory: str, max_size: int = 1024 * 1024 * 1024) -> None:
+        self.directory = os.path.abspath(os.path.expanduser(directory))
+        self.max_size = max_size
+        self.objects_directory = os.path.join(self.directory, "objects")
+        self.index_directory = os.path.join(self.directory, "index")
+
+    def _index_path(self, path: str) -> str:
+        key = hashlib.sha256(path.encode()).hexdigest()[:32]
+        return os.path.join(self.index_directory, key)
+
+    def open(self, path: str) -> Optional[IO[bytes]]:
+        """Opens the cached contents of the uploaded file at `path`, if
+        present, and marks them as recently used."""
+        try:
+            with open(self._index_path(path)) as f:
+                digest = f.read().strip()
+            object_path = os.path.join(self.objects_directory, digest)
+            os.utime(object_path)
+            return open(object_path, "rb")  # noqa: SIM115
+        except FileNotFoundError:
+            # Never cached, or since evicted.
+            return None
+
+    def writer(self, path: str) -> "AttachmentCacheWriter":
+        """Returns a file to write the contents of `path` to; they are
+        added to the cache when it is committed."""
+        return AttachmentCacheWriter(self, path)
+
+    def put(self, path: str, filename: str) -> None:
+        """Adds a copy of `filename` to the cache, as the contents of
+        the uploaded file at `path`."""
+        writer = self.writer(path)
+        with writer, open(filename, "rb") as f:
+            while chunk := f.read(CHUNK_SIZE):
+                writer.write(chunk)
+
+    def add(self, path: str, filename: str, digest: str) -> None:
+        """Moves `filename`, whose contents have the SHA-256 `digest`,
+        into the cache as the contents of `path`."""
+        os.replace(filename, os.path.join(self.objects_directory, digest))
+        os.makedirs(self.index_directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=self.index_directory, prefix=".")
+        with os.fdopen(fd, "w") as f:
+            f.write(digest)
+        os.replace(temp_path, self._index_path(path))
+        self.evict()
+
+    def evict(self) -> None:
+        """Deletes the least recently used files until the cache fits
+        in `max_size`.  Index entries of deleted files are left behind;
+        `open` treats them as missing."""
+        files = []
+        with os.scandir(self.objects_directory) as entries:
+            for entry in entries:
+                # Files still being written are hidden.
+                if entry.name.startswith("."):
+                    continue
+                with contextlib.suppress(FileNotFoundError):
+                    stat = entry.stat()
+                    files.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in files)
+        for _, size, object_path in sorted(files):
+            if total <= self.max_size:
+                break
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(object_path)
+            total -= size
+
+
+class AttachmentCacheWriter:
+    """Collects a file being downloaded into an `AttachmentCache`.
+
+    Used as a context manager, the file is added to the cache if the
+    block completes, and discarded if it raises.
+    """
+
+    def __init__(self, cache: AttachmentCache, path: str) -> None:
+        self.cache = cache
+        self.path = path
+        os.makedirs(cache.objects_directory, exist_ok=True)
+        fd, self.temp_path = tempfile.mkstemp(dir=cache.objects_directory, prefix=".")
+        self.file = os.fdopen(fd, "wb")
+        self.hash = hashlib.sha256()
+
+    def write(self, data: bytes) -> None:
+        self.file.write(data)
+        self.hash.update(data)
+
+    def commit(self) -> None:
+        self.file.close()
+        self.cache.add(self.path, self.temp_path, self.hash.hexdigest())
+
+    def abort(self) -> None:
+        self.file.close()
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(self.temp_path)
+
+    def __enter__(self) -> "AttachmentCacheWriter":
+        return self
+
+    def __exit__(self, exc_type: object, exc_value: object, traceback: object) -> None:
+        if exc_type is None:
+            self.commit()
+        else:
+            self.abort()
+
+
+def file_digest(file: IO[Any]) -> str:
+    """Returns the SHA-256 of a file's contents from its current
+    position, leaving the position unchanged."""
+    position = file.tell()
+    digest = hashlib.sha256()
+    while chunk := file.read(CHUNK_SIZE):
+        digest.update(chunk.encode() if isinstance(chunk, str) else chunk)
+    file.seek(position)
+    return digest.hexdigest()
+
+
+class UploadIndex:
+    """A persistent index of the files each user has uploaded, by the
+    SHA-256 of their contents, stored in an SQLite database.
+
+    Set as a client's `upload_index`, it lets `upload_file` return the
+    URL of an earlier upload of the same contents rather than uploading
+    them again.  At most `max_entries` uploads are remembered; the least
+    recently used are forgotten first.
+
+    Uploads deleted on the server since they were indexed are only
+    noticed by `warm_up`, which long-running bots may want to call
+    from time to time.
+    """
+
+    def __init__(self, path: str, max_entries: int = 10000) -> None:
+        self.path = os.path.abspath(os.path.expanduser(path))
+        self.max_entries = max_entries
+        with self._connect() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS zulip_uploads ("
+                "site TEXT NOT NULL, email TEXT NOT NULL, digest TEXT NOT NULL,"
+                " url TEXT NOT NULL, last_used REAL NOT NULL, PRIMARY KEY (site, email, digest))"
+            )
+
+    @contextlib.contextmanager
+    def _connect(self) -> Iterator["sqlite3.Connection"]:
+        import sqlite3
+
+        # As in zulip.checkpoint.SQLiteCheckpointStore, a connection
+        # per operation keeps the index usable from any thread.
+        with contextlib.closing(sqlite3.connect(self.path)) as connection, connection:
+            yield connection
+
+    def lookup(self, site: str, email: str, digest: str) -> Optional[str]:
+        """Returns the URL of an earlier upload by this user with the
+        given contents, if any."""
+        with self._connect() as connection:
+            row = connection.execute(
+                "SELECT url FROM zulip_uploads WHERE site = ? AND email = ? AND digest = ?",
+                (site, email, digest),
+            ).fetchone()
+            if row is None:
+                return None
+            connection.execute(
+                "UPDATE zulip_uploads SET last_used = ?"
+                " WHERE site = ? AND email = ? AND digest = ?",
+                (time.time(), site, email, digest),
+            )
+        return row[0]
+
+    def record(self, site: str, email: str, digest: str, url: str) -> None:
+        with self._connect() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO zulip_uploads (site, email, digest, url, last_used)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (site, email, digest, url, time.time()),
+            )
+            connection.execute(
+                "DELETE FROM zulip_uploads WHERE rowid NOT IN"
+                " (SELECT rowid FROM zulip_uploads ORDER BY last_used DESC LIMIT ?)",
+                (self.max_entries,),
+            )
+
+    def warm_up(self, client: "Client", max_download_size: int = 0) -> None:
+        """Brings the index up to date with the client user's uploads,
+        as listed by `get_attachments`: forgets uploads that have been
+        deleted, and downloads and indexes those of at most
+        `max_download_size` bytes that aren't indexed yet."""
+        result = client.get_attachments()
+        if result["result"] != "success":
+            raise ZulipError("Error listing uploads: {}".format(result.get("msg")))
+        attachments = {
+            "/user_uploads/" + attachment["path_id"]: attachment
+            for attachment in result["attachments"]
+        }
+
+        site, email = client.base_url, client.email
+        with self._connect() as connection:
+            indexed = connection.execute(
+                "SELECT digest, url FROM zulip_uploads WHERE site = ? AND email = ?",
+                (site, email),
+            ).fetchall()
+            connection.executemany(
+                "DELETE FROM zulip_uploads WHERE site = ? AND email = ? AND digest = ?",
+                [(site, email, digest) for digest, url in indexed if url not in attachments],
+            )
+
+        indexed_urls = {url for _, url in indexed}
+        for url, attachment in attachments.items():
+            if url in indexed_urls or attachment["size"] > max_download_size:
+                continue
+            digest = hashlib.sha256()
+            for chunk in client.iter_attachment(url):
+                digest.update(chunk)
+            self.record(site, email, digest.hexdigest(), url)
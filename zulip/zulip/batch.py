@@ -0,0 +1,176 @@
+import itertools
+import threading
+from collections import defaultdict, deque
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Deque,
+    Dict,
+    List,
+    Mapping,
+    Optional,
+    Tuple,
+    TypeVar,
+)
+
+if TYPE_CHECKING:
+    from zulip import Client
+
+T = TypeVar("T")
+
+# Methods of Client that don't make a single API call, and so can't be
+# queued on a batch; generators, such as iter_messages, would do their
+# work outside the batch's workers.
+UNBATCHABLE_METHODS = {
+    "batch",
+    "call_on_each_event",
+    "call_on_each_message",
+    "download_attachment",
+    "ensure_server_settings",
+    "ensure_session",
+    "get_user_agent",
+    "invalidate_server_settings",
+    "iter_attachment",
+    "iter_messages",
+    "upload_files",
+}
+
+
+class Batch:
+    """Runs many API calls concurrently over one Client's session.
+
+    Calls are queued by calling the usual Client methods on the batch,
+    which return `concurrent.futures.Future` objects instead of blocking:
+
+    >>> with client.batch(max_workers=8, endpoint_limits={"send_message": 2}) as batch:
+    ...     for message_id in message_ids:
+    ...         batch.add_reaction({"message_id": message_id, "emoji_name": "tada"})
+    >>> batch.results()
+    [{'result': 'success', 'msg': ''}, ...]
+
+    At most `max_workers` calls are in flight at once, and at most
+    `endpoint_limits[name]` calls to the Client method `name`.  Calls
+    are started in submission order, except that a call waiting on its
+    endpoint's limit doesn't hold up calls to other endpoints.  Leaving
+    the `with` block waits for every queued call to finish; a batch used
+    without `with` must be closed with `close` instead, or its worker
+    threads are left running.
+    """
+
+    def __init__(
+        self,
+        client: "Client",
+        max_workers: int = 8,
+        endpoint_limits: Optional[Mapping[str, int]] = None,
+    ) -> None:
+        if max_workers < 1:
+            raise ValueError("max_workers must be at least 1")
+        for endpoint, limit in (endpoint_limits or {}).items():
+            if limit < 1:
+                raise ValueError(f"The limit for {endpoint} must be at least 1")
+        self.client = client
+        self.max_workers = max_workers
+        self.endpoint_limits = dict(endpoint_limits or {})
+        self.futures: List["Future[Any]"] = []
+
+        # Create the session now, rather than racing to do so from
+        # several worker threads.
+        client.ensure_session()
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="zulip-batch"
+        )
+        self._lock = threading.Lock()
+        self._sequence = itertools.count()
+        self._pending: Dict[str, Deque[Tuple[int, Callable[[], None]]]] = defaultdict(deque)
+        self._running: Dict[str, int] = defaultdict(int)
+
+    def __enter__(self) -> "Batch":
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.close()
+
+    def __getattr__(self, name: str) -> Callable[..., "Future[Dict[str, Any]]"]:
+        method = getattr(self.client, name, None)
+        if name.startswith("_") or name in UNBATCHABLE_METHODS or not callable(method):
+            raise AttributeError(f"{name!r} cannot be called on a batch")
+
+        def submit(*args: Any, **kwargs: Any) -> "Future[Dict[str, Any]]":
+            return self.submit_as(name, method, *args, **kwargs)
+
+        return submit
+
+    def submit(self, fn: Callable[..., T], *args: Any, **kwargs: Any) -> "Future[T]":
+        """Queues an arbitrary callable, such as a helper that makes
+        several API calls; it is limited under its own `__name__`."""
+        return self.submit_as(getattr(fn, "__name__", repr(fn)), fn, *args, **kwargs)
+
+    def submit_as(
+        self, endpoint: str, fn: Callable[..., T], *args: Any, **kwargs: Any
+    ) -> "Future[T]":
+        future: Future[T] = Future()
+
+        def run() -> None:
+            try:
+                if future.set_running_or_notify_cancel():
+                    try:
+                        result = fn(*args, **kwargs)
+                    except BaseException as e:
+                        future.set_exception(e)
+                    else:
+                        future.set_result(result)
+            finally:
+                with self._lock:
+                    self._running[endpoint] -= 1
+                self._dispatch()
+
+        with self._lock:
+            self.futures.append(future)
+            self._pending[endpoint].append((next(self._sequence), run))
+        self._dispatch()
+        return future
+
+    def _dispatch(self) -> None:
+        ready = []
+        with self._lock:
+            while True:
+                # Of the endpoints with spare capacity, start the call
+                # that was submitted first.
+                candidates = [
+                    (queue[0][0], endpoint)
+                    for endpoint, queue in self._pending.items()
+                    if queue
+                    and self._running[endpoint]
+                    < self.endpoint_limits.get(endpoint, self.max_workers)
+                ]
+                if not candidates:
+                    break
+                _, endpoint = min(candidates)
+                _, run = self._pending[endpoint].popleft()
+                self._running[endpoint] += 1
+                ready.append(run)
+        for run in ready:
+            self._executor.submit(run)
+
+    def wait(self) -> None:
+        """Blocks until every call queued so far has finished."""
+        while True:
+            with self._lock:
+                not_done = [future for future in self.futures if not future.done()]
+            if not not_done:
+                return
+            wait(not_done)
+
+    def close(self) -> None:
+        """Waits for every queued call to finish, then stops the
+        batch's worker threads; no more calls can be queued."""
+        self.wait()
+        self._executor.shutdown()
+
+    def results(self) -> List[Any]:
+        """Returns the result of every queued call, in submission
+        order, re-raising the first exception any of them raised."""
+        self.wait()
+        return [future.result() for future in self.futures]
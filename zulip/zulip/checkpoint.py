@@ -0,0 +1,157 @@
+import contextlib
+import json
+import logging
+import os
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterator, NamedTuple, Optional
+
+from typing_extensions import Protocol
+
+if TYPE_CHECKING:
+    import sqlite3
+
+logger = logging.getLogger(__name__)
+
+
+class EventQueueCheckpoint(NamedTuple):
+    """How far a consumer has got through an event queue: every event
+    with an ID up to `last_event_id` has been handled."""
+
+    queue_id: str
+    last_event_id: int
+    # The arguments the queue was registered with (see
+    # `registration_key`), so that a consumer asking for different
+    # events doesn't resume a queue that doesn't deliver them.
+    registration: str
+
+
+def registration_key(
+    event_types: Optional[Any], narrow: Optional[Any], register_kwargs: Dict[str, Any]
+) -> str:
+    return json.dumps(
+        {"event_types": event_types, "narrow": narrow, **register_kwargs},
+        sort_keys=True,
+        default=str,
+    )
+
+
+def report_lost_queue(
+    checkpoint: EventQueueCheckpoint,
+    on_queue_lost: Optional[Callable[[EventQueueCheckpoint], None]],
+) -> None:
+    if on_queue_lost is not None:
+        on_queue_lost(checkpoint)
+    else:
+        logger.warning(
+            "Event queue %s expired; any events after event %d were missed",
+            checkpoint.queue_id,
+            checkpoint.last_event_id,
+        )
+
+
+class CheckpointStore(Protocol):
+    """Somewhere to persist the `EventQueueCheckpoint` of one consumer,
+    such as a bot, between runs.
+
+    Pass one to `Client.call_on_each_event` (or `call_on_each_message`)
+    as `checkpoint_store`; it is saved after every batch of events is
+    handled, and a restarted consumer resumes the saved queue instead of
+    registering a new one, so events that arrived in between aren't
+    lost.  Events in a batch that was interrupted are delivered again.
+
+    Any object with these methods will do; this module provides
+    `FileCheckpointStore` and `SQLiteCheckpointStore`.
+    """
+
+    def load(self) -> Optional[EventQueueCheckpoint]:
+        ...
+
+    def save(self, checkpoint: EventQueueCheckpoint) -> None:
+        ...
+
+    def clear(self) -> None:
+        ...
+
+
+class FileCheckpointStore:
+    """Keeps the checkpoint in a small JSON file."""
+
+    def __init__(self, path: str) -> None:
+        self.path = os.path.abspath(os.path.expanduser(path))
+
+    def load(self) -> Optional[EventQueueCheckpoint]:
+        try:
+            with open(self.path) as f:
+                return EventQueueCheckpoint(**json.load(f))
+        except FileNotFoundError:
+            return None
+        except (ValueError, TypeError):
+            logger.warning("Ignoring unreadable event queue checkpoint %s", self.path)
+            return None
+
+    def save(self, checkpoint: EventQueueCheckpoint) -> None:
+        import tempfile
+
+        directory = os.path.dirname(self.path)
+        os.makedirs(directory, exist_ok=True)
+        # Write to a temporary file and rename it into place, so that a
+        # crash mid-write never leaves a truncated checkpoint behind.
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(checkpoint._asdict(), f)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            with contextlib.suppress(OSError):
+                os.remove(tmp_path)
+            raise
+
+    def clear(self) -> None:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(self.path)
+
+
+class SQLiteCheckpointStore:
+    """Keeps the checkpoint in a row of an SQLite database, which
+    several consumers can share by using different `name`s."""
+
+    def __init__(self, path: str, name: str = "default") -> None:
+        self.path = os.path.abspath(os.path.expanduser(path))
+        self.name = name
+        with self._connect() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS zulip_event_queue_checkpoints ("
+                "name TEXT PRIMARY KEY, queue_id TEXT NOT NULL,"
+                " last_event_id INTEGER NOT NULL, registration TEXT NOT NULL)"
+            )
+
+    @contextlib.contextmanager
+    def _connect(self) -> Iterator["sqlite3.Connection"]:
+        import sqlite3
+
+        # A connection per operation keeps the store usable from any
+        # thread; checkpoints are only saved once per batch of events.
+        with contextlib.closing(sqlite3.connect(self.path)) as connection, connection:
+            yield connection
+
+    def load(self) -> Optional[EventQueueCheckpoint]:
+        with self._connect() as connection:
+            row = connection.execute(
+                "SELECT queue_id, last_event_id, registration"
+                " FROM zulip_event_queue_checkpoints WHERE name = ?",
+                (self.name,),
+            ).fetchone()
+        return None if row is None else EventQueueCheckpoint(*row)
+
+    def save(self, checkpoint: EventQueueCheckpoint) -> None:
+        with self._connect() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO zulip_event_queue_checkpoints"
+                " (name, queue_id, last_event_id, registration) VALUES (?, ?, ?, ?)",
+                (self.name, *checkpoint),
+            )
+
+    def clear(self) -> None:
+        with self._connect() as connection:
+            connection.execute(
+                "DELETE FROM zulip_event_queue_checkpoints WHERE name = ?", (self.name,)
+            )
@@ -0,0 +1,244 @@
+import logging
+import threading
+from typing import TYPE_CHECKING, Any, Dict, Optional, Set, Union
+
+from zulip import RandomExponentialBackoff
+
+if TYPE_CHECKING:
+    from zulip import Client
+
+logger = logging.getLogger(__name__)
+
+
+class RealmDirectory:
+    """An in-memory copy of a realm's users and streams, and of the
+    client's own subscriptions, kept current from the events API.
+
+    Looking up a stream ID, a user by email, or whether the bot is
+    subscribed to a stream is then a dictionary lookup rather than a
+    round trip to the server:
+
+    >>> directory = RealmDirectory(client)
+    >>> directory.start()
+    >>> directory.get_stream_id("devel")
+    5
+    >>> directory.is_subscribed("devel")
+    True
+
+    `start` registers an event queue, loads the directory from its
+    initial state, and applies further `realm_user`, `stream` and
+    `subscription` events from a background thread.  Code that already
+    consumes those events (or uses `zulip.AsyncClient`) can instead
+    pass the `register` response to `load_state` and each event to
+    `handle_event` itself.
+
+    Names and emails are matched case-insensitively, as the server
+    does.  Lookups return None for unknown names and IDs, and for
+    deactivated users; those are kept, so that they are found again
+    if they are reactivated.
+    """
+
+    EVENT_TYPES = ("realm_user", "stream", "subscription")
+
+    def __init__(self, client: Optional["Client"] = None) -> None:
+        self.client = client
+        self._lock = threading.Lock()
+        self._users: Dict[int, Dict[str, Any]] = {}
+        self._user_ids_by_email: Dict[str, int] = {}
+        self._deactivated_users: Dict[int, Dict[str, Any]] = {}
+        self._streams: Dict[int, Dict[str, Any]] = {}
+        self._stream_ids_by_name: Dict[str, int] = {}
+        self._subscribed_stream_ids: Set[int] = set()
+        self._queue_id: Optional[str] = None
+        self._last_event_id = -1
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def get_user(self, user_id: int) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            return self._users.get(user_id)
+
+    def get_user_by_email(self, email: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            user_id = self._user_ids_by_email.get(email.lower())
+            return None if user_id is None else self._users[user_id]
+
+    def get_stream(self, stream: Union[int, str]) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            stream_id = self._resolve_stream(stream)
+            return None if stream_id is None else self._streams.get(stream_id)
+
+    def get_stream_id(self, name: str) -> Optional[int]:
+        with self._lock:
+            return self._stream_ids_by_name.get(name.lower())
+
+    def is_subscribed(self, stream: Union[int, str]) -> bool:
+        with self._lock:
+            return self._resolve_stream(stream) in self._subscribed_stream_ids
+
+    def _resolve_stream(self, stream: Union[int, str]) -> Optional[int]:
+        if isinstance(stream, int):
+            return stream
+        return self._stream_ids_by_name.get(stream.lower())
+
+    def load_state(self, state: Dict[str, Any]) -> None:
+        """Replaces the directory's contents with the initial state in
+        a `register` response that fetched `EVENT_TYPES`."""
+        with self._lock:
+            self._users.clear()
+            self._user_ids_by_email.clear()
+            for user in state.get("realm_users", []):
+                self._add_user(user)
+            self._deactivated_users = {
+                user["user_id"]: dict(user) for user in state.get("realm_non_active_users", [])
+            }
+            self._streams.clear()
+            self._stream_ids_by_name.clear()
+            for stream in state.get("streams", []):
+                self._add_stream(stream)
+            self._subscribed_stream_ids.clear()
+            for subscription in state.get("subscriptions", []):
+                self._add_subscription(subscription)
+
+    def handle_event(self, event: Dict[str, Any]) -> None:
+        """Applies an event; events of other types are ignored."""
+        with self._lock:
+            if event["type"] == "realm_user":
+                self._handle_realm_user_event(event)
+            elif event["type"] == "stream":
+                self._handle_stream_event(event)
+            elif event["type"] == "subscription":
+                self._handle_subscription_event(event)
+
+    def _add_user(self, user: Dict[str, Any]) -> None:
+        self._remove_user(user["user_id"])
+        self._users[user["user_id"]] = dict(user)
+        self._user_ids_by_email[user["email"].lower()] = user["user_id"]
+
+    def _remove_user(self, user_id: int) -> None:
+        user = self._users.pop(user_id, None)
+        if user is not None:
+            self._user_ids_by_email.pop(user["email"].lower(), None)
+
+    def _handle_realm_user_event(self, event: Dict[str, Any]) -> None:
+        person = event["person"]
+        user_id = person["user_id"]
+        if event["op"] == "add":
+            self._deactivated_users.pop(user_id, None)
+            self._add_user(person)
+        elif event["op"] == "remove":
+            self._remove_user(user_id)
+            self._deactivated_users.pop(user_id, None)
+        elif event["op"] == "update":
+            # Most updates don't change whether the user is active.
+            is_active = person.get("is_active", user_id in self._users)
+            old_user = self._users.get(user_id) or self._deactivated_users.pop(user_id, None)
+            if old_user is None:
+                return
+            user = dict(old_user, **person)
+            if "new_email" in person:
+                user["email"] = user.pop("new_email")
+            if is_active:
+                self._add_user(user)
+            else:
+                self._remove_user(user_id)
+                self._deactivated_users[user_id] = user
+
+    def _add_stream(self, stream: Dict[str, Any]) -> None:
+        self._remove_stream(stream["stream_id"])
+        self._streams[stream["stream_id"]] = dict(stream)
+        self._stream_ids_by_name[stream["name"].lower()] = stream["stream_id"]
+
+    def _remove_stream(self, stream_id: int) -> None:
+        stream = self._streams.pop(stream_id, None)
+        if stream is not None:
+            self._stream_ids_by_name.pop(stream["name"].lower(), None)
+
+    def _handle_stream_event(self, event: Dict[str, Any]) -> None:
+        if event["op"] == "create":
+            for stream in event["streams"]:
+                self._add_stream(stream)
+        elif event["op"] == "delete":
+            for stream in event["streams"]:
+                self._remove_stream(stream["stream_id"])
+                self._subscribed_stream_ids.discard(stream["stream_id"])
+        elif event["op"] == "update" and event["stream_id"] in self._streams:
+            stream = dict(self._streams[event["stream_id"]])
+            stream[event["property"]] = event["value"]
+            self._add_stream(stream)
+
+    def _add_subscription(self, subscription: Dict[str, Any]) -> None:
+        self._subscribed_stream_ids.add(subscription["stream_id"])
+        # Private streams we're subscribed to may not be in `streams`.
+        if subscription["stream_id"] not in self._streams:
+            self._add_stream({"stream_id": subscription["stream_id"], "name": subscription["name"]})
+
+    def _handle_subscription_event(self, event: Dict[str, Any]) -> None:
+        if event["op"] == "add":
+            for subscription in event["subscriptions"]:
+                self._add_subscription(subscription)
+        elif event["op"] == "remove":
+            for subscription in event["subscriptions"]:
+                self._subscribed_stream_ids.discard(subscription["stream_id"])
+
+    def start(self) -> None:
+        """Loads the directory, then keeps it current from a daemon
+        thread until `stop` is called."""
+        assert self.client is not None
+        self._stopped.clear()
+        self._register()
+        self._thread = threading.Thread(
+            target=self._follow_events, name="zulip-realm-directory", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        if self._queue_id is not None and self.client is not None:
+            # This also ends the thread's pending long-poll.
+            self.client.deregister(self._queue_id)
+
+    def _register(self) -> None:
+        """Registers a queue and loads the directory, retrying until
+        that succeeds or `stop` is called."""
+        assert self.client is not None
+        backoff = RandomExponentialBackoff(delay_cap=30.0)
+        while not self._stopped.is_set():
+            result = self.client.register(
+                list(self.EVENT_TYPES), fetch_event_types=list(self.EVENT_TYPES)
+            )
+            if result["result"] == "success":
+                self.load_state(result)
+                self._queue_id = result["queue_id"]
+                self._last_event_id = result["last_event_id"]
+                return
+            logger.warning("Error registering realm directory: %s", result.get("msg"))
+            self._stopped.wait(backoff.fail_without_sleeping())
+
+    def _follow_events(self) -> None:
+        assert self.client is not None
+        # Errors are retried with backoff, waiting on _stopped so that
+        # stop() doesn't have to wait for it.
+        backoff = RandomExponentialBackoff(delay_cap=30.0)
+        while not self._stopped.is_set():
+            try:
+                result = self.client.get_events(
+                    queue_id=self._queue_id, last_event_id=self._last_event_id
+                )
+            except Exception:
+                logger.exception("Error fetching realm directory events")
+                self._stopped.wait(backoff.fail_without_sleeping())
+                continue
+            if self._stopped.is_set():
+                return
+            if result["result"] != "success":
+                if result.get("code") == "BAD_EVENT_QUEUE_ID":
+                    # We may have missed events, so start afresh.
+                    self._register()
+                else:
+                    self._stopped.wait(backoff.fail_without_sleeping())
+                continue
+            backoff.succeed()
+            for event in result["events"]:
+                self._last_event_id = max(self._last_event_id, int(event["id"]))
+                self.handle_event(event)
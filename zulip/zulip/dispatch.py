@@ -0,0 +1,154 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+from typing import Any, Callable, Deque, Dict, Hashable, NamedTuple, Optional, Tuple
+
+
+def conversation_key(event: Dict[str, Any]) -> Hashable:
+    """The conversation a message, or a message event, is part of: a
+    stream and topic, or the set of users in a direct message.  Other
+    events all share the key None."""
+    message = event.get("message", event)
+    if "display_recipient" not in message:
+        return None
+    if message["type"] == "stream":
+        # Topics are case-insensitive.
+        topic = message.get("subject", message.get("topic", ""))
+        return ("stream", message["stream_id"], topic.lower())
+    return ("private", tuple(sorted(user["id"] for user in message["display_recipient"])))
+
+
+class KeyStats(NamedTuple):
+    # Events dispatched for the key but not yet handled, including
+    # the one being handled.
+    depth: int
+    # Seconds since the oldest of them was dispatched.
+    lag: float
+
+
+class KeyedDispatcher:
+    """Hands events to a pool of workers, keeping those with the same
+    key in order.
+
+    Pass one as the callback of `call_on_each_event` or
+    `call_on_each_message`, so that a slow callback (say, one relaying
+    messages to another service) doesn't hold up every conversation:
+
+    >>> with KeyedDispatcher(relay, max_workers=8) as dispatcher:
+    ...     client.call_on_each_message(dispatcher)
+
+    Events are grouped by `key(event)`, by default the conversation a
+    message is part of (see `conversation_key`).  `callback` is called
+    with one event of a key at a time, in the order they were
+    dispatched, while events of different keys are handled in
+    parallel.  `stats()` reports how far behind each key is.
+
+    By default, callbacks run on a thread pool of `max_workers`
+    threads; pass another `executor`, such as a
+    `concurrent.futures.ProcessPoolExecutor`, to use that instead (for
+    a process pool, `callback` and events must be picklable).  Once
+    `max_pending` events are waiting, dispatching blocks until one has
+    been handled.  If `callback` raises an exception, it is re-raised
+    by the next dispatch, stopping the event loop as an exception from
+    an inline callback would.
+
+    Events count as handled by `call_on_each_event` once dispatched,
+    so with a `checkpoint_store`, events still waiting here when the
+    process dies are not delivered again.
+    """
+
+    def __init__(
+        self,
+        callback: Callable[[Dict[str, Any]], object],
+        key: Callable[[Dict[str, Any]], Hashable] = conversation_key,
+        max_workers: int = 8,
+        executor: Optional[Executor] = None,
+        max_pending: int = 1000,
+    ) -> None:
+        if max_pending < 1:
+            raise ValueError("max_pending must be at least 1")
+        self.callback = callback
+        self.key = key
+        self.max_pending = max_pending
+        self._owns_executor = executor is None
+        self.executor = executor or ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="zulip-dispatch"
+        )
+        self._condition = threading.Condition()
+        # For each key with events that haven't been handled, those
+        # events and when they were dispatched; the first one is being
+        # handled.
+        self._queues: Dict[Hashable, Deque[Tuple[float, Dict[str, Any]]]] = {}
+        self._pending = 0
+        self._error: Optional[BaseException] = None
+
+    def __enter__(self) -> "KeyedDispatcher":
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.close()
+
+    def __call__(self, event: Dict[str, Any]) -> None:
+        key = self.key(event)
+        with self._condition:
+            self._raise_error()
+            while self._pending >= self.max_pending:
+                self._condition.wait()
+                self._raise_error()
+            self._pending += 1
+            queue = self._queues.get(key)
+            if queue is not None:
+                queue.append((time.monotonic(), event))
+                return
+            self._queues[key] = deque([(time.monotonic(), event)])
+        self._start(key, event)
+
+    def _start(self, key: Hashable, event: Dict[str, Any]) -> None:
+        future = self.executor.submit(self.callback, event)
+        future.add_done_callback(lambda future: self._finished(key, future))
+
+    def _finished(self, key: Hashable, future: "Future[object]") -> None:
+        with self._condition:
+            if self._error is None and not future.cancelled():
+                self._error = future.exception()
+            queue = self._queues[key]
+            queue.popleft()
+            self._pending -= 1
+            next_event = queue[0][1] if queue else None
+            if next_event is None:
+                del self._queues[key]
+            self._condition.notify_all()
+        if next_event is not None:
+            self._start(key, next_event)
+
+    def _raise_error(self) -> None:
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def stats(self) -> Dict[Hashable, KeyStats]:
+        """The depth and lag of every key with events waiting."""
+        now = time.monotonic()
+        with self._condition:
+            return {
+                key: KeyStats(len(queue), now - queue[0][0]) for key, queue in self._queues.items()
+            }
+
+    def wait(self) -> None:
+        """Blocks until every event dispatched so far has been handled,
+        re-raising the first exception from `callback` since the last
+        one raised."""
+        with self._condition:
+            while self._pending:
+                self._condition.wait()
+            self._raise_error()
+
+    def close(self) -> None:
+        """Waits for the events dispatched so far, then shuts down the
+        executor if the dispatcher created it."""
+        try:
+            self.wait()
+        finally:
+            if self._owns_executor:
+                self.executor.shutdown()
@@ -0,0 +1,845 @@
+import base64
+import contextlib
+import email.parser
+import io
+import json
+import random
+import re
+import secrets
+import threading
+import time
+import urllib.parse
+from typing import (
+    IO,
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    NamedTuple,
+    Optional,
+    Tuple,
+    Union,
+)
+
+import requests
+from typing_extensions import override
+
+from zulip.narrow import compile_narrow
+
+if TYPE_CHECKING:
+    from wsgiref.types import StartResponse, WSGIEnvironment
+
+    from zulip import Client
+
+# The version and feature level reported by `server_settings`.
+ZULIP_VERSION = "9.0"
+ZULIP_FEATURE_LEVEL = 300
+
+# A (status, headers, body) HTTP response.
+Response = Tuple[int, Dict[str, str], bytes]
+
+
+class FakeServerError(Exception):
+    """Raised by request handlers to send an error response."""
+
+    def __init__(self, msg: str, code: str = "BAD_REQUEST", status: int = 400) -> None:
+        super().__init__(msg)
+        self.msg = msg
+        self.code = code
+        self.status = status
+
+
+class _User:
+    def __init__(self, user_id: int, email: str, full_name: str, is_bot: bool) -> None:
+        self.id = user_id
+        self.email = email
+        self.full_name = full_name
+        self.is_bot = is_bot
+        self.api_key = secrets.token_hex(16)
+        self.storage: Dict[str, str] = {}
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "user_id": self.id,
+            "email": self.email,
+            "full_name": self.full_name,
+            "is_bot": self.is_bot,
+            "is_admin": False,
+            "is_owner": False,
+            "is_guest": False,
+            "role": 400,
+            "is_active": True,
+            "avatar_url": None,
+            "timezone": "",
+            "date_joined": "2024-01-01T00:00:00+00:00",
+        }
+
+
+class _Stream:
+    def __init__(self, stream_id: int, name: str, description: str) -> None:
+        self.id = stream_id
+        self.name = name
+        self.description = description
+        self.subscribers: List[int] = []
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "stream_id": self.id,
+            "name": self.name,
+            "description": self.description,
+            "invite_only": False,
+            "is_web_public": False,
+            "history_public_to_subscribers": True,
+            "date_created": 1704067200,
+        }
+
+
+class _Queue:
+    def __init__(
+        self,
+        queue_id: str,
+        user: _User,
+        event_types: Optional[List[str]],
+        narrow: Callable[[Dict[str, Any]], bool],
+    ) -> None:
+        self.id = queue_id
+        self.user = user
+        self.event_types = event_types
+        self.narrow = narrow
+        self.events: List[Dict[str, Any]] = []
+        self.next_event_id = 0
+
+    def wants(self, event: Dict[str, Any]) -> bool:
+        if self.event_types is not None and event["type"] not in self.event_types:
+            return False
+        return event["type"] != "message" or self.narrow(event["message"])
+
+
+class _Upload:
+    def __init__(self, upload_id: int, path: str, name: str, content: bytes, owner: _User) -> None:
+        self.id = upload_id
+        self.path = path
+        self.name = name
+        self.content = content
+        self.owner = owner
+        self.created = int(time.time() * 1000)
+
+
+class _Request(NamedTuple):
+    user: _User
+    # Form fields and query parameters.
+    params: Dict[str, str]
+    # Uploaded files, as (filename, contents) pairs.
+    files: List[Tuple[str, bytes]]
+    # Named groups from the endpoint's path pattern.
+    path_args: Dict[str, str]
+
+
+def _parse_json(params: Mapping[str, str], name: str, default: Any = None) -> Any:
+    """Parameters are sent JSON-encoded, unless they are strings."""
+    if name not in params:
+        return default
+    try:
+        return json.loads(params[name])
+    except ValueError:
+        return params[name]
+
+
+class FakeZulipServer:
+    """An in-process stand-in for a Zulip server, for tests, benchmarks
+    and load tests of bots and integrations without a network.
+
+    It implements the parts of the API that bots and bridges use
+    most: event queues (`register` and long-polling `get_events`),
+    sending and fetching messages, streams and subscriptions, bot
+    storage, the user's profile, `server_settings`, and uploading and
+    downloading files.  Every response is delayed by `latency` seconds,
+    plus a random amount of up to `jitter` seconds, to mimic a real
+    server; idle `get_events` requests return a heartbeat event after
+    `heartbeat_interval` seconds, as a real server does.
+
+    Clients get to it either through a `requests` transport adapter,
+    so no sockets are involved:
+
+    >>> server = FakeZulipServer()
+    >>> server.add_user("bot@example.com", "Bot", is_bot=True)
+    >>> client = server.client("bot@example.com")
+
+    or over HTTP, since the server is also a WSGI application:
+
+    >>> with server.serve() as url:
+    ...     client = AsyncClient(email=..., api_key=server.api_key(...), site=url)
+    """
+
+    def __init__(
+        self,
+        site: str = "https://zulip.example.invalid",
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        heartbeat_interval: float = 50.0,
+        seed: Optional[int] = None,
+    ) -> None:
+        self.site = site.rstrip("/")
+        self.latency = latency
+        self.jitter = jitter
+        self.heartbeat_interval = heartbeat_interval
+        self._random = random.Random(seed)
+
+        # Guards all the state below; notified when events are added.
+        self._lock = threading.Condition()
+        self._users: Dict[int, _User] = {}
+        self._users_by_email: Dict[str, _User] = {}
+        self._streams: Dict[int, _Stream] = {}
+        self._messages: List[Dict[str, Any]] = []
+        self._queues: Dict[str, _Queue] = {}
+        self._uploads: Dict[str, _Upload] = {}
+        self._temporary_urls: Dict[str, str] = {}
+
+        # How many requests each endpoint has received, by names as
+        # from zulip.metrics.endpoint_name.
+        self.request_counts: Dict[str, int] = {}
+
+        self._routes: List[Tuple[str, "re.Pattern[str]", Callable[[_Request], Dict[str, Any]]]] = [
+            ("GET", re.compile(r"server_settings"), self._get_server_settings),
+            ("POST", re.compile(r"register"), self._register),
+            ("GET", re.compile(r"events"), self._get_events),
+            ("DELETE", re.compile(r"events"), self._delete_queue),
+            ("POST", re.compile(r"messages"), self._send_message),
+            ("GET", re.compile(r"messages"), self._get_messages),
+            ("GET", re.compile(r"users/me"), self._get_profile),
+            ("GET", re.compile(r"users"), self._get_members),
+            ("GET", re.compile(r"streams"), self._get_streams),
+            ("GET", re.compile(r"get_stream_id"), self._get_stream_id),
+            ("GET", re.compile(r"users/me/subscriptions"), self._get_subscriptions),
+            ("POST", re.compile(r"users/me/subscriptions"), self._subscribe),
+            ("DELETE", re.compile(r"users/me/subscriptions"), self._unsubscribe),
+            ("GET", re.compile(r"bot_storage"), self._get_storage),
+            ("PUT", re.compile(r"bot_storage"), self._update_storage),
+            ("DELETE", re.compile(r"bot_storage"), self._remove_storage),
+            ("POST", re.compile(r"user_uploads"), self._upload),
+            ("GET", re.compile(r"user_uploads/(?P<path>\d+/.+)"), self._get_upload_url),
+            ("GET", re.compile(r"attachments"), self._get_attachments),
+        ]
+
+    # Setting up the server's data.
+
+    def add_user(self, email: str, full_name: str = "", is_bot: bool = False) -> Dict[str, Any]:
+        """Adds a user, returning it as `get_profile` would, with its
+        `api_key`."""
+        with self._lock:
+            user = _User(len(self._users) + 1, email, full_name or email, is_bot)
+            self._users[user.id] = user
+            self._users_by_email[email.lower()] = user
+            return {**user.to_dict(), "api_key": user.api_key}
+
+    def api_key(self, email: str) -> str:
+        return self._users_by_email[email.lower()].api_key
+
+    def add_stream(
+        self, name: str, description: str = "", subscribers: Iterable[str] = ()
+    ) -> Dict[str, Any]:
+        with self._lock:
+            stream = self._stream_by_name(name)
+            if stream is None:
+                stream = self._create_stream(name, description)
+            for address in subscribers:
+                self._subscribe_user(self._users_by_email[address.lower()], stream)
+            return stream.to_dict()
+
+    def client(self, email: str, **kwargs: Any) -> "Client":
+        """Returns a `Client` for the given user, which sends its
+        requests straight to this server rather than over a network."""
+        from zulip import Client
+
+        client = Client(
+            email=email,
+            api_key=self.api_key(email),
+            site=self.site,
+            config_file="/nonexistent",
+            **kwargs,
+        )
+        client.ensure_session()
+        assert client.session is not None
+        client.session.mount(self.site + "/", FakeZulipAdapter(self))
+        return client
+
+    @contextlib.contextmanager
+    def serve(self, host: str = "127.0.0.1", port: int = 0) -> Iterator[str]:
+        """Serves the API over HTTP in a background thread while in
+        the block; yields the server's URL."""
+        from socketserver import ThreadingMixIn
+        from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+
+        class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+            daemon_threads = True
+
+        class QuietHandler(WSGIRequestHandler):
+            @override
+            def log_message(self, format: str, *args: Any) -> None:
+                pass
+
+        httpd = make_server(
+            host, port, self, server_class=ThreadingWSGIServer, handler_class=QuietHandler
+        )
+        thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+        thread.start()
+        try:
+            yield f"http://{host}:{httpd.server_port}"
+        finally:
+            httpd.shutdown()
+            httpd.server_close()
+
+    # Handling requests.
+
+    def handle(self, method: str, url: str, headers: Mapping[str, str], body: bytes) -> Response:
+        """Handles an HTTP request, and returns the response."""
+        from zulip.metrics import endpoint_name
+
+        parsed = urllib.parse.urlsplit(url)
+        path = parsed.path.lstrip("/")
+        delay = self.latency + (self._random.uniform(0, self.jitter) if self.jitter else 0)
+        if delay > 0:
+            time.sleep(delay)
+
+        if path.startswith("user_uploads/temporary/"):
+            return self._download(path, headers)
+        if not path.startswith("api/v1/"):
+            return _json_response(404, {"result": "error", "msg": "Not found", "code": "NOT_FOUND"})
+        path = path[len("api/v1/") :]
+        with self._lock:
+            # Don't count every uploaded file separately.
+            name = endpoint_name(method, re.sub(r"^(user_uploads/).+", r"\1:path", path))
+            self.request_counts[name] = self.request_counts.get(name, 0) + 1
+
+        params = dict(urllib.parse.parse_qsl(parsed.query, keep_blank_values=True))
+        files: List[Tuple[str, bytes]] = []
+        content_type = {k.lower(): v for k, v in headers.items()}.get("content-type", "")
+        if content_type.startswith("multipart/form-data"):
+            message = email.parser.BytesParser().parsebytes(
+                f"Content-Type: {content_type}\r\n\r\n".encode() + body
+            )
+            for part in message.get_payload():
+                payload = part.get_payload(decode=True)
+                filename = part.get_filename()
+                if filename is None:
+                    name = part.get_param("name", header="content-disposition")
+                    params[name] = payload.decode()
+                else:
+                    files.append((filename, payload))
+        elif body:
+            params.update(urllib.parse.parse_qsl(body.decode(), keep_blank_values=True))
+
+        try:
+            user = self._authenticate(headers)
+            handler, path_args = self._route(method, path)
+            result = handler(_Request(user, params, files, path_args))
+        except FakeServerError as e:
+            return _json_response(e.status, {"result": "error", "msg": e.msg, "code": e.code})
+        return _json_response(200, {"result": "success", "msg": "", **result})
+
+    def _route(
+        self, method: str, path: str
+    ) -> Tuple[Callable[[_Request], Dict[str, Any]], Dict[str, str]]:
+        for route_method, pattern, handler in self._routes:
+            match = pattern.fullmatch(path)
+            if route_method == method and match:
+                return handler, match.groupdict()
+        raise FakeServerError(f"Unsupported endpoint: {method} {path}", "NOT_FOUND", 404)
+
+    def __call__(
+        self, environ: "WSGIEnvironment", start_response: "StartResponse"
+    ) -> Iterable[bytes]:
+        from http import HTTPStatus
+
+        length = int(environ.get("CONTENT_LENGTH") or 0)
+        body = environ["wsgi.input"].read(length) if length else b""
+        headers = {
+            key[5:].replace("_", "-"): value
+            for key, value in environ.items()
+            if key.startswith("HTTP_")
+        }
+        if environ.get("CONTENT_TYPE"):
+            headers["CONTENT-TYPE"] = environ["CONTENT_TYPE"]
+        url = environ.get("PATH_INFO", "")
+        if environ.get("QUERY_STRING"):
+            url += "?" + environ["QUERY_STRING"]
+        status, response_headers, content = self.handle(
+            environ["REQUEST_METHOD"], url, headers, body
+        )
+        response_headers["Content-Length"] = str(len(content))
+        start_response(f"{status} {HTTPStatus(status).phrase}", list(response_headers.items()))
+        return [content]
+
+    def _authenticate(self, headers: Mapping[str, str]) -> _User:
+        authorization = {k.lower(): v for k, v in headers.items()}.get("authorization", "")
+        if authorization.startswith("Basic "):
+            with contextlib.suppress(ValueError):
+                email, api_key = (
+                    base64.b64decode(authorization[len("Basic ") :]).decode().split(":", 1)
+                )
+                user = self._users_by_email.get(email.lower())
+                if user is not None and secrets.compare_digest(user.api_key, api_key):
+                    return user
+        raise FakeServerError("Invalid API key", "UNAUTHORIZED", 401)
+
+    # Helpers; these expect the lock to be held.
+
+    def _stream_by_name(self, name: str) -> Optional[_Stream]:
+        for stream in self._streams.values():
+            if stream.name.lower() == name.lower():
+                return stream
+        return None
+
+    def _create_stream(self, name: str, description: str) -> _Stream:
+        stream = _Stream(len(self._streams) + 1, name, description)
+        self._streams[stream.id] = stream
+        for user in self._users.values():
+            self._send_event(
+                user, {"type": "stream", "op": "create", "streams": [stream.to_dict()]}
+            )
+        return stream
+
+    def _subscription(self, stream: _Stream) -> Dict[str, Any]:
+        return {
+            **stream.to_dict(),
+            "subscribers": list(stream.subscribers),
+            "color": "#76ce90",
+            "pin_to_top": False,
+            "is_muted": False,
+            "desktop_notifications": None,
+            "audible_notifications": None,
+            "email_notifications": None,
+            "push_notifications": None,
+            "wildcard_mentions_notify": None,
+        }
+
+    def _subscribe_user(self, user: _User, stream: _Stream) -> bool:
+        if user.id in stream.subscribers:
+            return False
+        stream.subscribers.append(user.id)
+        self._send_event(
+            user,
+            {"type": "subscription", "op": "add", "subscriptions": [self._subscription(stream)]},
+        )
+        return True
+
+    def _send_event(self, user: _User, event: Dict[str, Any]) -> None:
+        for queue in self._queues.values():
+            if queue.user is user and queue.wants(event):
+                queue.events.append({**event, "id": queue.next_event_id})
+                queue.next_event_id += 1
+        self._lock.notify_all()
+
+    def _can_see(self, user: _User, message: Dict[str, Any]) -> bool:
+        if message["type"] == "stream":
+            return True
+        return any(recipient["id"] == user.id for recipient in message["display_recipient"])
+
+    def _narrow_filter(self, user: _User, narrow: Any) -> Callable[[Dict[str, Any]], bool]:
+        try:
+            return compile_narrow(narrow, user.email)
+        except (ValueError, KeyError, TypeError) as e:
+            raise FakeServerError(f"Invalid narrow: {e}", "BAD_NARROW") from e
+
+    # Endpoints, each called with the lock released and returning
+    # the response's fields.
+
+    def _get_server_settings(self, request: _Request) -> Dict[str, Any]:
+        return {
+            "zulip_version": ZULIP_VERSION,
+            "zulip_feature_level": ZULIP_FEATURE_LEVEL,
+            "zulip_merge_base": ZULIP_VERSION,
+            "push_notifications_enabled": False,
+            "is_incompatible": False,
+            "email_auth_enabled": True,
+            "require_email_format_usernames": True,
+            "authentication_methods": {"password": True},
+            "external_authentication_methods": [],
+            "realm_uri": self.site,
+            "realm_url": self.site,
+            "realm_name": "Fake Zulip",
+            "realm_icon": "",
+            "realm_description": "",
+            "realm_web_public_access_enabled": False,
+        }
+
+    def _register(self, request: _Request) -> Dict[str, Any]:
+        event_types = _parse_json(request.params, "event_types")
+        narrow = self._narrow_filter(request.user, _parse_json(request.params, "narrow", []))
+        with self._lock:
+            queue = _Queue(
+                f"{int(time.time())}:{secrets.token_hex(4)}", request.user, event_types, narrow
+            )
+            self._queues[queue.id] = queue
+            return {
+                "queue_id": queue.id,
+                "last_event_id": -1,
+                "max_message_id": self._messages[-1]["id"] if self._messages else -1,
+                "zulip_version": ZULIP_VERSION,
+                "zulip_feature_level": ZULIP_FEATURE_LEVEL,
+                "event_queue_longpoll_timeout_seconds": self.heartbeat_interval,
+            }
+
+    def _get_events(self, request: _Request) -> Dict[str, Any]:
+        queue_id = request.params.get("queue_id", "")
+        last_event_id = int(request.params.get("last_event_id", -1))
+        dont_block = _parse_json(request.params, "dont_block", False)
+        deadline = time.monotonic() + self.heartbeat_interval
+        with self._lock:
+            while True:
+                queue = self._queues.get(queue_id)
+                if queue is None or queue.user is not request.user:
+                    raise FakeServerError(f"Bad event queue ID: {queue_id}", "BAD_EVENT_QUEUE_ID")
+                # Events up to last_event_id have been handled.
+                queue.events = [event for event in queue.events if event["id"] > last_event_id]
+                if queue.events or dont_block:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    queue.events.append({"type": "heartbeat", "id": queue.next_event_id})
+                    queue.next_event_id += 1
+                    break
+                self._lock.wait(remaining)
+            return {"events": list(queue.events), "queue_id": queue.id}
+
+    def _delete_queue(self, request: _Request) -> Dict[str, Any]:
+        with self._lock:
+            queue = self._queues.get(request.params.get("queue_id", ""))
+            if queue is None or queue.user is not request.user:
+                raise FakeServerError("Bad event queue ID", "BAD_EVENT_QUEUE_ID")
+            del self._queues[queue.id]
+            self._lock.notify_all()
+        return {}
+
+    def _send_message(self, request: _Request) -> Dict[str, Any]:
+        message_type = request.params.get("type", "stream")
+        to = _parse_json(request.params, "to")
+        content = request.params.get("content", "")
+        if not content.strip():
+            raise FakeServerError("Message must not be empty")
+
+        with self._lock:
+            message: Dict[str, Any] = {
+                "id": len(self._messages) + 1,
+                "sender_id": request.user.id,
+                "sender_email": request.user.email,
+                "sender_full_name": request.user.full_name,
+                "sender_realm_str": "fake",
+                "content": content,
+                "content_type": "text/x-markdown",
+                "timestamp": int(time.time()),
+                "client": "ZulipPython",
+                "is_me_message": content.startswith("/me "),
+                "reactions": [],
+                "submessages": [],
+                "topic_links": [],
+                "avatar_url": None,
+            }
+            if message_type in ("stream", "channel"):
+                if isinstance(to, list):
+                    to = to[0] if len(to) == 1 else None
+                stream = (
+                    self._streams.get(to) if isinstance(to, int) else self._stream_by_name(str(to))
+                )
+                if stream is None:
+                    raise FakeServerError(f"Stream '{to}' does not exist", "STREAM_DOES_NOT_EXIST")
+                topic = request.params.get("topic", request.params.get("subject", ""))
+                message.update(
+                    type="stream",
+                    display_recipient=stream.name,
+                    stream_id=stream.id,
+                    subject=topic,
+                    recipient_id=-stream.id,
+                )
+                recipients = [self._users[user_id] for user_id in stream.subscribers]
+            elif message_type in ("private", "direct"):
+                if isinstance(to, str):
+                    to = [address.strip() for address in to.split(",")]
+                recipients = []
+                for recipient in to if isinstance(to, list) else [to]:
+                    found = (
+                        self._users.get(recipient)
+                        if isinstance(recipient, int)
+                        else self._users_by_email.get(str(recipient).lower())
+                    )
+                    if found is None:
+                        raise FakeServerError(f"Invalid email '{recipient}'")
+                    recipients.append(found)
+                participants = sorted({request.user, *recipients}, key=lambda u: u.id)
+                message.update(
+                    type="private",
+                    display_recipient=[
+                        {
+                            "id": u.id,
+                            "email": u.email,
+                            "full_name": u.full_name,
+                            "is_mirror_dummy": False,
+                        }
+                        for u in participants
+                    ],
+                    subject="",
+                    recipient_id=0,
+                )
+                recipients = participants
+            else:
+                raise FakeServerError(f"Invalid message type: {message_type}")
+
+            self._messages.append(message)
+            for recipient in recipients:
+                flags = ["read"] if recipient is request.user else []
+                self._send_event(recipient, {"type": "message", "message": message, "flags": flags})
+            return {"id": message["id"]}
+
+    def _get_messages(self, request: _Request) -> Dict[str, Any]:
+        anchor = _parse_json(request.params, "anchor", "newest")
+        num_before = int(request.params.get("num_before", 0))
+        num_after = int(request.params.get("num_after", 0))
+        include_anchor = _parse_json(request.params, "include_anchor", True)
+        narrow = self._narrow_filter(request.user, _parse_json(request.params, "narrow", []))
+        with self._lock:
+            messages = [m for m in self._messages if self._can_see(request.user, m) and narrow(m)]
+
+        if anchor in ("newest", "first_unread"):
+            anchor_id = messages[-1]["id"] if messages else 0
+        elif anchor == "oldest":
+            anchor_id = 0
+        else:
+            anchor_id = int(anchor)
+        before = [m for m in messages if m["id"] < anchor_id]
+        at = [m for m in messages if m["id"] == anchor_id]
+        after = [m for m in messages if m["id"] > anchor_id]
+        found = before[len(before) - num_before :] if num_before else []
+        if include_anchor:
+            found += at
+        found += after[:num_after]
+        return {
+            "messages": [{**m, "flags": ["read"]} for m in found],
+            "anchor": anchor_id,
+            "found_anchor": bool(at),
+            "found_oldest": len(before) <= num_before,
+            "found_newest": len(after) <= num_after,
+            "history_limited": False,
+        }
+
+    def _get_profile(self, request: _Request) -> Dict[str, Any]:
+        with self._lock:
+            max_message_id = self._messages[-1]["id"] if self._messages else -1
+        return {**request.user.to_dict(), "max_message_id": max_message_id}
+
+    def _get_members(self, request: _Request) -> Dict[str, Any]:
+        with self._lock:
+            return {"members": [member.to_dict() for member in self._users.values()]}
+
+    def _get_streams(self, request: _Request) -> Dict[str, Any]:
+        with self._lock:
+            return {"streams": [stream.to_dict() for stream in self._streams.values()]}
+
+    def _get_stream_id(self, request: _Request) -> Dict[str, Any]:
+        with self._lock:
+            stream = self._stream_by_name(request.params.get("stream", ""))
+        if stream is None:
+            raise FakeServerError("Invalid stream name '{}'".format(request.params.get("stream")))
+        return {"stream_id": stream.id}
+
+    def _get_subscriptions(self, request: _Request) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "subscriptions": [
+                    self._subscription(stream)
+                    for stream in self._streams.values()
+                    if request.user.id in stream.subscribers
+                ]
+            }
+
+    def _subscribe(self, request: _Request) -> Dict[str, Any]:
+        subscriptions = _parse_json(request.params, "subscriptions", [])
+        subscribed: Dict[str, List[str]] = {}
+        already_subscribed: Dict[str, List[str]] = {}
+        with self._lock:
+            principals = [
+                self._users[p] if isinstance(p, int) else self._users_by_email[p.lower()]
+                for p in _parse_json(request.params, "principals", [request.user.id])
+            ]
+            for subscription in subscriptions:
+                stream = self._stream_by_name(subscription["name"])
+                if stream is None:
+                    stream = self._create_stream(
+                        subscription["name"], subscription.get("description", "")
+                    )
+                for principal in principals:
+                    added = self._subscribe_user(principal, stream)
+                    result = subscribed if added else already_subscribed
+                    result.setdefault(principal.email, []).append(stream.name)
+        return {"subscribed": subscribed, "already_subscribed": already_subscribed}
+
+    def _unsubscribe(self, request: _Request) -> Dict[str, Any]:
+        removed = []
+        not_removed = []
+        with self._lock:
+            for name in _parse_json(request.params, "subscriptions", []):
+                stream = self._stream_by_name(name)
+                if stream is None or request.user.id not in stream.subscribers:
+                    not_removed.append(name)
+                    continue
+                stream.subscribers.remove(request.user.id)
+                removed.append(name)
+                self._send_event(
+                    request.user,
+                    {
+                        "type": "subscription",
+                        "op": "remove",
+                        "subscriptions": [{"name": stream.name, "stream_id": stream.id}],
+                    },
+                )
+        return {"removed": removed, "not_removed": not_removed}
+
+    def _get_storage(self, request: _Request) -> Dict[str, Any]:
+        keys = _parse_json(request.params, "keys")
+        with self._lock:
+            if keys is None:
+                return {"storage": dict(request.user.storage)}
+            missing = [key for key in keys if key not in request.user.storage]
+            if missing:
+                raise FakeServerError("Key does not exist.")
+            return {"storage": {key: request.user.storage[key] for key in keys}}
+
+    def _update_storage(self, request: _Request) -> Dict[str, Any]:
+        storage = _parse_json(request.params, "storage", {})
+        if not isinstance(storage, dict) or not all(
+            isinstance(value, str) for value in storage.values()
+        ):
+            raise FakeServerError("storage contains a value that is not a string")
+        with self._lock:
+            request.user.storage.update(storage)
+        return {}
+
+    def _remove_storage(self, request: _Request) -> Dict[str, Any]:
+        keys = _parse_json(request.params, "keys")
+        with self._lock:
+            if keys is None:
+                request.user.storage.clear()
+                return {}
+            if any(key not in request.user.storage for key in keys):
+                raise FakeServerError("Key does not exist.")
+            for key in keys:
+                del request.user.storage[key]
+        return {}
+
+    def _upload(self, request: _Request) -> Dict[str, Any]:
+        files = request.files
+        if len(files) != 1:
+            raise FakeServerError("You must specify a file to upload")
+        [(filename, content)] = files
+        with self._lock:
+            upload_id = len(self._uploads) + 1
+            path = f"1/{secrets.token_hex(12)}/{urllib.parse.quote(filename)}"
+            self._uploads[path] = _Upload(upload_id, path, filename, content, request.user)
+        url = f"/user_uploads/{path}"
+        return {"uri": url, "url": url, "filename": filename}
+
+    def _get_upload_url(self, request: _Request) -> Dict[str, Any]:
+        with self._lock:
+            upload = self._uploads.get(request.path_args["path"])
+            if upload is None:
+                raise FakeServerError("File not found", "NOT_FOUND", 404)
+            token = secrets.token_hex(16)
+            self._temporary_urls[token] = upload.path
+        return {"url": f"/user_uploads/temporary/{token}/{urllib.parse.quote(upload.name)}"}
+
+    def _get_attachments(self, request: _Request) -> Dict[str, Any]:
+        with self._lock:
+            uploads = [upload for upload in self._uploads.values() if upload.owner is request.user]
+        return {
+            "attachments": [
+                {
+                    "id": upload.id,
+                    "name": upload.name,
+                    "path_id": upload.path,
+                    "size": len(upload.content),
+                    "create_time": upload.created,
+                    "messages": [],
+                }
+                for upload in uploads
+            ],
+            "upload_space_used": sum(len(upload.content) for upload in uploads),
+        }
+
+    def _download(self, path: str, headers: Mapping[str, str]) -> Response:
+        token = path.split("/")[2]
+        with self._lock:
+            upload = self._uploads.get(self._temporary_urls.get(token, ""))
+        if upload is None:
+            return 404, {"Content-Type": "text/plain"}, b"Not found"
+        range_header = {k.lower(): v for k, v in headers.items()}.get("range", "")
+        match = re.fullmatch(r"bytes=(\d+)-", range_header)
+        if match is None:
+            return 200, {"Content-Type": "application/octet-stream"}, upload.content
+        start = int(match.group(1))
+        if start >= len(upload.content):
+            return 416, {"Content-Range": f"bytes */{len(upload.content)}"}, b""
+        return (
+            206,
+            {
+                "Content-Type": "application/octet-stream",
+                "Content-Range": f"bytes {start}-{len(upload.content) - 1}/{len(upload.content)}",
+            },
+            upload.content[start:],
+        )
+
+
+def _json_response(status: int, data: Dict[str, Any]) -> Response:
+    return status, {"Content-Type": "application/json"}, json.dumps(data).encode()
+
+
+class FakeZulipAdapter(requests.adapters.BaseAdapter):
+    """A `requests` transport adapter sending requests to a
+    `FakeZulipServer`; see `FakeZulipServer.client`."""
+
+    def __init__(self, server: FakeZulipServer) -> None:
+        super().__init__()
+        self.server = server
+
+    @override
+    def send(
+        self,
+        request: requests.PreparedRequest,
+        stream: bool = False,
+        timeout: Any = None,
+        verify: Any = True,
+        cert: Any = None,
+        proxies: Any = None,
+    ) -> requests.Response:
+        # requests passes file-like bodies, like those of
+        # zulip.multipart.MultipartEncoder, on as they are.
+        body: Union[bytes, str, IO[bytes], None] = request.body
+        if body is None:
+            data = b""
+        elif isinstance(body, str):
+            data = body.encode()
+        elif isinstance(body, bytes):
+            data = body
+        else:
+            data = body.read()
+        assert request.method is not None
+        assert request.url is not None
+        status, headers, content = self.server.handle(
+            request.method, request.url, request.headers, data
+        )
+
+        response = requests.Response()
+        response.status_code = status
+        response.headers = requests.structures.CaseInsensitiveDict(headers)
+        response.raw = io.BytesIO(content)
+        response.url = request.url
+        response.request = request
+        response.reason = ""
+        response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+        return response
+
+    @override
+    def close(self) -> None:
+        pass
@@ -0,0 +1,120 @@
+import sys
+from typing import Any, Dict, Iterator, Mapping, Optional
+
+from typing_extensions import override
+
+from zulip import get_json_codec
+
+# Fields every message has, kept in slots of their own; everything
+# else is kept JSON-encoded, and only decoded when it's looked at.
+_FIELDS = ("id", "type", "sender_id", "sender_email", "sender_full_name", "subject", "timestamp")
+
+# Identical encodings of the other fields (say, of messages in the same
+# stream, without reactions) are shared, up to this many at a time.
+_MAX_SHARED_EXTRAS = 4096
+_shared_extras: Dict[bytes, bytes] = {}
+
+
+class CompactMessage(Mapping[str, Any]):
+    """A read-only message taking a fraction of the memory of the dict
+    the server's JSON decodes to, for consumers that keep many messages
+    around (see `Client.compact_messages`).
+
+    It can be used like the dict (`message["content"]`, `.get()`,
+    `dict(message)`), and its most used fields are also attributes.
+    Those are stored as they are, and strings that many messages share,
+    such as sender names and topics, are interned.  `content` is kept
+    as UTF-8, and the remaining fields (reactions, flags, edit history,
+    direct message recipients and so on) as JSON, each decoded again
+    every time it's looked at.
+    """
+
+    __slots__ = (*_FIELDS, "stream_id", "_stream", "_content", "_extras")
+
+    id: int
+    type: str
+    sender_id: int
+    sender_email: str
+    sender_full_name: str
+    subject: str
+    timestamp: int
+    stream_id: Optional[int]
+    _stream: Optional[str]
+    _content: bytes
+    _extras: Optional[bytes]
+
+    def __init__(self, message: Mapping[str, Any]) -> None:
+        extras = dict(message)
+        self.id = extras.pop("id")
+        self.type = extras.pop("type")
+        self.sender_id = extras.pop("sender_id")
+        self.sender_email = sys.intern(extras.pop("sender_email"))
+        self.sender_full_name = sys.intern(extras.pop("sender_full_name"))
+        self.subject = sys.intern(extras.pop("subject"))
+        self.timestamp = extras.pop("timestamp")
+        self.stream_id = extras.pop("stream_id", None)
+        self._stream = (
+            sys.intern(extras.pop("display_recipient")) if self.type == "stream" else None
+        )
+        self._content = extras.pop("content").encode()
+        self._extras = _share(extras) if extras else None
+
+    @property
+    def content(self) -> str:
+        return self._content.decode()
+
+    @property
+    def display_recipient(self) -> Any:
+        return self._stream if self._stream is not None else self["display_recipient"]
+
+    def _decode_extras(self) -> Dict[str, Any]:
+        return {} if self._extras is None else get_json_codec().loads(self._extras)
+
+    @override
+    def __getitem__(self, key: str) -> Any:
+        if key in _FIELDS:
+            return getattr(self, key)
+        if key == "content":
+            return self.content
+        if key == "stream_id" and self.stream_id is not None:
+            return self.stream_id
+        if key == "display_recipient" and self._stream is not None:
+            return self._stream
+        return self._decode_extras()[key]
+
+    @override
+    def __iter__(self) -> Iterator[str]:
+        yield from _FIELDS
+        yield "content"
+        if self.stream_id is not None:
+            yield "stream_id"
+        if self._stream is not None:
+            yield "display_recipient"
+        yield from self._decode_extras()
+
+    @override
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    @override
+    def __repr__(self) -> str:
+        return f"CompactMessage({self.to_dict()!r})"
+
+    def to_dict(self) -> Dict[str, Any]:
+        """The message as a plain dict, as the server sent it."""
+        return dict(self)
+
+    @override
+    def __reduce__(self) -> Any:
+        return (CompactMessage, (self.to_dict(),))
+
+
+def _share(extras: Dict[str, Any]) -> bytes:
+    encoded = get_json_codec().dumps(extras).encode()
+    shared = _shared_extras.get(encoded)
+    if shared is not None:
+        return shared
+    if len(_shared_extras) >= _MAX_SHARED_EXTRAS:
+        _shared_extras.clear()
+    _shared_extras[encoded] = encoded
+    return encoded
@@ -0,0 +1,256 @@
+import json
+import re
+import threading
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from typing_extensions import override
+
+from zulip import API_VERSTRING
+
+# Upper bounds, in seconds, of the request latency histogram buckets.
+# They go up to 90s because long-polling get_events requests are
+# expected to take that long.
+DEFAULT_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 90.0)
+
+
+class RequestRecord(NamedTuple):
+    """One HTTP request made by a client: one attempt at an API call."""
+
+    # The method and path of the call, with IDs and emails replaced by
+    # placeholders (see `endpoint_name`), e.g. "POST messages/:id/reactions".
+    endpoint: str
+    # None if no response was received.
+    status_code: Optional[int]
+    # Seconds from sending the request until its response was read.
+    duration: float
+    request_bytes: int
+    response_bytes: int
+    # 0 for the first attempt at a call, 1 for the first retry, etc.
+    attempt: int
+    # The name of the exception raised instead of a response, if any.
+    error: Optional[str] = None
+
+
+class RequestHook:
+    """Receives a callback for every request a client makes, and every
+    time it sleeps before retrying.
+
+    Add hooks to a client's `request_hooks` list; the methods are
+    called from whichever thread made the request, so they should be
+    quick and thread-safe.
+    """
+
+    def on_request(self, record: RequestRecord) -> None:
+        pass
+
+    def on_sleep(self, endpoint: str, reason: str, seconds: float) -> None:
+        """`reason` is "retry" after an error, or "rate_limit"."""
+
+    def on_coalesce(self, endpoint: str) -> None:
+        """Called when a call is answered by an identical GET request
+        that was already in progress, rather than making its own."""
+
+    def on_cache(self, endpoint: str, outcome: str) -> None:
+        """Called when a call is looked up in the client's
+        `response_cache`.  `outcome` is "hit" if it was answered from
+        the cache, "revalidated" if the server confirmed a cached
+        response is still current, or "miss"."""
+
+
+_ID_SEGMENT = re.compile(r"(?<=/)(?:\d+|[^/]*@[^/]*)(?=/|$)")
+
+
+def endpoint_name(method: str, url: str) -> str:
+    path = url.split("?", 1)[0]
+    if path.startswith(API_VERSTRING):
+        path = path[len(API_VERSTRING) :]
+    path = _ID_SEGMENT.sub(lambda m: ":email" if "@" in m.group() else ":id", "/" + path)
+    return f"{method} {path[1:]}"
+
+
+class _EndpointMetrics:
+    def __init__(self, bucket_count: int) -> None:
+        self.status_codes: Dict[str, int] = {}
+        self.bucket_counts = [0] * bucket_count
+        self.duration_count = 0
+        self.duration_sum = 0.0
+        self.retries = 0
+        self.coalesced = 0
+        self.cache: Dict[str, int] = {}
+        self.request_bytes = 0
+        self.response_bytes = 0
+        self.sleep_seconds: Dict[str, float] = {}
+
+
+class RequestMetrics(RequestHook):
+    """A `RequestHook` that keeps per-endpoint request counts by status
+    code, latency histograms, retry counts, calls coalesced with an
+    identical request, response cache lookups, bytes sent and received,
+    and time spent sleeping before retries.
+
+    >>> metrics = RequestMetrics()
+    >>> client.request_hooks.append(metrics)
+    >>> ...
+    >>> print(metrics.to_prometheus())
+
+    `to_prometheus` renders the metrics in the Prometheus text
+    exposition format, and `to_dict` as JSON-serializable data.
+    """
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS) -> None:
+        self.buckets = sorted(buckets)
+        self._lock = threading.Lock()
+        self._endpoints: Dict[str, _EndpointMetrics] = {}
+
+    def _endpoint(self, endpoint: str) -> _EndpointMetrics:
+        metrics = self._endpoints.get(endpoint)
+        if metrics is None:
+            metrics = self._endpoints[endpoint] = _EndpointMetrics(len(self.buckets))
+        return metrics
+
+    @override
+    def on_request(self, record: RequestRecord) -> None:
+        status = str(record.status_code) if record.status_code is not None else record.error
+        with self._lock:
+            metrics = self._endpoint(record.endpoint)
+            metrics.status_codes[str(status)] = metrics.status_codes.get(str(status), 0) + 1
+            for i, bound in enumerate(self.buckets):
+                if record.duration <= bound:
+                    metrics.bucket_counts[i] += 1
+                    break
+            metrics.duration_count += 1
+            metrics.duration_sum += record.duration
+            if record.attempt > 0:
+                metrics.retries += 1
+            metrics.request_bytes += record.request_bytes
+            metrics.response_bytes += record.response_bytes
+
+    @override
+    def on_coalesce(self, endpoint: str) -> None:
+        with self._lock:
+            self._endpoint(endpoint).coalesced += 1
+
+    @override
+    def on_cache(self, endpoint: str, outcome: str) -> None:
+        with self._lock:
+            cache = self._endpoint(endpoint).cache
+            cache[outcome] = cache.get(outcome, 0) + 1
+
+    @override
+    def on_sleep(self, endpoint: str, reason: str, seconds: float) -> None:
+        with self._lock:
+            sleep_seconds = self._endpoint(endpoint).sleep_seconds
+            sleep_seconds[reason] = sleep_seconds.get(reason, 0.0) + seconds
+
+    def to_dict(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            result = {}
+            for endpoint, metrics in sorted(self._endpoints.items()):
+                cumulative = 0
+                histogram = {}
+                for bound, count in zip(self.buckets, metrics.bucket_counts):
+                    cumulative += count
+                    histogram[str(bound)] = cumulative
+                result[endpoint] = {
+                    "requests": dict(metrics.status_codes),
+                    "duration_seconds": {
+                        "count": metrics.duration_count,
+                        "sum": metrics.duration_sum,
+                        "buckets": histogram,
+                    },
+                    "retries": metrics.retries,
+                    "coalesced": metrics.coalesced,
+                    "cache": dict(metrics.cache),
+                    "request_bytes": metrics.request_bytes,
+                    "response_bytes": metrics.response_bytes,
+                    "sleep_seconds": dict(metrics.sleep_seconds),
+                }
+            return result
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict(), indent=2)
+
+    def to_prometheus(self, prefix: str = "zulip_api") -> str:
+        data = self.to_dict()
+        lines: List[str] = []
+
+        def metric(name: str, kind: str, help: str, samples: List[Tuple[str, Any]]) -> None:
+            lines.append(f"# HELP {prefix}_{name} {help}")
+            lines.append(f"# TYPE {prefix}_{name} {kind}")
+            lines.extend(f"{prefix}_{sample} {value}" for sample, value in samples)
+
+        def labels(**values: str) -> str:
+            return ",".join(f'{key}="{_escape(value)}"' for key, value in values.items())
+
+        metric(
+            "requests_total",
+            "counter",
+            "HTTP requests made, by response status.",
+            [
+                (f"requests_total{{{labels(endpoint=endpoint, status=status)}}}", count)
+                for endpoint, metrics in data.items()
+                for status, count in sorted(metrics["requests"].items())
+            ],
+        )
+        histogram: List[Tuple[str, Any]] = []
+        for endpoint, metrics in data.items():
+            duration = metrics["duration_seconds"]
+            for bound, count in duration["buckets"].items():
+                histogram.append(
+                    (
+                        f"request_duration_seconds_bucket{{{labels(endpoint=endpoint, le=bound)}}}",
+                        count,
+                    )
+                )
+            histogram += [
+                (
+                    f"request_duration_seconds_bucket{{{labels(endpoint=endpoint, le='+Inf')}}}",
+                    duration["count"],
+                ),
+                (f"request_duration_seconds_sum{{{labels(endpoint=endpoint)}}}", duration["sum"]),
+                (
+                    f"request_duration_seconds_count{{{labels(endpoint=endpoint)}}}",
+                    duration["count"],
+                ),
+            ]
+        metric("request_duration_seconds", "histogram", "HTTP request latency.", histogram)
+        for name, help in [
+            ("retries", "Requests that were retries of an earlier failed request."),
+            ("coalesced", "Calls answered by an identical request already in progress."),
+            ("request_bytes", "Bytes of request bodies sent."),
+            ("response_bytes", "Bytes of response bodies received."),
+        ]:
+            metric(
+                f"{name}_total",
+                "counter",
+                help,
+                [
+                    (f"{name}_total{{{labels(endpoint=endpoint)}}}", metrics[name])
+                    for endpoint, metrics in data.items()
+                ],
+            )
+        metric(
+            "cache_lookups_total",
+            "counter",
+            "Calls looked up in the response cache, by outcome.",
+            [
+                (f"cache_lookups_total{{{labels(endpoint=endpoint, outcome=outcome)}}}", count)
+                for endpoint, metrics in data.items()
+                for outcome, count in sorted(metrics["cache"].items())
+            ],
+        )
+        metric(
+            "sleep_seconds_total",
+            "counter",
+            "Time spent waiting before retrying or to respect rate limits.",
+            [
+                (f"sleep_seconds_total{{{labels(endpoint=endpoint, reason=reason)}}}", seconds)
+                for endpoint, metrics in data.items()
+                for reason, seconds in sorted(metrics["sleep_seconds"].items())
+            ],
+        )
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
@@ -0,0 +1,122 @@
+import io
+import mimetypes
+import os
+import uuid
+from typing import IO, TYPE_CHECKING, Any, Callable, List, Mapping, Optional, Sequence, Tuple, Union
+
+from typing_extensions import override
+
+if TYPE_CHECKING:
+    from _typeshed import WriteableBuffer
+
+# Called with the number of bytes of the request body sent so far, and
+# its total size.
+ProgressCallback = Callable[[int, int], None]
+
+# How much of a file is read at a time when the body is streamed.
+CHUNK_SIZE = 64 * 1024
+
+
+def _quote(value: str) -> str:
+    # The escaping browsers use for names in Content-Disposition headers.
+    return value.replace('"', "%22").replace("\r", "%0D").replace("\n", "%0A")
+
+
+class MultipartEncoder(io.RawIOBase):
+    """A multipart/form-data request body that reads its files while it
+    is being sent, rather than building the whole body in memory.
+
+    `fields` are sent as plain form fields; each file is sent as a
+    field named after its `name` (as `requests` does), from its current
+    position to its end.  The body's length is known up front, so it
+    can be sent with a Content-Length header:
+
+    >>> encoder = MultipartEncoder({}, [open("build.tar.gz", "rb")])
+    >>> session.post(url, data=encoder, headers={"Content-Type": encoder.content_type})
+
+    If given, `progress` is called after every chunk of the body is
+    read.
+    """
+
+    def __init__(
+        self,
+        fields: Mapping[str, str],
+        files: Sequence[IO[Any]],
+        progress: Optional[ProgressCallback] = None,
+    ) -> None:
+        super().__init__()
+        self.boundary = uuid.uuid4().hex
+        self.content_type = f"multipart/form-data; boundary={self.boundary}"
+        self.progress = progress
+
+        # Each part is either some bytes, or a (file, size) pair.
+        self._parts: List[Union[bytes, Tuple[IO[bytes], int]]] = []
+        self._length = 0
+        for name, value in fields.items():
+            self._add_bytes(
+                f'--{self.boundary}\r\nContent-Disposition: form-data; name="{_quote(name)}"'
+                f"\r\n\r\n{value}\r\n".encode()
+            )
+        for file in files:
+            filename = os.path.basename(file.name)
+            content_type = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+            self._add_bytes(
+                f'--{self.boundary}\r\nContent-Disposition: form-data; name="{_quote(file.name)}";'
+                f' filename="{_quote(filename)}"\r\nContent-Type: {content_type}\r\n\r\n'.encode()
+            )
+            binary_file = file
+            if isinstance(file.read(0), str):
+                # A text file; send the binary file underneath it.
+                buffer = getattr(file, "buffer", None)
+                if buffer is None:
+                    # E.g. a StringIO, whose contents are in memory anyway.
+                    self._add_bytes(file.read().encode())
+                    self._add_bytes(b"\r\n")
+                    continue
+                binary_file = buffer
+            start = binary_file.tell()
+            size = binary_file.seek(0, io.SEEK_END) - start
+            binary_file.seek(start)
+            self._parts.append((binary_file, size))
+            self._length += size
+            self._add_bytes(b"\r\n")
+        self._add_bytes(f"--{self.boundary}--\r\n".encode())
+
+        self._part = 0
+        self._offset = 0
+        self._sent = 0
+
+    def _add_bytes(self, data: bytes) -> None:
+        self._parts.append(data)
+        self._length += len(data)
+
+    def __len__(self) -> int:
+        return self._length
+
+    @override
+    def readable(self) -> bool:
+        return True
+
+    @override
+    def readinto(self, buffer: "WriteableBuffer") -> int:
+        view = memoryview(buffer).cast("B")
+        while self._part < len(self._parts):
+            part = self._parts[self._part]
+            if isinstance(part, bytes):
+                chunk = part[self._offset : self._offset + len(view)]
+            else:
+                file, size = part
+                chunk = file.read(min(len(view), size - self._offset))
+                if not chunk and self._offset < size:
+                    raise ValueError(f"{file.name} was truncated while it was being uploaded")
+            if not chunk:
+                self._part += 1
+                self._offset = 0
+                continue
+            view[: len(chunk)] = chunk
+            self._offset += len(chunk)
+            self._sent += len(chunk)
+            if self.progress is not None:
+                self.progress(self._sent, self._length)
+            return len(chunk)
+        return 0
@@ -0,0 +1,109 @@
+import asyncio
+import functools
+from typing import Awaitable, Callable, List, Optional
+
+from zulip.async_client import AsyncClient, AsyncEventCallback
+from zulip.checkpoint import CheckpointStore, EventQueueCheckpoint
+
+
+class EventMultiplexer:
+    """Consumes many event queues concurrently from a single thread.
+
+    Rather than dedicating a thread or process to each blocking
+    `call_on_each_event` loop, queues are added to a multiplexer, each
+    with its own callback, and long-polled together from one asyncio
+    event loop:
+
+    >>> multiplexer = EventMultiplexer()
+    >>> for config_file in ["~/realm1-zuliprc", "~/realm2-zuliprc"]:
+    ...     client = zulip.AsyncClient(config_file=config_file)
+    ...     multiplexer.add_message_callback(client, functools.partial(relay, client))
+    >>> multiplexer.run()
+
+    Queues can be on different realms or use different credentials,
+    or several can share one `AsyncClient`.  Every queue's long-poll
+    holds one of its client's connections open, so a client shared by
+    many queues needs a `connection_limit` of more than that many.
+
+    Callbacks may be plain functions or coroutine functions; all of
+    them run on the event loop's thread, so a callback that blocks
+    holds up every queue.  If a callback raises an exception, the
+    other queues are stopped and the exception is re-raised.
+    """
+
+    def __init__(self) -> None:
+        self.clients: List[AsyncClient] = []
+        self._consumers: List[Callable[[], Awaitable[None]]] = []
+
+    def add(
+        self,
+        client: AsyncClient,
+        callback: AsyncEventCallback,
+        event_types: Optional[List[str]] = None,
+        narrow: Optional[List[List[str]]] = None,
+        checkpoint_store: Optional[CheckpointStore] = None,
+        on_queue_lost: Optional[Callable[[EventQueueCheckpoint], None]] = None,
+        **kwargs: object,
+    ) -> None:
+        """Adds an event queue, registered and consumed as by
+        `client.call_on_each_event` with the same arguments."""
+        self._add(
+            client,
+            functools.partial(
+                client.call_on_each_event,
+                callback,
+                event_types,
+                narrow,
+                checkpoint_store,
+                on_queue_lost,
+                **kwargs,
+            ),
+        )
+
+    def add_message_callback(
+        self,
+        client: AsyncClient,
+        callback: AsyncEventCallback,
+        checkpoint_store: Optional[CheckpointStore] = None,
+        on_queue_lost: Optional[Callable[[EventQueueCheckpoint], None]] = None,
+        **kwargs: object,
+    ) -> None:
+        """Adds a queue of messages, as consumed by
+        `client.call_on_each_message`."""
+        self._add(
+            client,
+            functools.partial(
+                client.call_on_each_message, callback, checkpoint_store, on_queue_lost, **kwargs
+            ),
+        )
+
+    def _add(self, client: AsyncClient, consume: Callable[[], Awaitable[None]]) -> None:
+        if not any(client is known for known in self.clients):
+            self.clients.append(client)
+        self._consumers.append(consume)
+
+    async def run_async(self) -> None:
+        """Consumes every queue added so far until a callback raises."""
+        if not self._consumers:
+            return
+        tasks = [asyncio.ensure_future(consume()) for consume in self._consumers]
+        try:
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+            for task in done:
+                task.result()
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    def run(self) -> None:
+        """Runs `run_async` in a new event loop, closing every client's
+        connections when it finishes."""
+
+        async def run_and_close() -> None:
+            try:
+                await self.run_async()
+            finally:
+                await asyncio.gather(*(client.close() for client in self.clients))
+
+        asyncio.run(run_and_close())
@@ -0,0 +1,293 @@
+import re
+from typing import Any, Callable, Dict, Hashable, Iterable, List, Optional, Tuple
+
+# A compiled narrow: whether a message matches it.
+MessagePredicate = Callable[[Dict[str, Any]], bool]
+
+# Other names servers accept for operators.
+OPERATOR_ALIASES = {
+    "channel": "stream",
+    "subject": "topic",
+    "pm-with": "dm",
+}
+
+_TAG_RE = re.compile(r"<[^>]*>")
+_WORD_RE = re.compile(r"\w+")
+
+
+def parse_narrow(narrow: Optional[Iterable[Any]]) -> List[Tuple[str, Any, bool]]:
+    """The (operator, operand, negated) terms of a narrow, given in
+    any of the forms the API accepts: `["stream", "devel"]` pairs, with
+    a "-" before the operator to negate them, or `{"operator": ...,
+    "operand": ..., "negated": ...}` dicts.  Operators are canonicalized
+    (see `OPERATOR_ALIASES`)."""
+    terms = []
+    for term in narrow or []:
+        if isinstance(term, dict):
+            operator, operand, negated = term["operator"], term["operand"], term.get("negated")
+        else:
+            operator, operand = term
+            negated = operator.startswith("-")
+            operator = operator.lstrip("-")
+        terms.append((OPERATOR_ALIASES.get(operator, operator), operand, bool(negated)))
+    return terms
+
+
+def _topic(message: Dict[str, Any]) -> str:
+    return message["subject"] if "subject" in message else message.get("topic", "")
+
+
+def _match_stream(operand: Any, user_email: Optional[str]) -> MessagePredicate:
+    if isinstance(operand, int):
+        return lambda message: message["type"] == "stream" and message["stream_id"] == operand
+    name = operand.lower()
+    return (
+        lambda message: message["type"] == "stream" and message["display_recipient"].lower() == name
+    )
+
+
+def _match_topic(operand: Any, user_email: Optional[str]) -> MessagePredicate:
+    topic = operand.lower()
+    return lambda message: message["type"] == "stream" and _topic(message).lower() == topic
+
+
+def _match_sender(operand: Any, user_email: Optional[str]) -> MessagePredicate:
+    if isinstance(operand, int):
+        return lambda message: message["sender_id"] == operand
+    email = operand.lower()
+    return lambda message: message["sender_email"].lower() == email
+
+
+def _match_is(operand: Any, user_email: Optional[str]) -> MessagePredicate:
+    if operand in ("private", "dm"):
+        return lambda message: message["type"] == "private"
+    if operand == "mentioned":
+        return lambda message: bool(
+            {"mentioned", "wildcard_mentioned"}.intersection(message.get("flags", ()))
+        )
+    if operand == "starred":
+        return lambda message: "starred" in message.get("flags", ())
+    if operand == "unread":
+        return lambda message: "read" not in message.get("flags", ())
+    if operand == "resolved":
+        return lambda message: message["type"] == "stream" and _topic(message).startswith("✔ ")
+    raise ValueError(f"Unsupported narrow: is:{operand}")
+
+
+def _match_has(operand: Any, user_email: Optional[str]) -> MessagePredicate:
+    # Judged from the rendered content, as events and get_messages
+    # don't include the server's has_* flags.
+    if operand == "link":
+        return lambda message: "<a " in message["content"] or "://" in message["content"]
+    if operand == "attachment":
+        return lambda message: "/user_uploads/" in message["content"]
+    if operand == "image":
+        return lambda message: "message_inline_image" in message["content"]
+    raise ValueError(f"Unsupported narrow: has:{operand}")
+
+
+def _match_dm(operand: Any, user_email: Optional[str]) -> MessagePredicate:
+    # Users are given either by email or, on newer servers, by ID.
+    addresses = operand.split(",") if isinstance(operand, str) else list(operand)
+    by_id = all(isinstance(address, int) for address in addresses)
+    wanted = {str(address).lower() for address in addresses}
+    if user_email is not None and not by_id:
+        wanted.add(user_email.lower())
+
+    def match(message: Dict[str, Any]) -> bool:
+        if message["type"] != "private":
+            return False
+        recipients = {
+            str(recipient["id"] if by_id else recipient["email"]).lower()
+            for recipient in message["display_recipient"]
+        }
+        if user_email is None or by_id:
+            # Without knowing which of the participants is the user,
+            # accept a conversation between the given users and one
+            # other.
+            return wanted <= recipients and len(recipients - wanted) <= 1
+        return recipients == wanted
+
+    return match
+
+
+def _match_search(operand: Any, user_email: Optional[str]) -> MessagePredicate:
+    # Like the server's full-text search, words match by prefix, in
+    # the topic or the content.
+    search_words = _WORD_RE.findall(str(operand).lower())
+
+    def match(message: Dict[str, Any]) -> bool:
+        text = _TAG_RE.sub(" ", message["content"]) + " " + _topic(message)
+        words = _WORD_RE.findall(text.lower())
+        return all(any(word.startswith(prefix) for word in words) for prefix in search_words)
+
+    return match
+
+
+def _match_id(operand: Any, user_email: Optional[str]) -> MessagePredicate:
+    message_id = int(operand)
+    return lambda message: message["id"] == message_id
+
+
+_OPERATORS: Dict[str, Callable[[Any, Optional[str]], MessagePredicate]] = {
+    "stream": _match_stream,
+    "topic": _match_topic,
+    "sender": _match_sender,
+    "is": _match_is,
+    "has": _match_has,
+    "dm": _match_dm,
+    "search": _match_search,
+    "id": _match_id,
+}
+
+
+def compile_narrow(
+    narrow: Optional[Iterable[Any]], user_email: Optional[str] = None
+) -> MessagePredicate:
+    """Compiles a narrow into a function returning whether a message
+    (as in a message event or a `get_messages` response) matches it,
+    so that a broad event queue can be filtered as the server would.
+
+    Names and topics are compared case-insensitively, as by the
+    server.  `user_email` is that of the user whose messages these
+    are, which `dm` narrows need to tell the other participants
+    apart.  Raises ValueError for operators other than stream, topic,
+    sender, is, has, dm, search and id (or their aliases).
+    """
+    predicates = []
+    for operator, operand, negated in parse_narrow(narrow):
+        if operator not in _OPERATORS:
+            raise ValueError(f"Unsupported narrow operator: {operator}")
+        predicate = _OPERATORS[operator](operand, user_email)
+        if negated:
+            predicate = _negate(predicate)
+        predicates.append(predicate)
+
+    if not predicates:
+        return lambda message: True
+    if len(predicates) == 1:
+        return predicates[0]
+    return lambda message: all(predicate(message) for predicate in predicates)
+
+
+def _negate(predicate: MessagePredicate) -> MessagePredicate:
+    return lambda message: not predicate(message)
+
+
+def _index_key(narrow: Optional[Iterable[Any]]) -> Optional[Hashable]:
+    """The key a `NarrowRouter` files a narrow under: the most specific
+    of its (non-negated) stream, stream and topic, direct message or
+    sender terms that every matching message shares."""
+    positive = {
+        operator: operand for operator, operand, negated in parse_narrow(narrow) if not negated
+    }
+    if "stream" in positive:
+        stream = positive["stream"]
+        topic = positive["topic"].lower() if "topic" in positive else None
+        if isinstance(stream, int):
+            return ("stream_id", stream, topic)
+        return ("stream", stream.lower(), topic)
+    if "dm" in positive or positive.get("is") in ("private", "dm"):
+        return ("private",)
+    if "sender" in positive:
+        sender = positive["sender"]
+        return ("sender_id", sender) if isinstance(sender, int) else ("sender", sender.lower())
+    return None
+
+
+def _lookup_keys(message: Dict[str, Any]) -> List[Hashable]:
+    """Every key under which a narrow matching `message` can be filed."""
+    keys: List[Hashable] = [
+        ("sender_id", message["sender_id"]),
+        ("sender", message["sender_email"].lower()),
+    ]
+    if message["type"] == "stream":
+        name = message["display_recipient"].lower()
+        topic = _topic(message).lower()
+        keys += [("stream", name, None), ("stream", name, topic)]
+        if "stream_id" in message:
+            keys += [
+                ("stream_id", message["stream_id"], None),
+                ("stream_id", message["stream_id"], topic),
+            ]
+    else:
+        keys.append(("private",))
+    return keys
+
+
+class NarrowRouter:
+    """Delivers each message to the subscribers whose narrows it
+    matches, so that one event queue can feed many consumers.
+
+    >>> router = NarrowRouter(client.email)
+    >>> router.add([["stream", "devel"], ["topic", "bridge"]], relay_to_irc)
+    >>> router.add([["is", "dm"]], handle_command)
+    >>> client.call_on_each_message(router)
+
+    Rather than testing each message against every narrow, subscribers
+    are indexed by the stream (and topic), direct messages or sender
+    their narrow is limited to, so a message is only tested against
+    those that might match it (and those whose narrow can't be
+    indexed).  Subscribers are called in the order they were added.
+    """
+
+    def __init__(self, user_email: Optional[str] = None) -> None:
+        self.user_email = user_email
+        self._subscribers: Dict[
+            int, Tuple[MessagePredicate, Callable[[Dict[str, Any]], object]]
+        ] = {}
+        self._index: Dict[Hashable, List[int]] = {}
+        self._unindexed: List[int] = []
+        self._keys: Dict[int, Optional[Hashable]] = {}
+        self._next_id = 0
+
+    def add(
+        self, narrow: Optional[Iterable[Any]], callback: Callable[[Dict[str, Any]], object]
+    ) -> int:
+        """Subscribes `callback` to messages matching `narrow`; returns
+        an ID to pass to `remove`."""
+        narrow = list(narrow or [])
+        predicate = compile_narrow(narrow, self.user_email)
+        subscriber_id = self._next_id
+        self._next_id += 1
+        self._subscribers[subscriber_id] = (predicate, callback)
+        key = _index_key(narrow)
+        self._keys[subscriber_id] = key
+        if key is None:
+            self._unindexed.append(subscriber_id)
+        else:
+            self._index.setdefault(key, []).append(subscriber_id)
+        return subscriber_id
+
+    def remove(self, subscriber_id: int) -> None:
+        del self._subscribers[subscriber_id]
+        key = self._keys.pop(subscriber_id)
+        if key is None:
+            self._unindexed.remove(subscriber_id)
+        else:
+            self._index[key].remove(subscriber_id)
+            if not self._index[key]:
+                del self._index[key]
+
+    def match(self, message: Dict[str, Any]) -> List[Callable[[Dict[str, Any]], object]]:
+        """The callbacks of the subscribers `message` should go to."""
+        candidates = list(self._unindexed)
+        for key in _lookup_keys(message):
+            candidates += self._index.get(key, ())
+        if len(candidates) > 1:
+            candidates.sort()
+        matches = []
+        for subscriber_id in candidates:
+            predicate, callback = self._subscribers[subscriber_id]
+            if predicate(message):
+                matches.append(callback)
+        return matches
+
+    def __call__(self, event: Dict[str, Any]) -> None:
+        """Calls the matching subscribers with a message, or the
+        message of a message event; other events are ignored."""
+        message = event["message"] if event.get("type") == "message" else event
+        if "display_recipient" not in message:
+            return
+        for callback in self.match(message):
+            callback(message)
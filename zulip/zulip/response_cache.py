@@ -0,0 +1,175 @@
+import contextlib
+import glob
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Mapping, NamedTuple, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# How long, in seconds, responses from each endpoint are cached by
+# default.  Endpoints are named as by `zulip.metrics.endpoint_name`,
+# without the method.  Changes made by other users are only noticed
+# once a response expires, so these are kept short.
+DEFAULT_TTLS: Mapping[str, float] = {
+    "get_stream_id": 300.0,
+    "realm/emoji": 300.0,
+    "realm/linkifiers": 300.0,
+    "server_settings": 3600.0,
+    "streams": 60.0,
+    "user_groups": 60.0,
+    "users": 60.0,
+    "users/me/subscriptions": 60.0,
+}
+
+# A change to one of these resources may change the responses of
+# endpoints for the others: e.g. subscribing to a stream can create it,
+# and renaming a stream renames it in everyone's subscriptions.
+_RELATED_RESOURCES: Mapping[str, Tuple[str, ...]] = {
+    "streams": ("subscriptions",),
+    "subscriptions": ("streams",),
+}
+
+
+def resource_name(endpoint: str) -> str:
+    """The resource an endpoint reads or changes, which is usually the
+    first component of its path; requests changing a resource
+    invalidate the cached responses about it."""
+    if endpoint.startswith("users/me/subscriptions"):
+        return "subscriptions"
+    if endpoint == "get_stream_id":
+        return "streams"
+    return endpoint.split("/", 1)[0]
+
+
+class CachedResponse(NamedTuple):
+    # The response, as JSON.
+    body: str
+    # When, as a time.time() timestamp, the response should be fetched
+    # again (or revalidated, if it has validators).
+    expires_at: float
+    # Validators sent by the server with the response, if any.
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+
+
+class ResponseCache:
+    """A cache of responses to GET requests, used by a `Client` when set
+    as its `response_cache`.
+
+    Responses from the endpoints in `ttls` are kept for the given number
+    of seconds.  When an expired response came with an ETag or
+    Last-Modified header, it is revalidated with a conditional request,
+    and reused if the server says it hasn't changed.  Any other request
+    to the same resource (see `resource_name`) made through the client
+    invalidates its cached responses.
+
+    At most `max_entries` responses are kept in memory.  If `directory`
+    is given, responses are also stored there, where other processes
+    (and later runs of the same one) can use them.
+    """
+
+    def __init__(
+        self,
+        ttls: Mapping[str, float] = DEFAULT_TTLS,
+        directory: Optional[str] = None,
+        max_entries: int = 1000,
+    ) -> None:
+        self.ttls = dict(ttls)
+        self.directory = os.path.abspath(os.path.expanduser(directory)) if directory else None
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        # Keyed by `key`, in order of use; each entry has its resource.
+        self._entries: "OrderedDict[str, Tuple[str, CachedResponse]]" = OrderedDict()
+
+    @staticmethod
+    def key(site: str, email: str, url: str, request: Mapping[str, str]) -> str:
+        # Responses depend on who asks, so the user is part of the key.
+        return json.dumps([site, email, url, sorted(request.items())])
+
+    def ttl(self, endpoint: str) -> Optional[float]:
+        """How long responses from `endpoint` are cached, or None if
+        they aren't."""
+        return self.ttls.get(endpoint)
+
+    def _path(self, resource: str, key: str) -> str:
+        assert self.directory is not None
+        digest = hashlib.sha256(key.encode()).hexdigest()[:32]
+        return os.path.join(self.directory, f"{resource}-{digest}.json")
+
+    def get(self, endpoint: str, key: str) -> Optional[CachedResponse]:
+        """Returns the cached response for `key`, even if it has
+        expired, so that it can be revalidated."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                return entry[1]
+        if self.directory is None:
+            return None
+
+        resource = resource_name(endpoint)
+        try:
+            with open(self._path(resource, key)) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if data.get("key") != key:
+            return None
+        response = CachedResponse(
+            data["body"], data["expires_at"], data.get("etag"), data.get("last_modified")
+        )
+        self._remember(resource, key, response)
+        return response
+
+    def set(self, endpoint: str, key: str, response: CachedResponse) -> None:
+        resource = resource_name(endpoint)
+        self._remember(resource, key, response)
+        if self.directory is None:
+            return
+        data = {"key": key, **response._asdict()}
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            # As in ServerSettingsCache, rename the file into place so
+            # that concurrent processes never see a partial file.
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix=".", suffix=".tmp")
+            with os.fdopen(fd, "w") as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self._path(resource, key))
+        except OSError:
+            logger.warning("Could not write response cache in %s", self.directory)
+
+    def _remember(self, resource: str, key: str, response: CachedResponse) -> None:
+        with self._lock:
+            self._entries[key] = (resource, response)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, endpoint: str) -> None:
+        """Forgets the cached responses a request to `endpoint` may
+        have changed."""
+        resource = resource_name(endpoint)
+        resources = {resource, *_RELATED_RESOURCES.get(resource, ())}
+        with self._lock:
+            for key in [key for key, entry in self._entries.items() if entry[0] in resources]:
+                del self._entries[key]
+        if self.directory is None:
+            return
+        for name in resources:
+            for path in glob.glob(os.path.join(glob.escape(self.directory), f"{name}-*.json")):
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(path)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+        if self.directory is None:
+            return
+        for path in glob.glob(os.path.join(glob.escape(self.directory), "*.json")):
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(path)
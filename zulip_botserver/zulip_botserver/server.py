@@ -146,6 +146,7 @@ def load_bot_handlers(
             email=bots_config[bot]["email"],
             api_key=bots_config[bot]["key"],
             site=bots_config[bot]["site"],
+            share_connections=True,
         )
         bot_file = bot_lib_modules[bot].__file__
         assert bot_file is not None